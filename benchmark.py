@@ -0,0 +1,853 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+"""
+性能测试
+python benchmark.py            #运行所有的性能测试
+python benchmark.py tidlink    #运行指定的性能测试
+"""
+import sys
+from timeit import default_timer as timer
+from collections import OrderedDict
+
+benchmarks = OrderedDict()
+
+#----------------------------------------------------------------------
+def benchmark(name):
+    """注册一个性能测试"""
+    def inner(func):
+        benchmarks[name] = func
+        return func
+    return inner
+
+#----------------------------------------------------------------------
+def timeit(func,number):
+    """执行number次func，返回单次执行的平均时间(微秒)"""
+    start = timer()
+    for i in xrange(number):
+        func(i)
+    return (timer() - start)/number*1e6
+
+#----------------------------------------------------------------------
+@benchmark("tidlink")
+def bench_tidlink():
+    """挑战者-响应映射表的查找时间，在不同数量的等待回复的请求下应保持不变，
+    所有位置都在等待回复时，被覆盖的请求也要按超时处理
+    """
+    from dht_tracker.common import TidLink
+    class SmallLink(TidLink):
+        _max_length = 512
+    timeouts = []
+    tidlink = SmallLink()
+    tidlink.on_timeout = timeouts.append
+    tiditer = iter(tidlink)
+    tiditer.next()
+    for i in xrange(1000):
+        tiditer.send(("ping","ping",None,("127.0.0.1",i)))
+    #迭代器在每次写入后已经分配好下一个位置，这个位置上的请求也已经按超时处理
+    assert len(timeouts) == tidlink.overwritten == 1000 - len(tidlink) == 489,(len(timeouts),tidlink.overwritten)
+    assert timeouts[0][3] == ("127.0.0.1",0)
+    print "tidlink overwritten=%d timeouts=%d"%(tidlink.overwritten,len(timeouts))
+    for outstanding in (1024,4096,16384,65536):
+        tidlink = TidLink()
+        tiditer = iter(tidlink)
+        tid = tiditer.next()
+        for i in xrange(outstanding):
+            tid = tiditer.send(("ping","ping",None,("127.0.0.1",i)))
+        cost = timeit(lambda i:tidlink[i%outstanding],100000)
+        print "tidlink outstanding=%-6d lookup=%.3fus"%(outstanding,cost)
+
+#----------------------------------------------------------------------
+@benchmark("timewheel")
+def bench_timewheel():
+    """时间轮的超时检查：信息不能在添加时间+超时时间之前超时，超过之后的一个刻度后必须超时"""
+    from time import time
+    from random import Random
+    from dht_tracker.common import TimeWheel
+    rand = Random(6883)
+    base = float(int(time()) + 1000)
+    for tick in (1,0.5):
+        wheel = TimeWheel(tick,64)
+        wheel.advance(base + 0.05)
+        wheel.add("edge",None,1,now=base + 0.95)
+        assert not wheel.advance(base + 1.10),"expired before its deadline"
+        assert wheel.advance(base + 2.0) == [("edge",None)]
+        deadlines = {}
+        now = base + 1000
+        for i in xrange(20000):
+            last,now = now,now + rand.random()*tick
+            if rand.random() < 0.5:
+                timeout = rand.choice((tick,2*tick,rand.uniform(0.01,10)))
+                wheel.add(i,None,timeout,now=now)
+                deadlines[i] = now + timeout
+            for key,data in wheel.advance(now):
+                assert deadlines[key] <= now and last < deadlines[key] + tick,(key,deadlines[key],now)
+                del deadlines[key]
+    print "timewheel deadline check ok"
+
+#----------------------------------------------------------------------
+@benchmark("tubes")
+def bench_tubes():
+    """任务管道通过id获取任务的时间，以及一次移除一半任务的时间"""
+    from dht_tracker.common import Tubes
+    for number in (1000,10000,50000):
+        tubes = Tubes()
+        ids = ["%020d"%i for i in xrange(number)]
+        for id in ids:
+            tubes.push(id)
+        cost = timeit(lambda i:tubes[ids[i%number]],100000)
+        for id in ids[::2]:
+            tubes.remove(id)
+        start = timer()
+        removed = tubes.resize()
+        print "tubes tasks=%-6d lookup=%.3fus resize(removed=%d)=%.1fms"%(number,cost,removed,(timer() - start)*1e3)
+
+#----------------------------------------------------------------------
+def lookup_network(number,k = 8):
+    """模拟一个有number个节点的DHT网络，
+    每个节点的路由表在第一次被请求时生成(每个K桶随机k个节点)，回复路由表中与target最近的k个节点
+    Returns:
+        (nodes,reply)
+            nodes: [(nid,addr),...]
+            reply: reply(item,target) -> [(nid,addr),...]
+    """
+    from random import Random
+    rand = Random(6884)
+    nodes = [("".join(chr(rand.randint(0,255)) for j in xrange(20)),("10.0.%d.%d"%(i/256,i%256),6881)) for i in xrange(number)]
+    ints = dict((node,int(node[0].encode("hex"),16)) for node in nodes)
+    tables = {}
+    def reply(item,target):
+        if item not in tables:
+            buckets = {}
+            for node in nodes:
+                if node != item:
+                    buckets.setdefault((ints[node] ^ ints[item]).bit_length(),[]).append(node)
+            tables[item] = sum([rand.sample(bucket,min(k,len(bucket))) for bucket in buckets.itervalues()],[])
+        target = int(target.encode("hex"),16)
+        return sorted(tables[item],key=lambda node:ints[node] ^ target)[:k]
+    return nodes,reply
+
+#----------------------------------------------------------------------
+@benchmark("lookup")
+def bench_lookup():
+    """解析一个infohash(找到最近的k个节点)需要的请求次数，随机请求与由近到远的迭代查找对比"""
+    from random import Random
+    from dht_tracker.common import Task,LookupTask
+    rand = Random(6885)
+    nodes,reply = lookup_network(5000)
+    ints = lambda nid,target:int(nid.encode("hex"),16) ^ int(target.encode("hex"),16)
+    for name,task_class in (("random",Task),("lookup",LookupTask)):
+        queries,found = [],0
+        for i in xrange(20):
+            target = "".join(chr(rand.randint(0,255)) for j in xrange(20))
+            closest = set(sorted(nodes,key=lambda node:ints(node[0],target))[:8])
+            task = task_class(target)
+            for node in rand.sample(nodes,8):
+                task.put(node)
+            queried,sent = set(),0
+            while sent < 3000:
+                item = task.get()
+                if item is None:
+                    if task_class is Task or not task.inflight:break
+                    for item in list(task._inflight):
+                        task.done(item)
+                        for node in reply(item,target):task.put(node)
+                    continue
+                queried.add(item)
+                sent += 1
+                if task_class is Task:
+                    for node in reply(item,target):task.put(node)
+                    if closest <= queried:break
+            queries.append(sent)
+            found += len(closest & queried)
+        print "lookup %-6s queries/infohash=%-6.0f closest found=%.0f%%"%(name,sum(queries)/float(len(queries)),found/1.6)
+
+#----------------------------------------------------------------------
+@benchmark("selffill")
+def bench_selffill():
+    """寻找自己的节点(填充路由表)的任务，查找任务在最近的k个节点回复后就会停止，
+    普通任务持续请求新的节点，直到发现的节点数量超过MIN_STOP_TABLE_LENGTH
+    """
+    from random import Random
+    from dht_tracker.common import Task,LookupTask
+    from dht_tracker.config import MIN_STOP_TABLE_LENGTH
+    rand = Random(6887)
+    nodes,reply = lookup_network(5000)
+    nid = "".join(chr(rand.randint(0,255)) for j in xrange(20))
+    for task_class in (LookupTask,Task):
+        task = task_class(nid)
+        for node in rand.sample(nodes,8):
+            task.put(node)
+        known,sent = set(),0
+        while len(known) <= MIN_STOP_TABLE_LENGTH and sent < 20000:
+            item = task.get()
+            if item is None:
+                if task_class is Task or not task.inflight:break
+                for item in list(task._inflight):
+                    task.done(item)
+                    for node in reply(item,nid):
+                        known.add(node)
+                        task.put(node)
+                continue
+            sent += 1
+            if task_class is Task:
+                for node in reply(item,nid):
+                    known.add(node)
+                    task.put(node)
+        print "selffill %-10s queries=%-6d nodes found=%-6d filled=%s"%(task_class.__name__,sent,len(known),len(known) > MIN_STOP_TABLE_LENGTH)
+
+#----------------------------------------------------------------------
+def rss():
+    """当前进程占用的内存(字节)"""
+    import os
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+
+#----------------------------------------------------------------------
+def random_nodes(number,seed = 6886):
+    """生成number个随机节点(nid,ip,port)"""
+    from random import Random
+    rand = Random(seed)
+    return [("".join(chr(rand.randint(0,255)) for j in xrange(20)),"10.%d.%d.%d"%(i>>16&255,i>>8&255,i&255),6881) for i in xrange(number)]
+
+#----------------------------------------------------------------------
+@benchmark("knode")
+def bench_knode():
+    """100000个KNode节点占用的内存"""
+    import gc
+    from dht_tracker.dht import KNode
+    items = random_nodes(100000)
+    gc.collect()
+    start = rss()
+    nodes = [KNode(nid,ip,port,5,900) for nid,ip,port in items]
+    gc.collect()
+    print "knode number=%d memory=%.0f bytes/node"%(len(nodes),(rss() - start)/float(len(nodes)))
+
+#----------------------------------------------------------------------
+@benchmark("ktable")
+def bench_ktable():
+    """向路由表插入100000个节点的时间，以及查找节点和最近节点的时间"""
+    from dht_tracker.dht import KTable
+    items = random_nodes(100000)
+    table = KTable()
+    push = timeit(lambda i:table.push(items[i]),len(items))
+    index = timeit(lambda i:table._index(items[i%len(items)][0]),100000)
+    getitem = timeit(lambda i:table[items[i%len(items)][0]],100000)
+    find = timeit(lambda i:table.find_node2chrall(items[i%len(items)][0]),20000)
+    print "ktable nodes=%d buckets=%d push=%.2fus index=%.2fus getitem=%.2fus find_node=%.2fus"%(
+        len(table),table.length,push,index,getitem,find)
+
+#----------------------------------------------------------------------
+@benchmark("closest")
+def bench_closest():
+    """在10k-1M个节点的路由表中查找最近的16个节点的时间，
+    原来的按桶拼接(不是真正最近的节点)、纯Python查找、numpy数组索引查找对比
+    """
+    from random import Random
+    from dht_tracker.dht import KTable
+    from dht_tracker.config import RETURN_NODE_MAX_LENGTH
+    rand = Random(6887)
+    def concat(table,target):
+        index = table._index(target)
+        nodes = []
+        while len(nodes) < RETURN_NODE_MAX_LENGTH and index < len(table.buckets):
+            nodes += table.buckets[index].nodes
+            index += 1
+        return nodes
+    for number in (10000,100000,1000000):
+        #桶的容量足够大，所有的节点都可以进入路由表
+        table = KTable()
+        table._k = number
+        for item in random_nodes(number):
+            table.push(item)
+        calls = max(5,2000000/number)
+        targets = ["".join(chr(rand.randint(0,255)) for j in xrange(20)) for i in xrange(calls)]
+        nindex = table._nindex
+        costs = [timeit(lambda i:concat(table,targets[i]),calls)]
+        table._nindex = None
+        costs.append(timeit(lambda i:table._find_node(targets[i]),calls))
+        table._nindex = nindex
+        if nindex is not None:
+            costs.append(timeit(lambda i:nindex.closest(targets[i],RETURN_NODE_MAX_LENGTH),calls))
+        print "closest nodes=%-7d buckets=%-3d concat=%.0fus python=%.0fus numpy=%s"%(
+            len(table),table.length,costs[0],costs[1],"%.0fus"%costs[2] if nindex is not None else "-")
+
+#----------------------------------------------------------------------
+@benchmark("check")
+def bench_check():
+    """在不同数量节点的路由表中取出需要检测的节点的时间，
+    原来遍历所有节点与时间轮对比，每次约有1/16的节点到了检测时间
+    """
+    from time import time
+    from dht_tracker.dht import KTable
+    for number in (1000,10000,100000):
+        table = KTable()
+        table._k = number
+        for item in random_nodes(number):
+            table.push(item)
+        #节点的检测时间只会推后，时间轮中的时间第一次取出时按节点新的检测时间重新加入
+        now = time() + table._timeout
+        for i,node in enumerate(table.nodes):
+            node._utime = now + i%16 + 1
+        table.need_check(now)
+        scan = timeit(lambda i:[node for bucket in table.buckets for node in bucket if node.need_check],10)
+        due = 0
+        start = timer()
+        for i in xrange(16):
+            due += len(table.need_check(now + i + 1))
+        wheel = (timer() - start)/16*1e6
+        idle = timeit(lambda i:table.need_check(now + 16),100)
+        print "check nodes=%-7d due=%-6d scan=%.0fus wheel=%.0fus wheel_idle=%.1fus"%(len(table),due/16,scan,wheel,idle)
+
+#----------------------------------------------------------------------
+@benchmark("churn")
+def bench_churn():
+    """路由表中一半的节点下线后，每轮检测所有节点(下线的节点失误)，
+    之后两轮检测之间只见到少量的新节点，对比有无替换缓存时路由表中在线节点的比例
+    """
+    from random import Random
+    from dht_tracker.dht import KTable,KBucket
+    items = random_nodes(20000)
+    for length in (0,KBucket._cache_length):
+        KBucket._cache_length = length
+        rand = Random(6889)
+        table = KTable()
+        for item in items[:10000]:
+            table.push(item)
+        dead = set(rand.sample(table.nodes,len(table)//2))
+        dead = set(node.nid for node in dead)
+        rates = []
+        for rounds in xrange(4):
+            for item in rand.sample(items[10000:],20):
+                table.push(item)
+            for node in table.nodes:
+                if node.nid in dead:
+                    table.miss(node.nid,node.addr)
+                else:
+                    node.update()
+            nodes = table.nodes
+            rates.append(sum(1 for node in nodes if node.nid not in dead)*100.0/len(nodes))
+        print "churn cache=%d live=%s"%(length," ".join("%.0f%%"%rate for rate in rates))
+    KBucket._cache_length = length
+
+#----------------------------------------------------------------------
+@benchmark("snapshot")
+def bench_snapshot():
+    """100000个节点的路由表保存快照、读取快照文件和恢复路由表的时间"""
+    import os
+    import shutil
+    import tempfile
+    from dht_tracker.dht import KTable,_ksnapshot
+    table = KTable()
+    table._k = 100000
+    for item in random_nodes(100000):
+        table.push(item)
+    path = os.path.join(tempfile.mkdtemp(),"ktable.snapshot")
+    try:
+        start = timer()
+        data = table.snapshot()
+        dump = timer() - start
+        start = timer()
+        _ksnapshot.save(path,data)
+        save = timer() - start
+        start = timer()
+        nid,records = _ksnapshot.load(path)
+        load = timer() - start
+        restored = KTable()
+        restored._k = table._k
+        start = timer()
+        restored.restore(records)
+        restore = timer() - start
+        print "snapshot nodes=%d size=%dKB dump=%.0fms save=%.0fms load=%.0fms restore=%.0fms restored=%d"%(
+            len(table),len(data)/1024,dump*1e3,save*1e3,load*1e3,restore*1e3,len(restored))
+    finally:
+        shutil.rmtree(os.path.dirname(path))
+
+#----------------------------------------------------------------------
+def policy_memory(policy,max_nodes,number,queue):
+    """在子进程中按策略向路由表插入number个随机节点，返回节点数量、桶数量、内存和插入时间"""
+    import gc
+    from random import Random
+    from dht_tracker.dht import KTable
+    rand = Random(6890)
+    table = KTable()
+    table._policy = policy
+    table._max_nodes = max_nodes
+    gc.collect()
+    start = rss()
+    begin = timer()
+    for i in xrange(number):
+        table.push((("%040x"%rand.getrandbits(160)).decode("hex"),"10.%d.%d.%d"%(i>>16&255,i>>8&255,i&255),6881))
+    elapsed = timer() - begin
+    gc.collect()
+    queue.put((len(table),table.length,rss() - start,elapsed/number*1e6))
+
+@benchmark("policy")
+def bench_policy():
+    """不同的桶容量策略和节点数量上限下，插入1000000个随机节点后路由表的节点数量和占用的内存"""
+    from multiprocessing import Process,Queue
+    for policy,max_nodes in (("standard",0),("relaxed",0),("unbounded",100000),("unbounded",0)):
+        queue = Queue()
+        process = Process(target=policy_memory,args=(policy,max_nodes,1000000,queue))
+        process.start()
+        nodes,buckets,memory,push = queue.get()
+        process.join()
+        print "policy %-9s max_nodes=%-6d nodes=%-7d buckets=%-3d memory=%.1fMB push=%.1fus"%(
+            policy,max_nodes,nodes,buckets,memory/1048576.0,push)
+
+#----------------------------------------------------------------------
+@benchmark("pool")
+def bench_pool():
+    """向1000000容量的节点池加入2000000个节点(8个一组，与find_node回复相同)的时间、
+    随机取出节点的时间和每个节点占用的内存
+    """
+    import gc
+    from random import Random
+    from dht_tracker.dht._kpool import NodePool
+    rand = Random(6891)
+    pool = NodePool(1000000)
+    gc.collect()
+    start = rss()
+    number = 2000000
+    begin = timer()
+    for i in xrange(0,number,8):
+        pool.add_nodes(("%0416x"%rand.getrandbits(1664)).decode("hex"))
+    add = (timer() - begin)/number*1e6
+    gc.collect()
+    memory = rss() - start
+    pick = timeit(lambda i:pool.pick(16),10000)/16
+    print "pool nodes=%d evicted=%d add=%.2fus pick=%.2fus memory=%.0f bytes/node"%(
+        len(pool),pool.status["evicted"],add,pick,memory/float(len(pool)))
+
+#----------------------------------------------------------------------
+@benchmark("refresh")
+def bench_refresh():
+    """模拟运行4个小时，路由表中的节点随机向我们发送请求，
+    对比有无被动刷新时检测发送的ping次数，以及被动刷新的时间
+    """
+    from random import Random
+    from time import time
+    from dht_tracker.dht import KTable
+    from dht_tracker.config import NODE_CHECK_INTERVAL_TIME
+    items = random_nodes(20000)
+    for queries in (0,50,200):
+        rand = Random(6892)
+        table = KTable()
+        table._k = 64
+        for item in items:
+            table.push(item)
+        nodes = table.nodes
+        now = time()
+        pings = refreshed = 0
+        for step in xrange(int(4*3600/NODE_CHECK_INTERVAL_TIME)):
+            now += NODE_CHECK_INTERVAL_TIME
+            for node in rand.sample(nodes,min(queries,len(nodes))):
+                refreshed += bool(table.refresh(node.nid,node.addr,now))
+            due = table.need_check(now)
+            pings += len(due)
+            for node in due:
+                node.update(now)
+        print "refresh queries/interval=%-4d nodes=%d pings=%-5d refreshed=%-5d avoided=%d"%(
+            queries,len(table),pings,refreshed,table.avoided)
+    node = nodes[0]
+    cost = timeit(lambda i:table.refresh(node.nid,node.addr),100000)
+    print "refresh call=%.2fus"%cost
+
+#----------------------------------------------------------------------
+@benchmark("count")
+def bench_count():
+    """@count装饰的空函数和incr的单次时间，模拟运行不同天数后统计树的序列化大小和/count查询的时间"""
+    import cPickle
+    from time import time
+    from dht_tracker.common import CountTree,count,incr,tick
+    tree = CountTree()
+    @count(tree,"recv","q","ping")
+    def on_ping():
+        pass
+    def noop():
+        pass
+    base = timeit(lambda i:noop(),200000)
+    decorated = timeit(lambda i:on_ping(),200000) - base
+    dynamic = timeit(lambda i:incr(tree,"drop","utp"),200000)
+    print "count decorator=%.2fus incr=%.2fus total=%d"%(decorated,dynamic,tree["recv"].count)
+    paths = [("recv","q",name) for name in ("ping","find_node","get_peers","announce_peer")]
+    paths += [("send",name) for name in ("ping","find_node","get_peers")]
+    start = time()
+    tree = CountTree()
+    minute = 0
+    for days in (1,7,30,90):
+        while minute < days*1440:
+            tick(start + minute*60)
+            for path in paths:
+                incr(tree,*path)
+            minute += 1
+        size = len(cPickle.dumps(tree,2))
+        query = timeit(lambda i:tree["recv"]["q"]["ping"].status,100)
+        root = timeit(lambda i:tree.count,10000)
+        print "count days=%-3d pickle=%-6d status=%.0fus root.count=%.2fus total=%d"%(
+            days,size,query,root,tree.count)
+    tick()
+
+#----------------------------------------------------------------------
+def query_state(tasks):
+    """统计树(7天的数据)和任务队列(一个2000个节点的ping任务和tasks个查找任务)"""
+    import os
+    from time import time
+    from dht_tracker.common import CountTree,TaskLine,LookupTask,incr,tick
+    tree = CountTree()
+    paths = [("recv","q",name) for name in ("ping","find_node","get_peers","announce_peer")]
+    paths += [("send",name) for name in ("ping","find_node","get_peers")]
+    start = time() - 7*86400
+    for minute in xrange(7*1440):
+        tick(start + minute*60)
+        for path in paths:
+            incr(tree,*path)
+    tick()
+    taskline = TaskLine()
+    taskline.settube("get_peers",LookupTask)
+    taskline.push("ping","ping")
+    for i in xrange(2000):
+        taskline["ping"]["ping"].put((os.urandom(20),("10.0.%d.%d"%(i>>8,i&255),6881)))
+    for i in xrange(tasks):
+        id = os.urandom(20)
+        taskline.push("get_peers",id)
+        task = taskline["get_peers"][id]
+        for j in xrange(64):
+            task.put((os.urandom(20),("10.1.%d.%d"%(j,i&255),6881)))
+    return tree,taskline
+
+@benchmark("rpc")
+def bench_rpc():
+    """web进程按需查询的单次往返时间和回复的字节数，与状态的大小(任务数量)无关"""
+    import threading
+    from multiprocessing import Pipe
+    from dht_tracker.common import RPCClient,RPCServer
+    class Handler(object):
+        def query_count(self,*path):
+            res = tree
+            for key in path:
+                res = res[key]
+            return res.status
+        def query_task(self,tubes,id):
+            return taskline[tubes][id].status
+    server_conn,client_conn = Pipe()
+    server = RPCServer(server_conn,Handler())
+    client = RPCClient(client_conn)
+    def serve():
+        from select import select
+        fileno = server.fileno()
+        while 1:
+            readable,writable,_ = select([fileno],[fileno] if server.pending else [],[])
+            try:
+                if writable:
+                    server.flush()
+                if readable:
+                    server.answer()
+            except EOFError:
+                break
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    for tasks in (10,100,1000):
+        tree,taskline = query_state(tasks)
+        id = taskline["get_peers"].tubes[0].id
+        queries,sent = server.status["queries"],server.status["bytes"]
+        task = timeit(lambda i:client.call("task","get_peers",id),1000)
+        size = (server.status["bytes"] - sent)//(server.status["queries"] - queries)
+        counter = timeit(lambda i:client.call("count","recv","q","ping"),200)
+        print "rpc tasks=%-5d task=%.0fus(%d bytes) count=%.0fus"%(tasks,task,size,counter)
+    client_conn.close()
+
+def control_server(port,beat = None):
+    """只回答查询和执行任务控制命令的DHT进程
+    Args:
+        beat: multiprocessing.Value，DHT进程每10毫秒写入一次当前时间，用来检查进程是否被阻塞
+    """
+    import gevent
+    from time import time
+    from dht_tracker.dht import NormalDHT
+    dht = NormalDHT(port)
+    def heartbeat():
+        while 1:
+            beat.value = time()
+            gevent.sleep(0.01)
+    greenlets = [gevent.spawn(dht.auto_answer_query),gevent.spawn(dht.auto_check_task)]
+    if beat is not None:
+        greenlets.append(gevent.spawn(heartbeat))
+    gevent.joinall(greenlets)
+
+@benchmark("control")
+def bench_control():
+    """通过查询管道提交10万个get_peers任务的吞吐量，逐个提交与批量提交对比，每个命令都有结果，
+    格式错误的命令(查询管道和任务控制管道)只返回invalid，不影响同一批的其他命令，
+    web进程查询超时后不再读取大的回复时，DHT进程不会被阻塞
+    """
+    import os
+    from time import time,sleep
+    from collections import Counter
+    from multiprocessing import Process,Value
+    from dht_tracker.common import RPCClient,query_client,control_in,RPCError
+    from dht_tracker.config import CONTROL_BATCH_SIZE
+    query = RPCClient(query_client)
+    beat = Value("d",0)
+    server = Process(target=control_server,args=(16910,beat))
+    server.daemon = True
+    server.start()
+    query._timeout = 30
+    query.call("pacer")
+    good = os.urandom(20)
+    malformed = [("push",("get_peers","")),("push",(["get_peers"],good)),("push",("get_peers",u"\u4e2d"*20)),
+        ("push",("unknown",good)),("jump",("get_peers",good)),("push",),("push",("get_peers",good))]
+    assert query.call("control",malformed) == ["invalid"]*6 + ["ok"],"malformed commands"
+    control_in.send(malformed[:-1] + [("push",("get_peers",good[::-1]))])
+    control_in.send(("push",(None,None)))
+    control_in.send(("push",("get_peers",good[1:]+good[:1])))
+    deadline = timer() + 5
+    while query.call("task","get_peers",good[1:]+good[:1]) is None:
+        assert timer() < deadline,"control pipe stalled by malformed commands"
+    assert query.call("task","get_peers",good[::-1]) is not None
+    print "control malformed commands ok"
+    number = 100000
+    single = 5000
+    start = timer()
+    results = [query.call("control",[("push",("get_peers",os.urandom(20)))])[0] for i in xrange(single)]
+    cost = timer() - start
+    print "control single tasks=%d %.0f tasks/s %s"%(single,single/cost,dict(Counter(results)))
+    for batch in (100,CONTROL_BATCH_SIZE,10000):
+        commands = [("push",("get_peers",os.urandom(20))) for i in xrange(number)]
+        start = timer()
+        results = []
+        for offset in xrange(0,number,batch):
+            results += query.call("control",commands[offset:offset+batch])
+        cost = timer() - start
+        print "control batch=%-5d tasks=%d %.2fs %.0f tasks/s %s"%(
+            batch,number,cost,number/cost,dict(Counter(results)))
+    query._timeout = 0.01
+    try:
+        query.call("task","get_peers")
+    except RPCError:
+        pass
+    assert query._conn.poll(30),"no reply"
+    sleep(1)
+    lag = time() - beat.value
+    assert lag < 0.5,"DHT process stalled %.2fs by an unread reply"%lag
+    query._timeout = 30
+    start = timer()
+    query.call("pacer")
+    print "control unread reply: heartbeat lag=%.3fs next query=%.2fs(skips the stale reply)"%(lag,timer() - start)
+    web_queries(16911)
+    server.terminate()
+
+def web_queries(port):
+    """web进程在IOLoop中查询：多个查询同时等待回复，大的查询超时返回503时IOLoop不被阻塞，
+    之后的查询跳过迟到的回复
+    """
+    from tornado import gen
+    from tornado.ioloop import IOLoop,PeriodicCallback
+    from tornado.httpclient import AsyncHTTPClient
+    from dht_tracker.web import application
+    application.listen(port)
+    url = "http://127.0.0.1:%d"%port
+    gaps = [timer(),0]
+    def tick():
+        now = timer()
+        gaps[1] = max(gaps[1],now - gaps[0])
+        gaps[0] = now
+    @gen.coroutine
+    def fetch():
+        http = AsyncHTTPClient()
+        start = timer()
+        responses = yield [http.fetch(url + "/pacer",raise_error=False) for i in xrange(50)]
+        assert set(response.code for response in responses) == set([200]),"concurrent queries"
+        concurrent = timer() - start
+        start = timer()
+        task = yield http.fetch(url + "/task?tubes=get_peers",raise_error=False)
+        task = (task.code,timer() - start)
+        start = timer()
+        while 1:
+            pacer = yield http.fetch(url + "/pacer",raise_error=False)
+            if pacer.code == 200:
+                break
+            assert timer() - start < 60,"query pipe stalled"
+        raise gen.Return((concurrent,) + task + (timer() - start,))
+    ticker = PeriodicCallback(tick,10)
+    ticker.start()
+    res = IOLoop.current().run_sync(fetch,timeout=120)
+    ticker.stop()
+    print "control web 50 concurrent /pacer=%.2fs /task=%d %.2fs next /pacer=%.2fs ioloop max gap=%.3fs"%(
+        res + (gaps[1],))
+
+#----------------------------------------------------------------------
+def krpc_corpus():
+    """各种结构的KRPC信息"""
+    from random import Random
+    rand = Random(6881)
+    rstr = lambda n:"".join(chr(rand.randint(0,255)) for i in xrange(n))
+    corpus = []
+    for i in xrange(200):
+        t,nid,target = rstr(2),rstr(20),rstr(20)
+        corpus += [
+            {"t":t,"y":"q","q":"ping","a":{"id":nid}},
+            {"t":t,"y":"q","q":"find_node","a":{"id":nid,"target":target}},
+            {"t":t,"y":"q","q":"get_peers","a":{"id":nid,"info_hash":target},"v":"UT\x01\x02"},
+            {"t":t,"y":"q","q":"announce_peer","a":{"id":nid,"info_hash":target,"port":6881,"token":rstr(8),"implied_port":1}},
+            {"t":t,"y":"r","r":{"id":nid}},
+            {"t":t,"y":"r","r":{"id":nid,"nodes":rstr(26*8)},"ip":rstr(6)},
+            {"t":t,"y":"r","r":{"id":nid,"token":rstr(8),"values":[rstr(6) for j in xrange(rand.randint(1,50))]}},
+            {"t":t,"y":"e","e":[rand.choice((201,202,203,204)),"Server Error"]},
+            {"t":t,"y":"q","q":"sample_infohashes","a":{"id":nid,"target":target,"x-unknown":-i}},
+        ]
+    return corpus
+
+#----------------------------------------------------------------------
+def krpc_conformance():
+    """KRPC专用编解码与通用bencode编解码的一致性检查
+    合法的信息编解码结果必须一致，不合法的信息专用解码只能更严格
+    """
+    from random import Random
+    from dht_tracker.common import bdumps,bloads,kdumps,kloads
+    rand = Random(6882)
+    for msg in krpc_corpus():
+        data = bdumps(msg)
+        assert kdumps(msg) == data,msg
+        assert kloads(data) == msg == bloads(data),msg
+        for i in xrange(4):
+            index = rand.randrange(len(data))
+            broken = [data[:index],data[:index]+chr(rand.randint(0,255))+data[index+1:],data+"e"]
+            for item in broken:
+                res = kloads(item)
+                assert res is None or res == bloads(item),repr(item)
+    for msg in ({"t":"aa","y":"r","r":{"id":True}},{"t":"aa","y":"r","r":{"id":{"a":"b"}}},
+                {"t":"aa","y":"q","q":"ping","a":{"id":["a",1]}},
+                {"t":"aa","y":"q","q":1,"a":{}},{"t":1,"y":"r","r":{}},{"t":"aa","y":"r","r":{"id":2**70}}):
+        assert kdumps(msg) == bdumps(msg),msg
+    for item in ("","de","d1:t2:aae","d1:t02:aae","d1:ti-0ee","d1:ti03ee","d1:t2:aa","l1:te","i1e","d1:dd1:dd1:ddeeee"):
+        res = kloads(item)
+        assert res is None or res == bloads(item),repr(item)
+    print "krpc codec conformance ok"
+
+#----------------------------------------------------------------------
+@benchmark("codec")
+def bench_codec():
+    """KRPC信息编解码的吞吐量(条/秒)"""
+    from dht_tracker.common import bdumps,bloads,kdumps,kloads
+    krpc_conformance()
+    corpus = krpc_corpus()
+    datas = [bdumps(msg) for msg in corpus]
+    number = len(corpus)*20
+    for name,loads,dumps in (("bencode",bloads,bdumps),("krpc",kloads,kdumps)):
+        decode = timeit(lambda i:loads(datas[i%len(datas)]),number)
+        encode = timeit(lambda i:dumps(corpus[i%len(corpus)]),number)
+        print "codec %-8s decode=%8.0f msg/s encode=%8.0f msg/s"%(name,1e6/decode,1e6/encode)
+
+#----------------------------------------------------------------------
+@benchmark("prefilter")
+def bench_prefilter():
+    """预过滤对不同类型信息的处理时间，以及与完整解码的对比"""
+    from random import Random
+    from dht_tracker.common import bdumps,kloads
+    from dht_tracker.dht import KRPC
+    rand = Random(6883)
+    corpus = [bdumps(msg) for msg in krpc_corpus()]
+    #回复中能取出的t必须与解码后的t一致
+    for data in corpus:
+        if data.endswith("1:y1:re"):
+            t = KRPC._reply_tid(data)
+            assert t is None or t == kloads(data)["t"],repr(data)
+    server = KRPC(16910,None)
+    server.outstanding = lambda t:False
+    samples = {
+        "utp":["\x41\x01"+"".join(chr(rand.randint(0,255)) for j in xrange(30)) for i in xrange(64)],
+        "junk":["".join(chr(rand.randint(0,255)) for j in xrange(60)) for i in xrange(64)],
+        "stale":[data for data in corpus if data.endswith("1:y1:re")],
+        "query":[data for data in corpus if data.endswith("1:y1:qe")],
+    }
+    for name,datas in samples.iteritems():
+        reasons = set(server.prefilter(data) for data in datas)
+        cost = timeit(lambda i:server.prefilter(datas[i%len(datas)]),100000)
+        decode = timeit(lambda i:kloads(datas[i%len(datas)]),100000)
+        print "prefilter %-6s reasons=%-30s prefilter=%.3fus decode=%.3fus"%(name,",".join(map(str,reasons)),cost,decode)
+
+#----------------------------------------------------------------------
+@benchmark("pacer")
+def bench_pacer():
+    """500个get_peers任务下实际与目标的每秒发送次数，以及没有任务时的CPU占用"""
+    import os
+    import gevent
+    from dht_tracker.common import Task
+    from dht_tracker.dht import NormalDHT
+    dht = NormalDHT(16920)
+    dht.send_msg = lambda msg,addr:None
+    dht.taskline["find_node"][dht.nid].stop()
+    dht.taskline["ping"]["ping"].stop()
+    #查找任务收不到回复会停止发送，这里使用普通任务测试发送的速度
+    dht.taskline.settube("get_peers",Task)
+    worker = gevent.spawn(dht._task_start)
+    start,cpu = timer(),os.times()[0]
+    gevent.sleep(2)
+    print "pacer idle      sent=%-6d cpu=%.1f%%"%(dht._send_num,(os.times()[0] - cpu)/(timer() - start)*100)
+    for i in xrange(500):
+        task_id = "%020d"%i
+        dht.taskline.push("get_peers",task_id)
+        task = dht.taskline["get_peers"][task_id]
+        for j in xrange(1000):
+            task.put(("%020d"%j,("127.0.0.1",j+1)))
+    gevent.sleep(1)
+    sent,start,cpu = dht._send_num,timer(),os.times()[0]
+    gevent.sleep(3)
+    elapsed = timer() - start
+    print "pacer tasks=500 target=%d achieved=%.0f measured=%.0f packets/s cpu=%.1f%%"%(
+        dht.pacer.rate,dht.pacer.achieved,(dht._send_num - sent)/elapsed,(os.times()[0] - cpu)/elapsed*100)
+    worker.kill()
+
+#----------------------------------------------------------------------
+def udp_blast(port,number):
+    """向本地端口发送number个ping请求"""
+    import socket
+    from dht_tracker.common import kdumps
+    sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    datas = [kdumps({"t":chr(i%256)*2,"y":"q","q":"ping","a":{"id":"a"*20}}) for i in xrange(256)]
+    for i in xrange(number):
+        sock.sendto(datas[i%256],("127.0.0.1",port))
+
+#----------------------------------------------------------------------
+@benchmark("udp")
+def bench_udp():
+    """本地回环下KRPC逐个收发与批量收发每秒处理的数据包数量，
+    发送进程与服务端可能在同一个核上竞争，cpu为服务端每个CPU秒(单核)可以处理的数据包数量
+    """
+    import gevent
+    import socket
+    import resource
+    from multiprocessing import Process
+    from dht_tracker.dht import KRPC
+    number = 200000
+    for batch_io in (0,1):
+        stats = {"num":0,"first":0,"last":0}
+        def on_q(msg,addr):
+            stats["num"] += 1
+            stats["last"] = timer()
+            if stats["num"] == 1:stats["first"] = stats["last"]
+            server.send_data("d1:rd2:id20:aaaaaaaaaaaaaaaaaaaae1:t2:aa1:y1:re",addr)
+        server = KRPC(16900+batch_io,None)
+        server.batch_io = batch_io
+        server.add_handle("q",on_q)
+        server.start()
+        server.socket.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,8*1024*1024)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        sender = Process(target=udp_blast,args=(server.port,number))
+        sender.start()
+        while sender.is_alive() or timer() - stats["last"] < 1:
+            gevent.sleep(0.1)
+        sender.join()
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        server.stop()
+        pps = stats["num"]/((stats["last"] - stats["first"]) or 1)
+        cpu = end.ru_utime + end.ru_stime - usage.ru_utime - usage.ru_stime
+        print "udp batch_io=%d handled=%d/%d %.0f packets/s cpu=%.0f packets/cpu-s"%(
+            batch_io,stats["num"],number,pps,stats["num"]/(cpu or 1))
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or benchmarks.keys()
+    for name in names:
+        benchmarks[name]()
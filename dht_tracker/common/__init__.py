@@ -4,6 +4,7 @@ from __future__ import absolute_import
 from ._utils import Dict
 from ._utils import (
     ascii2l16,
+    nid2l16,
     bdumps,
     bloads,
     chr2ipv4,
@@ -12,11 +13,15 @@ from ._utils import (
     pack_node,
     unpack_nodes
 )
+from ._kcodec import kdumps,kloads
 from ._linklist import Node,Linklist
-from ._taskline import Task,Tubes,TaskLine
+from ._taskline import Task,LookupTask,Tubes,TaskLine
+from ._timewheel import TimeWheel
 from ._tidlink import TidLink
-from ._count import CountTree,count,reserve_time
-from ._communicate import sync,control_in,control_out
+from ._pacer import Bucket,Pacer
+from ._count import CountTree,count,incr,reserve_time,tick
+from ._rpc import RPCError,RPCClient,RPCStream,AsyncRPCClient,RPCServer
+from ._communicate import control_in,control_out,query_conn,query_client,query
 tidlink = TidLink()
 taskline = TaskLine()
 netcount = CountTree()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 #coding:utf-8
-from multiprocessing import Manager,Pipe
-#多进程信息同步字典
-sync = Manager().dict()
+from __future__ import absolute_import
+from multiprocessing import Pipe
+from ._rpc import AsyncRPCClient
 #任务控制管道
 control_out,control_in = Pipe(duplex=False)
+#查询管道，query_conn由DHT进程应答，query由web进程在IOLoop中发送查询(query_client可以用RPCClient阻塞地查询)
+query_conn,query_client = Pipe()
+query = AsyncRPCClient(query_client)
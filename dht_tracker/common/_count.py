@@ -5,26 +5,219 @@
 进行数据统计
 用树结构实现对数据的统计，父节点可通过递归获取所有子节点的所有数据统计之和
 count生成器，通过传入的参数进行惰性计算，缩短运行时的数据结构
+incr 对统计树下某个路径当前时间的统计加一
 reserve_time 对时间进行结构化
+tick 更新当前时间的分钟路径，每个统计路径缓存当前分钟的计数，
+    分钟路径变化之前每次统计只需要对计数加一，不需要每次格式化时间和逐层查找
+统计路径下的时间数据保存在固定长度的环形缓冲区中(分钟、小时、天三级)，
+分钟变化时将上一分钟的计数汇总到三级缓冲区和总数中，运行时间再长占用的内存也不会增加，
+超出保留时间的数据被覆盖，查询时按(年 月 日 时 分)的路径展开保留范围内的数据
 """
+from __future__ import absolute_import
+from array import array
+from datetime import date
 from functools import wraps
 from time import time,localtime,strftime
+from ..config import (
+    COUNT_KEEP_MINUTES,
+    COUNT_KEEP_HOURS,
+    COUNT_KEEP_DAYS
+)
+
+class Clock(object):
+    """当前时间的分钟路径
+    Attributes:
+        minute: (年,月,日,时,分)，由tick更新，只有分钟变化时才会替换为新的元组
+        stamp: 当前分钟的序号(本地时间从公元1年1月1日起的分钟数)
+    """
+    minute = None
+    stamp = 0
+
+def tick(now = None):
+    """更新当前时间的分钟路径，需要每秒调用一次
+    Args:
+        now: 当前时间，默认为time()
+    """
+    minute = tuple(reserve_time(now))
+    if minute != Clock.minute:
+        year,month,day,hour,mint = [int(i) for i in minute]
+        Clock.stamp = (date(year,month,day).toordinal()*24 + hour)*60 + mint
+        Clock.minute = minute
+
+def unstamp(stamp):
+    """分钟序号对应的(年 月 日 时 分)"""
+    day,mint = divmod(stamp,1440)
+    hour,mint = divmod(mint,60)
+    day = date.fromordinal(day)
+    return ("%04d"%day.year,"%02d"%day.month,"%02d"%day.day,"%02d"%hour,"%02d"%mint)
+
+
+class Ring(object):
+    """固定长度的环形计数缓冲区
+    Notes:
+        每个槽保存时间单位的序号和计数，写入时槽内的序号不一致说明是一圈之前的数据，直接覆盖
+    Attributes:
+        length: 槽的数量(保留的时间单位数量)
+        unit: 每个槽的时间单位(分钟)
+        add: 对某一分钟所在的时间单位增加计数
+        items: 保留范围内的(分钟序号,计数)
+    """
+
+    def __init__(self,length,unit):
+        """初始化一个空的环形缓冲区
+        Args:
+            length: 槽的数量
+            unit: 每个槽的时间单位(分钟)
+        """
+        self.length = length
+        self.unit = unit
+        self._keys = array("l",[-1])*length
+        self._counts = array("l",[0])*length
+
+    def add(self,stamp,num):
+        """对分钟序号stamp所在的时间单位增加计数
+        Args:
+            stamp: 分钟序号
+            num: 增加的计数
+        """
+        key = stamp // self.unit
+        slot = key % self.length
+        if self._keys[slot] != key:
+            self._keys[slot] = key
+            self._counts[slot] = 0
+        self._counts[slot] += num
+
+    def items(self,stamp,pending = None):
+        """截止到分钟序号stamp，保留范围内的计数
+        Args:
+            stamp: 截止的分钟序号
+            pending: (分钟序号,计数)，还没有写入缓冲区的计数
+        Returns:
+            [(分钟序号,计数),...]: 按时间排序，分钟序号为时间单位的起点
+        """
+        unit = self.unit
+        end = stamp // unit
+        start = end - self.length
+        counts = dict(
+            (key,num) for key,num in zip(self._keys,self._counts) if start < key <= end
+        )
+        if pending and pending[1]:
+            key = pending[0] // unit
+            if start < key <= end:
+                counts[key] = counts.get(key,0) + pending[1]
+        return [(key*unit,num) for key,num in sorted(counts.iteritems())]
+
+
+class TimeView(object):
+    """统计路径下按(年 月 日 时 分)展开的时间数据，接口与CountTree相同，供查询使用"""
+
+    def __init__(self):
+        """"""
+        self.count = 0
+        self._child = dict()
+
+    @property
+    def status(self):
+        """"""
+        return {
+            "count":self.count,
+            "detail":[(name,child.status) for name,child in sorted(self._child.iteritems())]
+        }
+
+    def get(self,key):
+        if key not in self._child:
+            self._child[key] = TimeView()
+        return self._child[key]
+
+    def __getitem__(self,key):
+        """"""
+        return self._child[key]
+
+    def __contains__(self,key):
+        """"""
+        return key in self._child
+
+
+class Series(object):
+    """统计路径的时间序列
+    Notes:
+        当前分钟的计数单独保存在current中，统计时只需要加一，
+        分钟变化后第一次统计时(roll)再汇总到分钟、小时、天三级缓冲区和总数中，
+        总数为汇总的总数加上当前分钟的计数，读取为O(1)
+    Attributes:
+        total: 累计的总数
+        roll: 将当前分钟的计数汇总，切换到新的分钟
+        view: 保留范围内的时间数据
+    """
+
+    def __init__(self):
+        """"""
+        self._minute = None
+        self._stamp = 0
+        self._current = 0
+        self._total = 0
+        self._rings = (
+            Ring(COUNT_KEEP_DAYS,1440),
+            Ring(COUNT_KEEP_HOURS,60),
+            Ring(COUNT_KEEP_MINUTES,1),
+        )
+
+    @property
+    def total(self):
+        """累计的总数"""
+        return self._total + self._current
+
+    def roll(self):
+        """将当前分钟的计数汇总到三级缓冲区和总数中，切换到Clock的当前分钟"""
+        if self._current:
+            for ring in self._rings:
+                ring.add(self._stamp,self._current)
+            self._total += self._current
+        self._current = 0
+        self._stamp = Clock.stamp
+        self._minute = Clock.minute
+
+    def view(self):
+        """保留范围内的时间数据
+        Notes:
+            年、月的计数为保留范围内的天数之和，
+            小时、分钟只展开在保留范围内的部分
+        Returns:
+            TimeView: 第一层为年
+        """
+        root = TimeView()
+        stamp = max(self._stamp,Clock.stamp)
+        pending = (self._stamp,self._current)
+        for depth,ring in enumerate(self._rings,3):
+            for start,num in ring.items(stamp,pending):
+                node = root
+                for key in unstamp(start)[:depth]:
+                    node = node.get(key)
+                    if depth == 3:
+                        node.count += num
+                if depth != 3:
+                    node.count = num
+        return root
+
+
 class CountTree(object):
     """"""
     def __init__(self):
         """Constructor"""
         self._child = dict()
-        self._count = 0
+        self._series = None
+    @property
+    def series(self):
+        """统计路径自己的时间序列，第一次使用时创建"""
+        if self._series is None:
+            self._series = Series()
+        return self._series
     @property
     def count(self):
-        if self._child:
-            return reduce(lambda x,y:x+y, [i.count for i in self._child.itervalues()])
-        else:
-            return self._count
-    @count.setter
-    def count(self,num):
-        """"""
-        self._count = num
+        total = self._series.total if self._series is not None else 0
+        for child in self._child.itervalues():
+            total += child.count
+        return total
     @property
     def status(self):
         """"""
@@ -32,15 +225,22 @@ class CountTree(object):
             "count":self.count,
         }
         res["detail"] = [(name,child.status) for name,child in self._child.iteritems()]
+        if self._series is not None:
+            res["detail"].extend(self._series.view().status["detail"])
         return res
-   
+
     def get(self,key):
         if key not in self._child:
             self._child[key] = CountTree()
-        return self._child[key]        
+        return self._child[key]
+
     #----------------------------------------------------------------------
     def __getitem__(self,key):
-        """"""
+        """统计路径的子节点，不是子节点时查找时间数据(年)"""
+        if key not in self._child and self._series is not None:
+            view = self._series.view()
+            if key in view:
+                return view[key]
         return self.get(key)
     def __call__(self,key):
         """"""
@@ -48,27 +248,48 @@ class CountTree(object):
     #----------------------------------------------------------------------
     def __contains__(self,key):
         """"""
-        return key in self._child
-        
+        if key in self._child:
+            return True
+        return self._series is not None and key in self._series.view()
+
 
 
 def count(cls,*args):
     """"""
     assert isinstance(cls,CountTree)
     for arg in args:
-        cls = cls[arg]    
+        cls = cls.get(arg)
+    series = cls.series
     def inner(func):
         @wraps(func)
         def wrapper(*args,**kwargs):
-            incls = cls
-            for key in reserve_time():
-                incls = incls[key]
-            incls.count+=1
+            if series._minute is not Clock.minute:
+                series.roll()
+            series._current += 1
             return func(*args,**kwargs)
         return wrapper
     return inner
 
+def incr(cls,*args,**kwargs):
+    """对统计树下args路径当前时间(年 月 日 时 分)的统计增加num
+    Args:
+        cls: 统计树
+        args: 统计的路径
+        num: 增加的计数，默认为1
+    """
+    for arg in args:
+        cls = cls.get(arg)
+    series = cls.series
+    if series._minute is not Clock.minute:
+        series.roll()
+    series._current += kwargs.get("num",1)
+
 #----------------------------------------------------------------------
-def reserve_time():
-    """"""
-    return strftime("%Y %m %d %H %M",localtime(time())).split(" ")
\ No newline at end of file
+def reserve_time(now = None):
+    """当前时间的(年 月 日 时 分)
+    Args:
+        now: 时间，默认为time()
+    """
+    return strftime("%Y %m %d %H %M",localtime(time() if now is None else now)).split(" ")
+
+tick()
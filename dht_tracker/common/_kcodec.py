@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+KRPC信息专用的bencode编解码
+KRPC的信息只有几种固定的结构:
+    {"t":str,"y":"q","q":str,"a":{"id":str,...}}
+    {"t":str,"y":"r","r":{"id":str,"nodes":str,"token":str,...}}
+    {"t":str,"y":"e","e":[int,str]}
+解码时先对长度、首尾字节进行检查，嵌套深度最多为 dict -> dict -> list，
+不合法的信息直接丢弃，
+编码时q,r信息的参数字典使用预先计算好的键前缀，各部分一次''.join拼接，
+参数的值只支持字符串、整数和字符串列表，不属于以上结构的信息使用通用的bencode编码
+kloads,kdumps与bloads,bdumps的接口相同，解码或编码失败都返回None
+"""
+from ._utils import bdumps
+from ..config import KRPC_MAX_LENGTH
+
+#KRPC参数字典常用键的编码前缀 键 -> "长度:键"
+_PREFIXES = dict((key,"%d:%s"%(len(key),key)) for key in (
+    "id","target","info_hash","nodes","nodes6","token","values",
+    "port","implied_port","want","samples","interval","num"
+))
+
+
+def _decode_int(msg,index):
+    """解码整数
+    Args:
+        msg: 需要解码的信息
+        index: 整数开始的位置
+    Returns:
+        (int,index): 解码后的整数和下一个值开始的位置
+    Raises:
+        ValueError: 整数格式不正确
+    """
+    end = msg.index("e",index)
+    number = int(msg[index+1:end])
+    if msg[index+1] == "-":
+        if msg[index+2] == "0":
+            raise ValueError
+    elif msg[index+1] == "0" and end != index+2:
+        raise ValueError
+    return number,end+1
+
+def _decode_list(msg,index,depth):
+    """解码列表，字符串在循环内直接解码
+    Args:
+        msg: 需要解码的信息
+        index: 列表开始的位置
+        depth: 还可以嵌套的深度
+    Returns:
+        (list,index): 解码后的列表和下一个值开始的位置
+    Raises:
+        ValueError: 列表格式不正确或者嵌套过深
+    """
+    res = []
+    index += 1
+    while 1:
+        char = msg[index]
+        if char == "e":
+            return res,index+1
+        if "0" <= char <= "9":
+            colon = msg.index(":",index)
+            if char == "0" and colon != index+1:
+                raise ValueError
+            end = colon+1+int(msg[index:colon])
+            res.append(msg[colon+1:end])
+            index = end
+        elif char == "i":
+            value,index = _decode_int(msg,index)
+            res.append(value)
+        elif depth and char == "l":
+            value,index = _decode_list(msg,index,depth-1)
+            res.append(value)
+        elif depth and char == "d":
+            value,index = _decode_dict(msg,index,depth-1)
+            res.append(value)
+        else:
+            raise ValueError
+
+def _decode_dict(msg,index,depth):
+    """解码字典，键值和字符串在循环内直接解码
+    Args:
+        msg: 需要解码的信息
+        index: 字典开始的位置
+        depth: 还可以嵌套的深度
+    Returns:
+        (dict,index): 解码后的字典和下一个值开始的位置
+    Raises:
+        ValueError: 字典格式不正确或者嵌套过深
+    """
+    res = {}
+    index += 1
+    while 1:
+        char = msg[index]
+        if char == "e":
+            return res,index+1
+        if not "0" <= char <= "9":
+            raise ValueError
+        colon = msg.index(":",index)
+        if char == "0" and colon != index+1:
+            raise ValueError
+        end = colon+1+int(msg[index:colon])
+        key = msg[colon+1:end]
+        index = end
+        char = msg[index]
+        if "0" <= char <= "9":
+            colon = msg.index(":",index)
+            if char == "0" and colon != index+1:
+                raise ValueError
+            end = colon+1+int(msg[index:colon])
+            res[key] = msg[colon+1:end]
+            index = end
+        elif char == "i":
+            res[key],index = _decode_int(msg,index)
+        elif depth and char == "l":
+            res[key],index = _decode_list(msg,index,depth-1)
+        elif depth and char == "d":
+            res[key],index = _decode_dict(msg,index,depth-1)
+        else:
+            raise ValueError
+
+def kloads(msg):
+    """将KRPC信息用bencode解码
+    长度超过KRPC_MAX_LENGTH、不是字典、嵌套过深的信息都会被丢弃
+    Args:
+        msg: 需要进行b解码的信息
+    Returns:
+        b解码后的信息(dict)
+        None: 信息不合法
+    """
+    if not msg or len(msg) > KRPC_MAX_LENGTH or msg[0] != "d" or msg[-1] != "e":
+        return None
+    try:
+        res,index = _decode_dict(msg,0,2)
+    except (ValueError,IndexError):
+        return None
+    if index == len(msg):
+        return res
+
+
+def _encode_args(args,parts):
+    """编码参数字典的内容(不包括首尾的d,e)，依次加入parts
+    Args:
+        args: 参数字典
+        parts: 编码结果的片段列表
+    Raises:
+        TypeError: 参数字典中包含不支持的类型
+    """
+    for key in sorted(args):
+        prefix = _PREFIXES.get(key)
+        if prefix is None:
+            if type(key) is not str:
+                raise TypeError
+            prefix = "%d:%s"%(len(key),key)
+        value = args[key]
+        if type(value) is str:
+            parts += (prefix,str(len(value)),":",value)
+        elif type(value) is int:
+            parts += (prefix,"i",str(value),"e")
+        elif type(value) is list:
+            parts += (prefix,"l")
+            for item in value:
+                if type(item) is not str:
+                    raise TypeError
+                parts += (str(len(item)),":",item)
+            parts.append("e")
+        else:
+            raise TypeError
+
+def kdumps(msg):
+    """将KRPC信息用bencode编码
+    q,r信息由参数字典的片段和固定的首尾拼接，e信息直接格式化，
+    其他的信息使用通用的bencode编码
+    Args:
+        msg: 需要进行b编码的信息
+    Returns:
+        b编码后的信息
+        None: 信息中包含不能编码的类型
+    """
+    if type(msg) is not dict:
+        return bdumps(msg)
+    y,t = msg.get("y"),msg.get("t")
+    if type(t) is not str:
+        return bdumps(msg)
+    try:
+        if y == "q" and len(msg) == 4:
+            q = msg["q"]
+            if type(q) is not str or type(msg["a"]) is not dict:
+                return bdumps(msg)
+            parts = ["d1:ad"]
+            _encode_args(msg["a"],parts)
+            parts += ("e1:q",str(len(q)),":",q,"1:t",str(len(t)),":",t,"1:y1:qe")
+            return "".join(parts)
+        if y == "r" and len(msg) == 3:
+            if type(msg["r"]) is not dict:
+                return bdumps(msg)
+            parts = ["d1:rd"]
+            _encode_args(msg["r"],parts)
+            parts += ("e1:t",str(len(t)),":",t,"1:y1:re")
+            return "".join(parts)
+    except (KeyError,TypeError):
+        return bdumps(msg)
+    if y == "e" and len(msg) == 3:
+        error = msg.get("e")
+        if (isinstance(error,(list,tuple)) and len(error) == 2
+            and type(error[0]) is int and type(error[1]) is str):
+            return "d1:eli%de%d:%se1:t%d:%s1:y1:ee"%(error[0],len(error[1]),error[1],len(t),t)
+    return bdumps(msg)
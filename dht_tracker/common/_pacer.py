@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+令牌桶发送节拍器
+全局令牌桶限制每秒发送的总次数，每个任务管道另有一个子令牌桶限制该管道能占用的比例，
+每次唤醒时按照可用的令牌一次发送一批，令牌不足或者没有需要发送的任务时休眠，
+同时统计实际每秒的发送次数，方便与目标值对比
+"""
+from time import time
+
+class Bucket(object):
+    """令牌桶
+    Attributes:
+        rate: 每秒补充的令牌数量
+        burst: 令牌桶的容量
+        tokens: 当前可用的令牌数量
+        refill: 按照经过的时间补充令牌
+        consume: 消耗令牌
+    """
+
+    def __init__(self,rate,burst,now = None):
+        """初始化一个装满的令牌桶
+        Args:
+            rate: 每秒补充的令牌数量
+            burst: 令牌桶的容量
+        """
+        self.rate = float(rate)
+        self.burst = max(float(burst),1.0)
+        self.tokens = self.burst
+        self._last = time() if now is None else now
+
+    def refill(self,now):
+        """按照经过的时间补充令牌，不超过令牌桶的容量"""
+        if now > self._last:
+            self.tokens = min(self.burst,self.tokens + (now - self._last)*self.rate)
+        self._last = now
+
+    def consume(self,num):
+        """消耗num个令牌"""
+        self.tokens -= num
+
+
+class Pacer(object):
+    """令牌桶发送节拍器
+    Notes:
+        子令牌桶的比例是上限而不是保证，各管道比例之和可以超过1，
+        总的发送次数始终受全局令牌桶限制，没有设置比例的管道比例为1
+    Attributes:
+        rate: 目标每秒发送次数
+        interval: 有任务发送时的唤醒间隔
+        idle: 没有任务发送时的唤醒间隔
+        achieved: 最近一个统计周期内实际每秒的发送次数
+        status: 节拍器的状态(目标与实际的每秒发送次数，各管道的令牌和发送次数)
+        refill: 补充全局和所有子令牌桶的令牌
+        available: 管道本次可以发送的次数
+        consume: 记录管道已经发送的次数
+        delay: 计算下一次唤醒前需要休眠的时间
+    """
+    _window = 1.0
+
+    def __init__(self,rate,interval,idle,shares = None):
+        """初始化节拍器，令牌桶的容量为两个唤醒间隔内的发送次数，用来吸收休眠时间的误差
+        Args:
+            rate: 目标每秒发送次数
+            interval: 有任务发送时的唤醒间隔(秒)
+            idle: 没有任务发送时的唤醒间隔(秒)
+            shares: 各管道占用全局发送次数的比例上限 {tubename:share}
+        """
+        self.rate = rate
+        self.interval = interval
+        self.idle = idle
+        self._shares = dict(shares or {})
+        self._global = Bucket(rate,rate*interval*2)
+        self._tubes = dict()
+        self._sent = dict()
+        self._window_start = time()
+        self._window_sent = 0
+        self._achieved = 0.0
+
+    def _tube(self,tubename):
+        """获取管道的子令牌桶，不存在则按照比例创建"""
+        bucket = self._tubes.get(tubename)
+        if bucket is None:
+            share = self._shares.get(tubename,1.0)
+            bucket = self._tubes[tubename] = Bucket(self.rate*share,self.rate*share*self.interval*2)
+            self._sent[tubename] = 0
+        return bucket
+
+    @property
+    def achieved(self):
+        """最近一个统计周期内实际每秒的发送次数"""
+        return self._achieved
+
+    @property
+    def status(self):
+        """节拍器的状态
+        Returns:
+            target: 目标每秒发送次数
+            achieved: 实际每秒发送次数
+            tokens: 全局可用的令牌数量
+            tubes: 各管道的比例、可用令牌数量和累计发送次数
+        """
+        return {
+            "target":self.rate,
+            "achieved":self._achieved,
+            "tokens":self._global.tokens,
+            "tubes":dict(
+                (name,{"share":self._shares.get(name,1.0),"tokens":bucket.tokens,"sent":self._sent[name]})
+                for name,bucket in self._tubes.iteritems()
+            )
+        }
+
+    def refill(self,now = None):
+        """补充全局和所有子令牌桶的令牌，并滚动实际发送次数的统计周期"""
+        now = time() if now is None else now
+        self._global.refill(now)
+        for bucket in self._tubes.itervalues():
+            bucket.refill(now)
+        elapsed = now - self._window_start
+        if elapsed >= self._window:
+            self._achieved = self._window_sent/elapsed
+            self._window_start = now
+            self._window_sent = 0
+
+    def available(self,tubename):
+        """管道本次可以发送的次数
+        Returns:
+            全局和子令牌桶中可用令牌数量的较小值(整数)
+        """
+        return max(int(min(self._global.tokens,self._tube(tubename).tokens)),0)
+
+    def consume(self,tubename,num):
+        """记录管道已经发送的次数，同时消耗全局和子令牌桶的令牌"""
+        if not num:return
+        self._global.consume(num)
+        self._tube(tubename).consume(num)
+        self._sent[tubename] += num
+        self._window_sent += num
+
+    def delay(self,sent):
+        """计算下一次唤醒前需要休眠的时间
+        Args:
+            sent: 本次唤醒发送的次数
+        Returns:
+            令牌不足: 补充一个令牌需要的时间(至少为interval)
+            没有发送: idle
+            其他: interval
+        """
+        if self._global.tokens < 1:
+            return max(self.interval,(1 - self._global.tokens)/float(self.rate))
+        if not sent:
+            return self.idle
+        return self.interval
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+web进程与DHT进程之间的查询
+web进程通过管道发送查询(统计树的一个路径、一个任务、路由表的一个桶等)，
+DHT进程只对查询到的部分进行编码后回复，编码的开销与查询的次数有关，与状态的大小无关
+请求: (序号,查询类型,参数)，使用marshal编码
+回复: 4字节序号 + (是否成功,结果或者错误信息)，结果使用marshal编码
+序号用来丢弃超时之后才到达的回复，迟到的回复不需要解码
+应答端和web进程的请求端都不阻塞地收发(与multiprocessing的Connection格式相同，4字节长度+数据)，
+请求端超时后不再读取时，没有发送完的回复留在缓冲区中，等管道可写时继续发送，
+应答端在此期间继续读取和回答查询，不会因为一个大的回复阻塞DHT进程，
+web进程在IOLoop中等待回复(详见AsyncRPCClient)，查询期间不会阻塞其他的请求
+"""
+from __future__ import absolute_import
+import errno
+import socket
+import marshal
+from struct import pack,unpack_from
+from timeit import default_timer as timer
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from ..config import RPC_TIMEOUT
+
+#每次从管道读取的最大字节数
+_RECV_SIZE = 65536
+#不阻塞的收发时表示暂时不能收发的错误
+_AGAIN = (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR)
+
+
+class RPCError(Exception):
+    """查询失败(超时、查询类型不存在或者查询出错)"""
+
+
+class RPCClient(object):
+    """阻塞的查询请求端，用于脚本和测试，web进程使用AsyncRPCClient
+    Attributes:
+        call: 发送查询并等待回复
+    """
+
+    def __init__(self,conn,timeout = RPC_TIMEOUT):
+        """
+        Args:
+            conn: 管道的一端
+            timeout: 等待回复的超时时间
+        """
+        self._conn = conn
+        self._timeout = timeout
+        self._seq = 0
+
+    def call(self,kind,*args):
+        """发送查询并等待回复
+        Args:
+            kind: 查询类型(对应应答端处理对象的query_<kind>方法)
+            args: 查询的参数
+        Returns:
+            查询的结果
+        Raises:
+            RPCError: 超时、查询类型不存在或者查询出错
+        """
+        self._seq = (self._seq + 1) & 0xffffffff
+        self._conn.send_bytes(marshal.dumps((self._seq,kind,args),2))
+        deadline = timer() + self._timeout
+        while 1:
+            remain = deadline - timer()
+            if remain <= 0 or not self._conn.poll(remain):
+                raise RPCError("query [%s] timeout"%kind)
+            data = self._conn.recv_bytes()
+            if unpack_from("!I",data)[0] != self._seq:
+                continue
+            ok,result = marshal.loads(data[4:])
+            if not ok:
+                raise RPCError(result)
+            return result
+
+
+class RPCStream(object):
+    """不阻塞地收发帧(4字节长度+数据)的管道一端
+    Notes:
+        管道必须是双工的Pipe()(socketpair)，收发都使用MSG_DONTWAIT，
+        不改变管道本身的阻塞模式
+    Attributes:
+        fileno: 管道的文件描述符，用于等待可读、可写
+        pending: 还没有发送的字节数，不为0时需要等待管道可写后调用flush
+        flush: 不阻塞地发送缓冲区中的数据
+        write: 将一帧放入发送缓冲区并尽量发送
+        receive: 不阻塞地读取管道中的数据，返回已经完整的帧
+    """
+
+    def __init__(self,conn):
+        """
+        Args:
+            conn: 管道的一端
+        """
+        self._conn = conn
+        self._sock = socket.fromfd(conn.fileno(),socket.AF_UNIX,socket.SOCK_STREAM)
+        self._buffer = ""
+        self._offset = 0
+        self._chunks = []
+        self._size = 0
+        self._need = 4
+
+    def fileno(self):
+        """管道的文件描述符"""
+        return self._conn.fileno()
+
+    @property
+    def pending(self):
+        """还没有发送的字节数"""
+        return len(self._buffer) - self._offset
+
+    def flush(self):
+        """不阻塞地发送缓冲区中的数据，直到发送完或者管道已满
+        Returns:
+            还没有发送的字节数
+        Raises:
+            socket.error: 管道出错(对端关闭等)
+        """
+        while self._offset < len(self._buffer):
+            try:
+                self._offset += self._sock.send(buffer(self._buffer,self._offset),socket.MSG_DONTWAIT)
+            except socket.error as e:
+                if e.args[0] in _AGAIN:
+                    break
+                raise
+        if self._offset == len(self._buffer):
+            self._buffer = ""
+            self._offset = 0
+        return self.pending
+
+    def write(self,data):
+        """将一帧放入发送缓冲区并尽量发送(详见flush)"""
+        self._buffer = self._buffer[self._offset:] + pack("!i",len(data)) + data
+        self._offset = 0
+        self.flush()
+
+    def receive(self):
+        """不阻塞地读取管道中所有可读的数据，不完整的帧留到下一次读取，
+        读到的数据先按块保存，至少有一个完整的帧时才拼接，大的帧不会被反复复制
+        Returns:
+            [data,...]: 已经完整的帧，没有时为空列表
+        Raises:
+            EOFError: 对端已经关闭
+            socket.error: 管道出错
+        """
+        chunks = self._chunks
+        while 1:
+            try:
+                chunk = self._sock.recv(_RECV_SIZE,socket.MSG_DONTWAIT)
+            except socket.error as e:
+                if e.args[0] in _AGAIN:
+                    break
+                raise
+            if not chunk:
+                raise EOFError
+            chunks.append(chunk)
+            self._size += len(chunk)
+            if len(chunk) < _RECV_SIZE:
+                break
+        if self._size < self._need:
+            return []
+        data = "".join(chunks)
+        frames = []
+        offset = 0
+        while 1:
+            if len(data) - offset < 4:
+                self._need = 4
+                break
+            length, = unpack_from("!i",data,offset)
+            if len(data) - offset - 4 < length:
+                self._need = 4 + length
+                break
+            frames.append(data[offset+4:offset+4+length])
+            offset += 4 + length
+        data = data[offset:]
+        self._chunks = [data] if data else []
+        self._size = len(data)
+        return frames
+
+
+class AsyncRPCClient(RPCStream):
+    """查询的请求端(web进程)，在tornado的IOLoop中不阻塞地发送查询和读取回复
+    Notes:
+        第一次查询时将管道注册到当前的IOLoop，多个查询可以同时等待，按序号匹配回复，
+        超时之后才到达的回复直接丢弃
+    Attributes:
+        call: 发送查询，返回等待回复的Future
+    """
+
+    def __init__(self,conn,timeout = RPC_TIMEOUT):
+        """
+        Args:
+            conn: 管道的一端
+            timeout: 等待回复的超时时间
+        """
+        RPCStream.__init__(self,conn)
+        self._timeout = timeout
+        self._seq = 0
+        self._waiting = {}
+        self._ioloop = None
+        self._events = 0
+
+    def call(self,kind,*args):
+        """发送查询，不等待回复
+        Args:
+            kind: 查询类型(对应应答端处理对象的query_<kind>方法)
+            args: 查询的参数
+        Returns:
+            Future: 查询的结果，超时、查询类型不存在或者查询出错时为RPCError
+        """
+        future = Future()
+        if self._ioloop is None:
+            self._ioloop = IOLoop.current()
+            self._events = IOLoop.READ
+            self._ioloop.add_handler(self.fileno(),self._on_events,self._events)
+        self._seq = (self._seq + 1) & 0xffffffff
+        try:
+            self.write(marshal.dumps((self._seq,kind,args),2))
+        except (ValueError,IOError) as e:
+            future.set_exception(RPCError("query [%s] failed: %s"%(kind,e)))
+            return future
+        timeout = self._ioloop.call_later(self._timeout,self._expire,self._seq,kind)
+        self._waiting[self._seq] = (future,timeout)
+        self._update()
+        return future
+
+    def _update(self):
+        """有没有发送完的查询时同时等待管道可写"""
+        events = IOLoop.READ | (IOLoop.WRITE if self.pending else 0)
+        if events != self._events:
+            self._events = events
+            self._ioloop.update_handler(self.fileno(),events)
+
+    def _on_events(self,fd,events):
+        """管道可读时读取回复，可写时继续发送查询"""
+        try:
+            if events & IOLoop.WRITE:
+                self.flush()
+            if events & (IOLoop.READ | IOLoop.ERROR):
+                for data in self.receive():
+                    self._resolve(data)
+        except (IOError,EOFError) as e:
+            self._close("query pipe closed: %s"%(e or "EOF"))
+            return
+        self._update()
+
+    def _resolve(self,data):
+        """将回复交给等待该序号的Future，迟到的回复不解码直接丢弃"""
+        waiting = self._waiting.pop(unpack_from("!I",data)[0],None)
+        if waiting is None:
+            return
+        future,timeout = waiting
+        ok,result = marshal.loads(data[4:])
+        self._ioloop.remove_timeout(timeout)
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RPCError(result))
+
+    def _expire(self,seq,kind):
+        """查询超时"""
+        waiting = self._waiting.pop(seq,None)
+        if waiting is not None:
+            waiting[0].set_exception(RPCError("query [%s] timeout"%kind))
+
+    def _close(self,reason):
+        """管道出错时取消注册，所有等待中的查询都失败，下一次查询时重新注册"""
+        self._ioloop.remove_handler(self.fileno())
+        for future,timeout in self._waiting.itervalues():
+            self._ioloop.remove_timeout(timeout)
+            future.set_exception(RPCError(reason))
+        self._waiting.clear()
+        self._buffer = ""
+        self._offset = 0
+        self._chunks = []
+        self._size = 0
+        self._need = 4
+        self._ioloop = None
+
+
+class RPCServer(RPCStream):
+    """查询的应答端(DHT进程)
+    Notes:
+        查询类型kind由处理对象的query_<kind>方法回答，结果只能包含marshal支持的基本类型，
+        查询和回复都不阻塞地收发(详见RPCStream)
+    Attributes:
+        status: 累计的查询次数、出错次数、回复的字节数和处理时间
+        answer: 回答管道中所有已经完整的查询
+    """
+
+    def __init__(self,conn,handler):
+        """
+        Args:
+            conn: 管道的一端
+            handler: 处理查询的对象
+        """
+        RPCStream.__init__(self,conn)
+        self._handler = handler
+        self._queries = 0
+        self._errors = 0
+        self._bytes = 0
+        self._cost = 0
+
+    @property
+    def status(self):
+        """查询的开销
+        Returns:
+            queries: 累计的查询次数
+            errors: 累计的出错次数
+            bytes: 累计回复的字节数
+            pending: 还没有发送的回复字节数
+            cost: 累计的处理时间(微秒，包括查询和编码)
+        """
+        return {
+            "queries":self._queries,
+            "errors":self._errors,
+            "bytes":self._bytes,
+            "pending":self.pending,
+            "cost":int(self._cost*1e6)
+        }
+
+    def answer(self):
+        """不阻塞地读取管道中的查询，将回复放入缓冲区并尽量发送(详见flush)，
+        不完整的查询等下一次管道可读时再回答
+        Returns:
+            回答的查询数量
+        Raises:
+            EOFError: 请求端已经关闭
+        """
+        queries = self.receive()
+        for data in queries:
+            self._reply(data)
+        return len(queries)
+
+    def _reply(self,data):
+        """回答一个查询"""
+        start = timer()
+        seq = 0
+        try:
+            seq,kind,args = marshal.loads(data)
+            if type(seq) not in (int,long) or not 0 <= seq <= 0xffffffff:
+                seq = 0
+                raise RPCError("invalid query")
+            func = getattr(self._handler,"query_%s"%kind,None)
+            if func is None:
+                raise RPCError("unknown query [%s]"%kind)
+            data = marshal.dumps((True,func(*args)),2)
+        except Exception as e:
+            self._errors += 1
+            data = marshal.dumps((False,"%s: %s"%(type(e).__name__,e)),2)
+        self.write(pack("!I",seq) + data)
+        self._queries += 1
+        self._bytes += len(data)
+        self._cost += timer() - start
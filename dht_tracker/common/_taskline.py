@@ -3,10 +3,18 @@
 """
 任务管道
 实现对单个任务的控制,方便根据运行时间、执行次数对任务的管控
+LookupTask实现Kademlia的迭代查找，按照与任务id的异或距离由近到远请求节点
 """
 from __future__ import absolute_import
 from time import time
-from ..config import TASK_MAX_LENGTH
+from bisect import insort
+from collections import OrderedDict
+from ..config import (
+    TASK_MAX_LENGTH,
+    LOOKUP_ALPHA,
+    LOOKUP_K,
+    LOOKUP_TIMEOUT
+)
 
 class Task(object):
     """任务单元
@@ -31,6 +39,11 @@ class Task(object):
         start: 将任务的状态设置为开始
         stop: 将任务的状态设置为暂停
         clear: 清空任务的管道
+        finished: 任务是否已经完成
+        inflight: 正在等待回复的请求数量
+        responded: 已经回复的请求数量
+        done: 任务中的一个请求收到回复
+        fail: 任务中的一个请求超时
     """
     _maxlength = TASK_MAX_LENGTH
     
@@ -142,8 +155,11 @@ class Task(object):
         if self.length < self._maxlength:
             self._queue.add(item)
     
-    def get(self):
-        """从任务管道获取一个待执行的任务"""
+    def get(self,latency = None):
+        """从任务管道获取一个待执行的任务
+        Args:
+            latency: 与LookupTask.get的接口相同，普通任务不使用
+        """
         try:
             item = self._queue.pop()
             self._num += 1
@@ -161,17 +177,257 @@ class Task(object):
     def stop(self):
         """将任务的状态设置为暂停"""
         self._started = 0
+
+    @property
+    def finished(self):
+        """任务是否已经完成，普通任务没有完成的状态"""
+        return False
+
+    @property
+    def inflight(self):
+        """正在等待回复的请求数量，普通任务不记录"""
+        return 0
+
+    @property
+    def responded(self):
+        """已经回复的请求数量，普通任务不记录"""
+        return 0
+
+    def done(self,item):
+        """任务中的一个请求收到回复，普通任务不需要处理
+        Args:
+            item: 请求的节点(nid,addr)
+        """
+        pass
+
+    def fail(self,item):
+        """任务中的一个请求超时，普通任务不需要处理
+        Args:
+            item: 请求的节点(nid,addr)
+        """
+        pass
         
     def __len__(self):
         """"""
         return self.length
+
+
+
+class LookupTask(Task):
+    """Kademlia的迭代查找任务
+    候选节点按照与任务id的异或距离排序，每次取出最近的未请求节点，
+    同时最多有alpha个请求在等待回复，最近的k个节点都回复后任务完成
+    Notes:
+        候选节点为(nid,addr)，nid为None的节点(启动节点)距离最远，
+        距离的最高位相同的未请求节点中优先请求延时低的节点，
+        请求失败的节点不计入最近的k个节点，
+        超过LOOKUP_TIMEOUT没有回复的请求视为失败，避免请求的回复丢失后任务无法继续，
+        重新启动任务时保留候选节点，清空请求的状态，重新进行查找
+    Attributes:
+        alpha: 同时等待回复的最大请求数量
+        k: 需要回复的最近节点数量
+        queried: 已经请求的节点数量
+        responded: 已经回复的节点数量
+        inflight: 正在等待回复的节点数量
+        distance: 节点与任务id的异或距离
+    """
+    _alpha = LOOKUP_ALPHA
+    _k = LOOKUP_K
+    _timeout = LOOKUP_TIMEOUT
+    _far = 2**160
+
+    def __init__(self,id):
+        """初始化查找任务
+        _target: 任务id的整数形式
+        _shortlist: 按距离排序的候选节点[(distance,item),...]
+        _seen: 已经加入过的候选节点，不再重复加入
+        Args:
+            id: 任务的唯一标识(20位)
+        """
+        self._target = int(id.encode("hex"),16)
+        self._shortlist = []
+        self._seen = set()
+        self._queried = set()
+        self._responded = set()
+        self._failed = set()
+        self._inflight = dict()
+        super(LookupTask,self).__init__(id)
+
+    @property
+    def alpha(self):
+        """同时等待回复的最大请求数量"""
+        return self._alpha
+
+    @property
+    def k(self):
+        """需要回复的最近节点数量"""
+        return self._k
+
+    @property
+    def length(self):
+        """候选节点的数量"""
+        return len(self._shortlist)
+
+    @property
+    def items(self):
+        """按距离排序的候选节点
+        Returns:
+            [(nid,addr),(nid,addr),...]
+        """
+        return [item for distance,item in self._shortlist]
+
+    @property
+    def queried(self):
+        """已经请求的节点数量"""
+        return len(self._queried)
+
+    @property
+    def responded(self):
+        """已经回复的节点数量"""
+        return len(self._responded)
+
+    @property
+    def inflight(self):
+        """正在等待回复的节点数量"""
+        return len(self._inflight)
+
+    @property
+    def status(self):
+        """任务的状态，在Task的基础上添加查找的状态"""
+        res = super(LookupTask,self).status
+        res.update({
+            "queried":self.queried,
+            "responded":self.responded,
+            "inflight":self.inflight,
+            "finished":self.finished
+        })
+        return res
+
+    def distance(self,item):
+        """节点与任务id的异或距离，nid不是20位的节点距离最远"""
+        nid = item[0]
+        if not nid or len(nid) != 20:
+            return self._far
+        return int(nid.encode("hex"),16) ^ self._target
+
+    def put(self,item):
+        """加入一个候选节点，已经加入过的节点不再加入，
+        候选节点超过最大长度时丢弃最远的节点
+        """
+        if item in self._seen:
+            return
+        distance = self.distance(item)
+        if len(self._shortlist) >= self._maxlength:
+            if distance >= self._shortlist[-1][0]:
+                return
+            self._shortlist.pop()
+        self._seen.add(item)
+        insort(self._shortlist,(distance,item))
+
+    def _closest(self):
+        """最近的k个没有失败的候选节点
+        Yields:
+            (distance,item): 候选节点与任务id的距离，候选节点(nid,addr)
+        """
+        num = 0
+        for distance,item in self._shortlist:
+            if item in self._failed:
+                continue
+            yield distance,item
+            num += 1
+            if num >= self._k:
+                return
+
+    def _expire(self,now):
+        """将超过LOOKUP_TIMEOUT没有回复的请求视为失败"""
+        for item,stime in self._inflight.items():
+            if now - stime > self._timeout:
+                self.fail(item)
+
+    def get(self,latency = None):
+        """取出最近的k个节点中最近的一个未请求节点，
+        与它距离的最高位相同(同一个KBucket距离范围内)的未请求节点中，选择延时最小的节点
+        Args:
+            latency: 节点的预计延时latency(item)，为None时直接选择最近的节点
+        Returns:
+            item: 需要请求的节点(nid,addr)
+            None: 等待回复的请求已经达到alpha个，或者最近的k个节点都已经请求
+        """
+        now = time()
+        self._expire(now)
+        if len(self._inflight) >= self._alpha:
+            return None
+        choice = None
+        for distance,item in self._closest():
+            if item in self._queried:
+                continue
+            if choice is None:
+                choice,band = item,distance.bit_length()
+                if latency is None:
+                    break
+                best = latency(item)
+            elif distance.bit_length() != band:
+                break
+            else:
+                cost = latency(item)
+                if cost < best:
+                    choice,best = item,cost
+        if choice is not None:
+            self._queried.add(choice)
+            self._inflight[choice] = now
+            self._num += 1
+        return choice
+
+    def done(self,item):
+        """请求收到回复，超时后才收到的回复同样有效"""
+        if item in self._queried:
+            self._inflight.pop(item,None)
+            self._failed.discard(item)
+            self._responded.add(item)
+
+    def fail(self,item):
+        """请求超时，该节点不再计入最近的k个节点"""
+        if self._inflight.pop(item,None) is not None:
+            self._failed.add(item)
+
+    @property
+    def finished(self):
+        """没有正在等待回复的请求，并且最近的k个节点都已经回复"""
+        if self._inflight or not self._responded:
+            return False
+        for distance,item in self._closest():
+            if item not in self._responded:
+                return False
+        return True
+
+    def clear(self):
+        """清空候选节点和请求的状态"""
+        self._shortlist = []
+        self._seen.clear()
+        self._reset()
+
+    def _reset(self):
+        """清空请求的状态"""
+        self._queried.clear()
+        self._responded.clear()
+        self._failed.clear()
+        self._inflight.clear()
+
+    def start(self):
+        """将任务的状态设置为开始，清空请求的状态，重新进行查找"""
+        self._reset()
+        super(LookupTask,self).start()
         
         
 
 class Tubes(object):
-    """任务管道，使用列表的方式实现
+    """任务管道，使用有序字典的方式实现
     以任务的唯一标识id为识别方式，提供添加，删除，获取等操作
+    Notes:
+        有序字典保持任务添加的顺序，通过id获取任务为O(1)，
+        需要移除的任务在resize时一次性移除
     Attributes:
+        task_class: 管道内任务的类型
         push: 向任务管道内添加一个任务,如果管道内已经有了该任务，则不添加
         remove: 从管道内移除一个任务
         get: 通过任务唯一标识id获取任务
@@ -179,9 +435,13 @@ class Tubes(object):
         stop: 通过任务唯一标识id暂停任务
     """
     
-    def __init__(self):
-        """初始化一个空的任务管道"""
-        self._tubes = list()
+    def __init__(self,task_class = Task):
+        """初始化一个空的任务管道
+        Args:
+            task_class: 管道内任务的类型
+        """
+        self._tubes = OrderedDict()
+        self.task_class = task_class
     
     @property
     def length(self):
@@ -190,24 +450,23 @@ class Tubes(object):
     
     @property
     def tubes(self):
-        """任务管道内所有的任务"""
-        return self._tubes
+        """任务管道内所有的任务(按照添加的顺序)"""
+        return self._tubes.values()
     
-    def push(self,id):
+    def push(self,id,task_class = None):
         """向任务管道内添加一个任务,
         如果管道内已经有了该任务，则不添加
         Args:
             id: 任务唯一标识
+            task_class: 任务的类型，默认为管道内任务的类型
         Returns:
             True: 任务添加成功
             False: 管道内已经有该任务
         """
-        task = self._position(id)
-        if task:
+        if id in self._tubes:
             return False
-        else:
-            self._tubes.append(Task(id))
-            return True
+        self._tubes[id] = (task_class or self.task_class)(id)
+        return True
     
     def remove(self,id):
         """从管道内移除一个任务
@@ -218,7 +477,7 @@ class Tubes(object):
             None: 管道没有该任务
         """
         task = self._position(id)
-        if task:
+        if task is not None:
             task.remove()
             return True
     
@@ -240,9 +499,7 @@ class Tubes(object):
             task: 任务单元
             None: 管道内没有该id的任务
         """
-        for task in self._tubes:
-            if task.id == id:
-                return task
+        return self._tubes.get(id)
     
     def start(self,id):
         """通过任务唯一标识id启动任务
@@ -253,7 +510,7 @@ class Tubes(object):
             None: 管道内没有该id的任务
         """
         task = self._position(id)
-        if task:
+        if task is not None:
             task.start()
             return True
     
@@ -275,16 +532,19 @@ class Tubes(object):
             None: 管道内没有该id的任务
         """
         task = self._position(id)
-        if task:
+        if task is not None:
             task.stop()
             return True 
     
     def resize(self):
-        """重新调整，将需要移除的任务移除"""
-        for task in self._tubes:
-            if task.removed:
-                self._tubes.remove(task)
-                self.resize()
+        """重新调整，将需要移除的任务一次性移除
+        Returns:
+            移除的任务数量
+        """
+        removed = [id for id,task in self._tubes.iteritems() if task.removed]
+        for id in removed:
+            del self._tubes[id]
+        return len(removed)
         
     def __getitem__(self,id):
         """方便通过[id]的方式获取任务
@@ -296,6 +556,10 @@ class Tubes(object):
         """
         return self.get(id)
 
+    def __contains__(self,id):
+        """判断管道内是否有该id的任务"""
+        return id in self._tubes
+
         
 
 class TaskLine(object):
@@ -304,13 +568,20 @@ class TaskLine(object):
     对目前没有的key可以通过使用自动添加
     Attributes:
         tubes: 所有的任务类型
+        task_classes: 各类型任务管道内任务的类型，没有设置的为Task
+        settube: 设置一个类型的任务管道内任务的类型
         addtube: 添加一个类型的任务管道(key-value)
         push: 向一个任务管道中添加任务
         get: 从一个任务管道中获取一个任务
+        control: 执行一个任务控制命令(push、start、stop、remove)
     """
+    #可以通过控制命令执行的操作
+    controls = ("push","start","stop","remove")
+
     def __init__(self):
         """初始化一个字典用来存放任务管道"""
         self.mqueue = dict()
+        self.task_classes = dict()
     
     @property
     def length(self):
@@ -327,19 +598,30 @@ class TaskLine(object):
         如果已经存在该类型的管道则跳过
         """
         if not self.mqueue.has_key(key):
-            self.mqueue[key] = Tubes()
+            self.mqueue[key] = Tubes(self.task_classes.get(key,Task))
+
+    def settube(self,key,task_class):
+        """设置一个类型的任务管道内任务的类型，只对之后添加的任务有效
+        Args:
+            key: 任务类型
+            task_class: 任务的类型(Task或者其子类)
+        """
+        self.task_classes[key] = task_class
+        if self.mqueue.has_key(key):
+            self.mqueue[key].task_class = task_class
     
-    def push(self,key,id):
+    def push(self,key,id,task_class = None):
         """向一个任务管道中添加任务
         Args:
             key: 任务类型
             id: 任务唯一标识id
+            task_class: 任务的类型，默认为该类型管道内任务的类型
         Returns:
             True: 任务添加成功
             False: 管道内已经有该任务
         """
         self.addtube(key)
-        return self.mqueue[key].push(id)
+        return self.mqueue[key].push(id,task_class)
     
     def stop(self,key,id):
         """停止管道内的一个任务
@@ -376,6 +658,25 @@ class TaskLine(object):
         """
         self.addtube(key)
         return self.mqueue[key].remove(id)        
+
+    def control(self,action,key,id):
+        """执行一个任务控制命令
+        Args:
+            action: 操作(push、start、stop、remove)
+            key: 任务类型
+            id: 任务唯一标识id
+        Returns:
+            ok: 执行成功
+            exists: 管道内已经有该任务(push)
+            missing: 管道内没有该任务(start、stop、remove)
+            invalid: 不支持的操作
+        """
+        if action not in self.controls:
+            return "invalid"
+        res = getattr(self,action)(key,id)
+        if res:
+            return "ok"
+        return "missing" if res is None else "exists"
     
     @property
     def status(self):
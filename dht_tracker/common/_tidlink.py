@@ -1,45 +1,210 @@
 #!/usr/bin/env python
 #coding:utf-8
 """
-挑战者-响应 请求映射链表
-使链表可以通过iter()方法获取一个无限循环的迭代器(链表的最大长度为)
-方便对链表的信息的添加,缩短时间
+挑战者-响应 请求映射表
+使用定长的环形数组实现，数组的索引即为tid的整数形式，通过tid可以O(1)的获取当时发送的信息
+使映射表可以通过iter()方法获取一个无限循环的迭代器(映射表的最大长度为TID_MAX_LENGTH)
+方便对映射表的信息的添加,缩短时间
+等待回复的请求同时放入时间轮，超时后回收该位置并通过on_timeout通知请求超时
 """
-from itertools import cycle
-from struct import unpack,pack
-from . import Node,Linklist
-from ..config import TID_MAX_LENGTH
+from time import time
+from struct import pack
+from ._timewheel import TimeWheel
+from ..config import (
+    TID_MAX_LENGTH,
+    TID_TIMEOUT,
+    TID_WHEEL_TICK,
+    TID_WHEEL_LENGTH
+)
 
-class TidLink(Linklist):
-    """
+class TidLink(object):
+    """挑战者-响应 请求映射表
+    Notes:
+        每个位置保存当时发送的信息和发送时间，位置在收到回复后或者请求超时后被回收，
+        迭代器只会分配已经回收的位置，当所有位置都在使用中时覆盖最早分配的位置，
+        被覆盖的请求和已经超时但还没有被时间轮回收的请求在重新分配前按超时处理(调用on_timeout)，
+        回收后的位置不会再匹配迟到的回复
+    Attributes:
+        max_length: 映射表的最大长度
+        length: 正在等待回复的请求数量
+        overwritten: 还在等待回复就被覆盖的请求数量(累计)
+        timeout: 请求的默认超时时间
+        pop: 收到回复后回收该位置并返回当时发送的信息
+        elapsed: 请求发送后经过的时间(收到回复时即为往返时间)
+        expire: 回收所有超时的位置，对每个超时的请求调用on_timeout
+        on_timeout: 请求超时的扩展接口，在使用时自己添加
+        timeout_of: 计算请求超时时间的扩展接口，默认使用timeout
     """
     _max_length = TID_MAX_LENGTH
-    tid_iter = cycle(xrange(0,TID_MAX_LENGTH))
+    _timeout = TID_TIMEOUT
+    _probe = 256
+
+    def __init__(self):
+        """初始化映射表，所有的位置都为空"""
+        self._slots = [None]*self._max_length
+        self._stimes = [0]*self._max_length
+        self._deadlines = [0]*self._max_length
+        self._cursor = 0
+        self._length = 0
+        self._overwritten = 0
+        self._wheel = TimeWheel(TID_WHEEL_TICK,TID_WHEEL_LENGTH)
 
     @property
     def max_length(self):
-        """"""
+        """映射表的最大长度"""
         return self._max_length
-        
+
+    @property
+    def length(self):
+        """正在等待回复的请求数量"""
+        return self._length
+
+    @property
+    def overwritten(self):
+        """还在等待回复就被覆盖的请求数量(累计)"""
+        return self._overwritten
+
+    @property
+    def timeout(self):
+        """请求的默认超时时间"""
+        return self._timeout
+
+    def _checkindex(self,index):
+        """检验输入的索引值是否在映射表范围内
+        Raises:
+            IndexError: 索引值不合法或者超出映射表范围
+        """
+        if not 0 <= index < self._max_length:
+            raise IndexError("TidLink index out of range")
+
+    def _expired(self,index,now):
+        """判断该位置是否可以被重新分配(为空或者请求已经超时)"""
+        return self._slots[index] is None or now > self._deadlines[index]
+
+    def _alloc(self):
+        """从游标处开始寻找一个可以重新分配的位置，最多向后查找_probe个位置，
+        都在等待回复时，返回游标处的位置(覆盖最早分配的请求)，
+        位置上原来的请求先回收并调用on_timeout
+        Returns:
+            index: 分配的位置
+        """
+        now = time()
+        index = self._cursor
+        for _ in xrange(self._probe):
+            if self._expired(index,now):
+                break
+            index = (index + 1) % self._max_length
+        else:
+            index = self._cursor
+        self._cursor = (index + 1) % self._max_length
+        data = self._slots[index]
+        if data is not None:
+            if not self._expired(index,now):
+                self._overwritten += 1
+            self._release(index)
+            self.on_timeout(data)
+        return index
+
+    def set(self,index,data):
+        """向映射表的位置写入发送的信息，记录发送时间和超时时间"""
+        self._checkindex(index)
+        if self._slots[index] is None:
+            self._length += 1
+        timeout = self.timeout_of(data)
+        self._slots[index] = data
+        self._stimes[index] = time()
+        self._deadlines[index] = self._stimes[index] + timeout
+        self._wheel.add(index,data,timeout)
+
+    def elapsed(self,index):
+        """请求发送后经过的时间，在回收该位置前调用即为请求的往返时间
+        Args:
+            index: tid的整数形式
+        """
+        self._checkindex(index)
+        return time() - self._stimes[index]
+
+    def pop(self,index):
+        """收到回复后回收该位置
+        Args:
+            index: tid的整数形式
+        Returns:
+            data: 当时发送的信息
+            None: 该位置没有正在等待回复的请求
+        Raises:
+            IndexError: 索引值不合法或者超出映射表范围
+        """
+        data = self.getitem(index)
+        if data is not None:
+            self._release(index)
+        return data
+
+    def _release(self,index):
+        """回收该位置"""
+        self._slots[index] = None
+        self._length -= 1
+        self._wheel.retire(index)
+
+    def expire(self,now = None):
+        """推进时间轮，回收所有超时的位置，对每个超时的请求调用on_timeout
+        Args:
+            now: 推进到的时间，默认为当前时间
+        Returns:
+            超时的请求数量
+        """
+        expired = self._wheel.advance(now)
+        for index,data in expired:
+            self._release(index)
+            self.on_timeout(data)
+        return len(expired)
+
+    def timeout_of(self,data):
+        """计算请求超时时间的扩展接口，在使用时自己添加
+        Args:
+            data: 发送的信息
+        Returns:
+            请求的超时时间
+        """
+        return self._timeout
+
+    def on_timeout(self,data):
+        """请求超时的扩展接口，在使用时自己添加
+        Args:
+            data: 当时发送的信息
+        """
+        pass
+
+    def getitem(self,index):
+        """通过索引值获取当时发送的信息，超时的请求视为不存在
+        Args:
+            index: tid的整数形式
+        Returns:
+            data: 当时发送的信息
+            None: 该位置没有正在等待回复的请求
+        Raises:
+            IndexError: 索引值不合法或者超出映射表范围
+        """
+        self._checkindex(index)
+        if self._expired(index,time()):
+            return None
+        return self._slots[index]
+
+    def __getitem__(self,index):
+        """使映射表可以通过[index]的方式获取信息，方法同self.getitem"""
+        return self.getitem(index)
+
+    def __len__(self):
+        """正在等待回复的请求数量"""
+        return self._length
+
     def __iter__(self):
-        """使链表可以通过iter()方法获取一个无限循环的迭代器(链表的最大长度为)，
-        并可以通过send()方法修改节点信息
-        初始链表为空链表，通过无限循环的迭代器cycle可以无限的循环链表，链表的节点位置即为tid的整数形式
-        当链表为空，在头部添加一个节点，通过send方法为链表添加干节点的内容，
-        链表没有下一个节点并且不是cycle的最大长度，为该链表添加下一个节点
-        Yields:(tid,node)
+        """使映射表可以通过iter()方法获取一个无限循环的迭代器，
+        并可以通过send()方法写入该位置发送的信息
+        Yields:(tid,index)
             tid: 该位置(正整数索引) 的网络大端字节
-            node: 该位置(正整数索引)的节点
+            index: 该位置(正整数索引)
         """
-        if self._head is None:
-            self._head = Node(None)
-            self._length += 1        
         while 1:
-            tid_num = self.tid_iter.next()
-            if tid_num == 0:node = self._head           
-            data = yield (pack("!H",tid_num),node)
-            if node._next is None and self.length < self._max_length:
-                node._next = Node(None)
-                self._length += 1
-            if data:node.data = data
-            node = node._next        
\ No newline at end of file
+            index = self._alloc()
+            data = yield (pack("!H",index),index)
+            if data:self.set(index,data)
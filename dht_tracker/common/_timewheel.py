@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+哈希时间轮
+将需要超时处理的信息按超时的时间刻度放入时间轮的槽中，
+添加和移除都为O(1)，推进时间轮时只需要检查经过的槽，不需要遍历所有的信息
+"""
+from math import ceil
+from time import time
+
+class TimeWheel(object):
+    """哈希时间轮
+    Notes:
+        时间轮的每个槽是一个字典{key:(tick,data)}，tick为超时的绝对刻度，
+        超时时间超过一圈的信息会一直留在槽中，直到时间轮推进到它的刻度
+    Attributes:
+        tick: 时间轮的刻度(秒)
+        length: 时间轮槽的数量
+        add: 添加一个需要超时处理的信息
+        retire: 移除一个信息(不再需要超时处理)
+        advance: 推进时间轮，返回所有超时的信息
+    """
+
+    def __init__(self,tick,length):
+        """初始化一个空的时间轮
+        Args:
+            tick: 时间轮的刻度(秒)
+            length: 时间轮槽的数量
+        """
+        self._tick = tick
+        self._length = length
+        self._wheel = [dict() for _ in xrange(length)]
+        self._where = dict()
+        self._current = int(time()/tick)
+
+    @property
+    def tick(self):
+        """时间轮的刻度(秒)"""
+        return self._tick
+
+    @property
+    def length(self):
+        """时间轮槽的数量"""
+        return self._length
+
+    def add(self,key,data,timeout,now = None):
+        """添加一个需要超时处理的信息，已经存在的key将被替换，
+        超时的刻度向上取整，信息不会在now+timeout之前超时
+        Args:
+            key: 信息的唯一标识
+            data: 信息的内容
+            timeout: 超时时间(秒)
+            now: 添加的时间，默认为当前时间
+        """
+        self.retire(key)
+        deadline = (time() if now is None else now) + timeout
+        tick = max(int(ceil(deadline/self._tick)),self._current + 1)
+        slot = self._wheel[tick % self._length]
+        slot[key] = (tick,data)
+        self._where[key] = slot
+
+    def retire(self,key):
+        """移除一个信息(不再需要超时处理)
+        Args:
+            key: 信息的唯一标识
+        Returns:
+            data: 信息的内容
+            None: 时间轮内没有该信息
+        """
+        slot = self._where.pop(key,None)
+        if slot is not None:
+            return slot.pop(key)[1]
+
+    def advance(self,now = None):
+        """推进时间轮到now，取出所有超时的信息
+        Args:
+            now: 推进到的时间，默认为当前时间
+        Returns:
+            [(key,data),(key,data),...]
+        """
+        target = int((time() if now is None else now)/self._tick)
+        expired = []
+        start = max(self._current + 1,target - self._length + 1)
+        for tick in xrange(start,target + 1):
+            slot = self._wheel[tick % self._length]
+            if not slot:continue
+            for key,(deadline,data) in slot.items():
+                if deadline <= target:
+                    del slot[key]
+                    del self._where[key]
+                    expired.append((key,data))
+        self._current = max(self._current,target)
+        return expired
+
+    def __contains__(self,key):
+        """判断信息是否在时间轮中"""
+        return key in self._where
+
+    def __len__(self):
+        """时间轮中信息的数量"""
+        return len(self._where)
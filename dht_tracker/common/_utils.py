@@ -68,6 +68,14 @@ def ascii2l16(nid):
     """将16进制ASCII码转为10进制的长整数"""
     return long(nid.encode("hex"),16)    
 
+def nid2l16(nid):
+    """将20位的nid转为10进制的长整数，比ascii2l16少一次16进制编码
+    Raises:
+        struct.error: nid的长度不是20位
+    """
+    high,middle,low = unpack("!QQI",nid)
+    return (high << 96) | (middle << 32) | low
+
 def bloads(msg):
     """将信息用bencode解码
     Args:
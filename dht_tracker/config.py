@@ -9,15 +9,43 @@ TABLE_RANGE                   = (2**0,2**160)  #路由表的范围
 #可以修改的设置
 #挑战者-响应链表设置
 TID_MAX_LENGTH                = 256**2          #链表的最大长度
+TID_TIMEOUT                   = 10              #请求的超时时间，超时后tid可以被重新分配
+TID_WHEEL_TICK                = 1               #请求超时时间轮的刻度(秒)
+TID_WHEEL_LENGTH              = 64              #请求超时时间轮槽的数量
+#往返时间设置
+RTT_ALPHA                     = 1/8             #平滑往返时间的增益
+RTT_BETA                      = 1/4             #往返时间偏差的增益
+RTT_MIN_TIMEOUT               = 2               #根据往返时间计算的最小超时时间(不小于两个时间轮刻度)
+RTT_SUBNET_MAX_LENGTH         = 256**2          #记录往返时间的/24网段的最大数量
+RTT_COUNT_RANGE               = (0.05,0.1,0.2,0.5,1,2)  #往返时间统计的分段(秒)
+#KRPC设置
+KRPC_CODEC                    = "krpc"          #编解码方式(krpc-KRPC专用编解码，解码更严格，编解码都比bencode快，bencode-通用bencode编解码)
+KRPC_MAX_LENGTH               = 8192            #接收信息的最大长度，超过将会被丢弃
+KRPC_BATCH_IO                 = 0               #是否使用批量收发(0-逐个收发，1-批量收发)
+KRPC_BATCH_SIZE               = 64              #批量收发时单次收发的最大数量
+KRPC_PREFILTER                = 1               #是否在解码前对原始字节进行预过滤(0-关闭，1-开启)
 #任务设置
 TASK_MAX_LENGTH               = 1024            #任务队列的最大长度
+LOOKUP_ALPHA                  = 3               #查找任务同时等待回复的最大请求数量
+LOOKUP_K                      = 8               #查找任务需要回复的最近节点数量
+LOOKUP_TIMEOUT                = TID_TIMEOUT     #查找任务中请求的超时时间
 #路由表设置
 NODE_UPDATE_TIME              = 900             #对节点单次的检测时间
 NODE_DEFAULT_WEIGHT           = 5               #节点的默认权重
 KBUCKET_MAX_LENGTH            = 16              #K桶存放节点的最大数量
+KBUCKET_CACHE_LENGTH          = 8               #K桶替换缓存中候选节点的最大数量
+NODE_MAX_MISSNUM              = 2               #节点连续失误达到该次数后，用替换缓存中的候选节点替换
 RETURN_NODE_MAX_LENGTH        = 16              #返回节点的最大数量
+KTABLE_SPLIT_POLICY           = "standard"      #桶的容量策略(standard-只分隔自己所在的桶，relaxed-靠近自己的桶容量加倍，unbounded-其他桶不限容量)
+KTABLE_RELAXED_DEPTH          = 8               #relaxed策略下容量加倍的靠近自己的桶的数量
+KTABLE_MAX_NODES              = 0               #路由表节点数量的上限(0-不限制)，达到上限后淘汰权重最低的节点
+KTABLE_INDEX                  = 1               #是否使用numpy数组索引查找最近的节点(0-不使用，1-numpy可用时使用)
+KTABLE_INDEX_MIN_LENGTH       = 4096            #路由表节点数量达到该值后才使用数组索引查找
 #路由表检测间隔时间，在NODE_UPDATE_TIME时间内对所有的K桶内节点都可检测一遍
 NODE_CHECK_INTERVAL_TIME      = NODE_UPDATE_TIME/KBUCKET_MAX_LENGTH
+NODE_REFRESH_INTERVAL         = 60              #收到节点的请求时被动刷新同一个节点的最小间隔
+TABLE_SNAPSHOT_PATH           = ""              #路由表快照文件的绝对路径(为空时不保存也不恢复，如/var/lib/dht_tracker/ktable.snapshot)
+TABLE_SNAPSHOT_INTERVAL       = 300             #保存路由表快照的间隔时间
 #DHT设置
 BOOTSTRAP_NODES               = (          
     ("router.utorrent.com",6881),
@@ -26,7 +54,16 @@ BOOTSTRAP_NODES               = (
     ("router.bittorrent.com", 6881),
 )                                               #启动节点
 DHTPORT                       = 6881            #默认DHT网络端口
+SPIDER_POOL_MAX_LENGTH        = 1000000         #爬虫模式节点池的最大节点数量(每个节点约占用300位内存)
+SPIDER_POOL_BATCH             = 16              #爬虫模式find_node任务为空时从节点池中取出的节点数量
 PER_SECOND_MAX_TIME           = 1024            #DTH每秒发送的最大次数
+PACER_INTERVAL                = 0.01            #有任务发送时节拍器的唤醒间隔
+PACER_IDLE_TIME               = 0.1             #没有任务发送时节拍器的唤醒间隔
+PACER_TUBE_SHARE              = {               
+    "ping":0.25,
+    "find_node":0.5,
+    "get_peers":1,
+}                                               #各任务管道占用每秒发送次数的比例上限
 #停止主动向节点请求自己的路由表长度
 MIN_STOP_TABLE_LENGTH         = KBUCKET_MAX_LENGTH**2*2
 #停止对任务使用启动节点去请求的路由表长度
@@ -34,9 +71,13 @@ MIN_STOP_BOOT_LENGTH          = KBUCKET_MAX_LENGTH**2
 #单个任务的最多请求次数
 MAX_TASK_NUM                  = TASK_MAX_LENGTH*PER_SECOND_MAX_TIME
 MAX_RUN_TIME                  = 600             #单个任务的最大运行时间
-#共享内存设置
-SYNC_INTERVAL_TIME            = 3               #共享内存映射间隔时间
-CONTROL_INTERVAL_TIME         = 1               #任务控制间隔时间
+#进程间通信设置
+RPC_TIMEOUT                   = 1               #web进程等待查询回复的超时时间
+CONTROL_BATCH_SIZE            = 1000            #web进程每次查询发送的任务控制命令的最大数量
+COUNT_TICK_INTERVAL           = 1               #统计当前分钟路径的更新间隔时间
+COUNT_KEEP_MINUTES            = 120             #统计保留的分钟数
+COUNT_KEEP_HOURS              = 48              #统计保留的小时数
+COUNT_KEEP_DAYS               = 31              #统计保留的天数
 
 #reset api 设置
 WEBPORT                       = 8888           #默认reset api 端口
@@ -12,25 +12,41 @@ DHTSpider -> 爬虫模式
 import gevent
 import logging
 from random import choice
+from collections import Counter
 from struct import unpack
 from struct import error as structerror
 from gevent import sleep
+from gevent.select import select
+from gevent.socket import wait_read
 from . import KRPC
 from . import table
-from ..common import tidlink,taskline,sync,control_out
+from . import _ksnapshot
+from ._kpool import NodePool
+from ..common import tidlink,taskline,control_out
+from ..common import query_conn,RPCServer
 from ..common import nid,unpack_nodes
-from ..common import netcount,count
+from ..common import netcount,count,incr,tick,Pacer
+from ..common import Task,LookupTask
 from ..config import (
     BOOTSTRAP_NODES,
     DHTPORT,
+    SPIDER_POOL_MAX_LENGTH,
+    SPIDER_POOL_BATCH,
     NODE_CHECK_INTERVAL_TIME,
-    SYNC_INTERVAL_TIME,
-    CONTROL_INTERVAL_TIME,
+    TABLE_SNAPSHOT_PATH,
+    TABLE_SNAPSHOT_INTERVAL,
+    COUNT_TICK_INTERVAL,
     PER_SECOND_MAX_TIME,
+    PACER_INTERVAL,
+    PACER_IDLE_TIME,
+    PACER_TUBE_SHARE,
     MIN_STOP_TABLE_LENGTH,
     MIN_STOP_BOOT_LENGTH,
     MAX_RUN_TIME,
-    MAX_TASK_NUM
+    MAX_TASK_NUM,
+    TID_WHEEL_TICK,
+    RTT_COUNT_RANGE,
+    NID_LENGTH
 )
 
 
@@ -44,12 +60,25 @@ class BaseDHT(KRPC):
         tidlink: 挑战者-响应链表
         tiditer: 挑战者-响应链表的生成器，用于循环更改发送的请求的tid与内容
         taskline: 任务管道，用来存放各种需要请求的任务
+        pacer: 发送节拍器，控制每秒发送请求的次数
+        task_classes: 各类型任务管道内任务的类型
         _r_handle: 对收到的回复进行处理的关系映射
         _q_handle: 对收到的请求进行处理的关系映射
         _task_map: 对需要发送请求的任务类型处理的关系映射
         start_dht: 启动DHT网络
         auto_check_table: 更新路由表，对长时间没有互动的接近进行ping检测
+        auto_save_table: 定时保存路由表快照
+        auto_tick_count: 定时更新统计的当前分钟路径
+        rpc: 回答web进程查询的应答端
+        auto_answer_query: 回答web进程的查询(query_<kind>方法)
+        control: 执行一批任务控制命令，返回每个命令的结果
+        auto_check_task: 执行任务控制管道中的命令
+        load_table: 从快照恢复路由表
+        save_table: 保存路由表快照
+        auto_expire_tid: 回收超时的请求，将节点的失误反馈到路由表中
+        outstanding: 判断回复的t是否正在等待回复(KRPC中预过滤使用)
     """
+    task_classes = {"find_node":LookupTask,"get_peers":LookupTask}
     
     def __init__(self,port):
         """初始基本信息
@@ -59,6 +88,10 @@ class BaseDHT(KRPC):
         tiditer: 挑战者-响应链表的生成器，用于循环更改发送的请求的tid与内容
         tid: 挑战者-响应链表的生成器初始化
         taskline: 任务管道，用来存放各种需要请求的任务
+        pacer: 发送节拍器，控制每秒发送请求的次数
+        rpc: 回答web进程查询的应答端
+        _send_num: 已经发送的请求次数，用于计算任务每次执行发送的次数
+        _task_offsets: 每个任务管道下次开始执行的任务位置
         _r_handle: 对收到的回复进行处理的关系映射
         _q_handle: 对收到的请求进行处理的关系映射
         _task_map: 对需要发送请求的任务类型处理的关系映射
@@ -72,18 +105,30 @@ class BaseDHT(KRPC):
         self.tidlink = tidlink
         self.tiditer = iter(tidlink)
         self.tid = self.tiditer.next()
+        self.tidlink.on_timeout = self._on_tid_timeout
+        self.tidlink.timeout_of = self._tid_timeout
         self.taskline = taskline
+        self.pacer = Pacer(PER_SECOND_MAX_TIME,PACER_INTERVAL,PACER_IDLE_TIME,PACER_TUBE_SHARE)
+        self.rpc = RPCServer(query_conn,self)
+        self._send_num = 0
+        self._task_offsets = {}
         self._r_handle = {}
         self._q_handle = {}
         self._task_map = {}         
+        for key,task_class in self.task_classes.iteritems():
+            self.taskline.settube(key,task_class)
+        self.load_table()
         self._init()
     
     def _init(self):
         """添加默认任务
-        find_node: 寻找自己的节点，让更多的节点认识自己
+        find_node: 寻找自己的节点，让更多的节点认识自己，
+            该任务用于填充路由表，使用普通任务持续请求新的节点，
+            直到路由表超过MIN_STOP_TABLE_LENGTH(详见control_find_node)，
+            不使用查找任务，避免最近的k个节点回复后任务在路由表填满之前就停止
         ping: 对路由表更新的默认任务
         """
-        self.taskline.push("find_node",self.nid)
+        self.taskline.push("find_node",self.nid,Task)
         self.taskline.push("ping","ping") 
 
     def getnid(self,nid = None):
@@ -112,45 +157,197 @@ class BaseDHT(KRPC):
         """
         msg["t"] = self.tid[0]
         self.tid = self.tiditer.send((msg["q"],id,nid,addr))  #将信息添加到挑战者-响应 链表
+        self._send_num += 1
         self.send_msg(msg, addr)    
 
+    def outstanding(self,t):
+        """判断回复的t是否正在等待回复，用于在解码前丢弃过期或者虚假的回复
+        Args:
+            t: 回复的t
+        Returns:
+            True: 挑战者-响应链表中有该请求
+            False: 请求已经超时、已经回复或者不存在
+        """
+        if len(t) != 2:
+            return False
+        return self.tidlink.getitem(unpack("!H",t)[0]) is not None
+
+    def _tid_timeout(self,info):
+        """根据节点的往返时间计算请求的超时时间
+        Args:
+            info: 发送的信息(q,id,nid,addr)
+        """
+        return self.table.timeout(info[2],info[3])
+
+    def _on_rtt(self,info,rtt):
+        """收到回复后记录往返时间，并按照RTT_COUNT_RANGE分段统计往返时间的分布
+        Args:
+            info: 当时发送的信息(q,id,nid,addr)
+            rtt: 请求的往返时间
+        """
+        self.table.rtt(info[2],info[3],rtt)
+        for limit in RTT_COUNT_RANGE:
+            if rtt < limit:
+                incr(netcount,"rtt","<%gs"%limit)
+                return
+        incr(netcount,"rtt",">=%gs"%RTT_COUNT_RANGE[-1])
+
+    @count(netcount,"timeout")
+    def _on_tid_timeout(self,info):
+        """请求超时的处理，将节点的失误反馈到路由表中，并通知发送请求的任务
+        Args:
+            info: 当时发送的信息(q,id,nid,addr)
+        """
+        self.table.miss(info[2],info[3])
+        task = self.taskline[info[0]][info[1]]
+        if task is not None:
+            task.fail((info[2],info[3]))
+
+    def auto_expire_tid(self):
+        """每隔TID_WHEEL_TICK秒推进挑战-响应者链表的时间轮，回收超时的请求"""
+        while 1:
+            sleep(TID_WHEEL_TICK)
+            self.tidlink.expire()
+
     def _task_start(self):
         """对任务的处理
         获取任务映射关系的键值和操作
-        从管道中取出任务，让程序去执行任务，在子类中设置各种处理的操作
-        Notes:
-            目前管道没有加锁操作，使用try防止对管道进行添加、删除操作后，
-            遍历管道报错
+        每次唤醒时补充节拍器的令牌，按照每个任务管道可以发送的次数执行管道内的任务，
+        处理完成后发送队列中所有的信息，再按照节拍器计算的时间休眠，
+        没有任务发送时休眠PACER_IDLE_TIME，避免空转
         """
-        sleep_time = float(1)/PER_SECOND_MAX_TIME
         while 1:
-            sleep(sleep_time)
-            try:
-                for tubename,func in self._task_map.iteritems():
-                    self.taskline[tubename].resize()
-                    for task in self.taskline[tubename].tubes:
-                            func(task)
-            except:
-                pass
+            self.pacer.refill()
+            sent = 0
+            for tubename,func in self._task_map.items():
+                tubes = self.taskline[tubename]
+                tubes.resize()
+                sent += self._run_tube(tubename,list(tubes.tubes),func)
+            self.flush()
+            sleep(self.pacer.delay(sent))
+
+    def _run_tube(self,tubename,tasks,func):
+        """轮流执行任务管道内的任务，直到用完管道本次可以发送的次数，
+        或者一轮下来没有任务发送，下次从本次停止的位置开始执行，保证任务之间的公平
+        Args:
+            tubename: 任务管道的名称
+            tasks: 任务管道内所有的任务
+            func: 任务的处理方式
+        Returns:
+            本次发送的次数
+        """
+        budget = self.pacer.available(tubename)
+        if not (tasks and budget):
+            return 0
+        start = self._send_num
+        offset = self._task_offsets.get(tubename,0) % len(tasks)
+        while 1:
+            before = self._send_num
+            for step in xrange(len(tasks)):
+                if self._send_num - start >= budget:
+                    break
+                try:
+                    func(tasks[(offset + step) % len(tasks)])
+                except:
+                    logging.exception("任务执行出错:任务管道tubes -> %s"%tubename)
+            else:
+                step = len(tasks)
+            offset = (offset + step) % len(tasks)
+            if self._send_num == before or self._send_num - start >= budget:
+                break
+        self._task_offsets[tubename] = offset
+        sent = self._send_num - start
+        self.pacer.consume(tubename,sent)
+        return sent
             
-    def show(self):
-        """将统计信息、任务队列映射到共享内存"""
+    def auto_answer_query(self):
+        """等待web进程的查询并回答，查询由query_<kind>方法处理(详见RPCServer)
+        管道可读时不阻塞地读取已经完整的查询，有没有发送完的回复时同时等待管道可写，继续发送回复，
+        web进程超时后不再读取回复时不会阻塞DHT进程，也不影响之后的查询
+        """
+        fileno = self.rpc.fileno()
         while 1:
-            sleep(SYNC_INTERVAL_TIME)
+            readable,writable,_ = select([fileno],[fileno] if self.rpc.pending else [],[])
             try:
-                sync["netcount"] = netcount
-                sync["taskline"] = taskline
-                logging.info("update [netcount] [taskline] ok")
-            except:
-                logging.warn("error in update [netcount] [taskline]")
+                if writable:
+                    self.rpc.flush()
+                if readable:
+                    self.rpc.answer()
+            except (IOError,OSError,EOFError) as e:
+                logging.warn("查询管道出错:%s"%str(e))
+                break
+
+    def query_count(self,*path):
+        """统计树下path路径的统计(包括按时间展开的部分)"""
+        res = netcount
+        for index,key in enumerate(path):
+            if key not in res:
+                return {
+                    "KeyError":"the key [%s] is not in %s"%(key,"/".join(("count",) + path[:index]))
+                }
+            res = res[key]
+        return res.status
+
+    def query_task(self,tubes = None,id = None):
+        """任务队列的状态
+        Args:
+            tubes: 任务类型，为None时返回所有管道的状态
+            id: 任务唯一标识，为None时返回整个管道的状态
+        Returns:
+            状态字典，任务不存在时返回None
+        """
+        if tubes is None:
+            return self.taskline.status
+        tube = self.taskline.mqueue.get(tubes)
+        if id is None:
+            return tube.status if tube is not None else {"length":0,"detail":[]}
+        task = tube[id] if tube is not None else None
+        return task.status if task is not None else None
+
+    def query_table(self,index = None):
+        """路由表的状态
+        Args:
+            index: KBucket桶的位置，为None时返回路由表的概况(不包括节点的信息)
+        Returns:
+            状态字典，桶不存在时返回None
+        """
+        buckets = self.table.buckets
+        if index is None:
+            return {
+                "length":len(buckets),
+                "nodes_num":len(self.table),
+                "detail":[
+                    {"length":bucket.length,"range":bucket.ranges,"canSplit":bucket.canSplit()}
+                    for bucket in buckets
+                ]
+            }
+        if 0 <= index < len(buckets):
+            return buckets[index].status
+
+    def query_pacer(self):
+        """发送节拍器的状态"""
+        return self.pacer.status
+
+    def query_sync(self):
+        """回答查询的开销"""
+        return {"rpc":self.rpc.status}
+
+    def auto_tick_count(self):
+        """每隔COUNT_TICK_INTERVAL秒更新统计的当前分钟路径(详见tick)"""
+        while 1:
+            sleep(COUNT_TICK_INTERVAL)
+            tick()
 
     def start_dht(self):
         """启动DHT网络"""
         gevent.joinall(
             [
                 gevent.spawn(self.auto_check_table),
+                gevent.spawn(self.auto_save_table),
+                gevent.spawn(self.auto_expire_tid),
                 gevent.spawn(self._task_start),
-                gevent.spawn(self.show),
+                gevent.spawn(self.auto_answer_query),
+                gevent.spawn(self.auto_tick_count),
                 gevent.spawn(self.auto_check_task),
                 gevent.spawn(self.serve_forever)
              ]
@@ -158,39 +355,117 @@ class BaseDHT(KRPC):
 
     
     def auto_check_table(self):
-        """每隔NODE_CHECK_INTERVAL_TIME秒对路由表进行检查，将需要检测的节点放入到任务管道中"""
+        """每隔NODE_CHECK_INTERVAL_TIME秒从路由表中取出到了检测时间的节点，
+        在下一个间隔内平均地放入到ping任务中，避免一次性放入造成发送突增，
+        同时统计因为被动刷新而省去的ping次数
+        """
+        avoided = self.table.avoided
         while 1:
-            sleep(NODE_CHECK_INTERVAL_TIME) 
             task = self.taskline("ping").get("ping")
             if task is None:raise SystemError,"没有添加默认ping任务"
             need_check_nodes = self.table.need_check()
+            if self.table.avoided != avoided:
+                incr(netcount,"refresh","avoided",num=self.table.avoided - avoided)
+            avoided = self.table.avoided
+            if not need_check_nodes:
+                sleep(NODE_CHECK_INTERVAL_TIME)
+                continue
+            step = NODE_CHECK_INTERVAL_TIME/float(len(need_check_nodes))
             for node in need_check_nodes:
-                nid,addr = node.body
-                task.put(("ping",(nid, addr)))
+                task.put(node.body)
+                sleep(step)
     
+    def load_table(self):
+        """从快照恢复路由表，恢复的节点数量达到MIN_STOP_BOOT_LENGTH后，
+        任务直接从路由表启动，不需要再通过启动节点启动
+        Returns:
+            恢复的节点数量
+        """
+        if not TABLE_SNAPSHOT_PATH:return 0
+        try:
+            snapshot = _ksnapshot.load(TABLE_SNAPSHOT_PATH)
+        except (IOError,OSError,ValueError) as e:
+            logging.warn("读取路由表快照失败:%s"%str(e))
+            return 0
+        if snapshot is None:return 0
+        num = self.table.restore(snapshot[1])
+        logging.info("从路由表快照恢复了%d个节点"%num)
+        return num
+
+    def save_table(self):
+        """保存路由表快照，在当前协程中生成快照，在线程池中写入文件，不阻塞其他协程"""
+        data = self.table.snapshot()
+        try:
+            gevent.get_hub().threadpool.apply(_ksnapshot.save,(TABLE_SNAPSHOT_PATH,data))
+        except (IOError,OSError) as e:
+            logging.warn("保存路由表快照失败:%s"%str(e))
+
+    def auto_save_table(self):
+        """每隔TABLE_SNAPSHOT_INTERVAL秒保存一次路由表快照"""
+        if not TABLE_SNAPSHOT_PATH:return
+        while 1:
+            sleep(TABLE_SNAPSHOT_INTERVAL)
+            self.save_table()
+
+    def control(self,commands):
+        """执行一批任务控制命令，默认任务(find_node自己的nid、ping)不可更改
+        Notes:
+            每个命令单独检查，格式错误的命令不影响同一批的其他命令:
+            操作和任务类型必须是字符串，任务类型必须是会被执行的任务类型(_task_map)，
+            任务唯一标识id必须是NID_LENGTH位的字符串
+        Args:
+            commands: [(操作,(任务类型,任务唯一标识id)),...]
+        Returns:
+            [结果,...]: 每个命令的结果(详见TaskLine.control)，
+                默认任务为forbidden，格式错误的命令为invalid
+        """
+        results = []
+        for command in commands:
+            try:
+                action,(tubes,id) = command
+            except (TypeError,ValueError):
+                results.append("invalid")
+                continue
+            if not (isinstance(action,str) and isinstance(tubes,str) and isinstance(id,str)):
+                results.append("invalid")
+                continue
+            if tubes == "ping" and id == "ping":
+                results.append("forbidden")
+                continue
+            if tubes not in self._task_map or len(id) != NID_LENGTH:
+                results.append("invalid")
+                continue
+            if tubes == "find_node" and id == self.nid:
+                results.append("forbidden")
+                continue
+            results.append(self.taskline.control(action,tubes,id))
+        if results:
+            logging.info("任务控制命令%d个:%s"%(len(results),dict(Counter(results))))
+        return results
+
+    def query_control(self,commands):
+        """执行web进程发送的一批任务控制命令，返回每个命令的结果(详见control)"""
+        return self.control(commands)
+
     def auto_check_task(self):
-        """"""
+        """等待任务控制管道中的命令，每次唤醒时执行管道中所有的命令，
+        管道中的每条信息可以是一个命令(操作,(任务类型,任务唯一标识id))或者一批命令的列表
+        """
         while 1:
-            sleep(CONTROL_INTERVAL_TIME)
             if control_out.closed:
                 logging.warn("任务控制输出端被关闭")
                 break
-            if not control_out.poll():continue
-            control = control_out.recv()
-            if (control[1][0] == "find_node" and control[1][1] == self.nid) or (control[1][0] == "ping" and control[1][1] == "ping"):
-                logging.debug("原始任务不可设置,管道 -> %s,任务 -> %s,设置 -> %s,禁止(原始任务不可更改)")
-                continue
-            res = getattr(self.taskline, control[0])(*control[1])
-            if res:
-                logging.info("任务设置成功,管道 -> %s,任务 -> %s,设置 -> %s，成功True")
-            elif res is None:
-                logging.error("任务设置失败,管道 -> %s,任务 -> %s,设置 -> %s，失败Flase(任务不存在)")
-            else:
-                logging.debug("任务已经存在,管道 -> %s,任务 -> %s,设置 -> %s，失败Flase(任务已经存在)")
-
-                
-
-
+            wait_read(control_out.fileno())
+            try:
+                while control_out.poll():
+                    control = control_out.recv()
+                    try:
+                        self.control(control if isinstance(control,list) else [control])
+                    except Exception:
+                        logging.exception("任务控制命令执行出错:%r"%(control,))
+            except (IOError,OSError,EOFError) as e:
+                logging.warn("任务控制管道出错:%s"%str(e))
+                break
 
 
 class S_Handle(BaseDHT):
@@ -296,35 +571,74 @@ class S_Handle(BaseDHT):
     
     def find_node(self,task):
         """find_node一个任务
-        从任务队列中取出一个需要执行的任务
-        如果任务队列中有任务，则进行find_node操作
-        如果没有任务，则进行任务初始化
+        对任务进行控制后，查找任务按照查找的状态执行一步(详见lookup)，
+        普通任务(寻找自己的节点)从任务队列中取出一个需要执行的任务进行find_node操作，
+        没有任务时进行任务初始化
         Args:
             task: 需要操作的任务管道
         """
         self.control_find_node(task)      
         if not task.started:return
+        if isinstance(task,LookupTask):
+            self.lookup(task,self._find_node)
+            return
         taskitem = task.get()
         if taskitem:
             self._find_node(task.id, *taskitem)
         else:
-            self.boot_task(task) 
+            self.boot_task(task)
     
     def get_peers(self,task):
         """get_peers一个任务
-        从任务队列中取出一个需要执行的任务
-        如果任务队列中有任务，则进行get_peers操作
-        如果没有任务，则进行任务初始化
+        对任务进行控制后，按照查找的状态执行一步(详见lookup)
         Args:
             task: 需要操作的任务管道
         """
         self.control_get_peers(task)
         if not task.started:return
-        taskitem = task.get()
+        self.lookup(task,self._get_peers)
+
+    def lookup(self,task,send):
+        """查找任务的一步
+        如果任务有需要请求的节点，则发送请求
+        如果没有等待回复的请求，也没有收到过回复，则进行任务初始化
+        如果最近的k个节点都已经回复，则完成任务
+        其他情况(等待回复的请求已满)不做操作
+        距离相近的候选节点中优先请求往返时间短的节点(详见LookupTask.get)
+        Args:
+            task: 需要操作的任务
+            send: 发送请求的方式 send(id,nid,addr)
+        """
+        taskitem = task.get(self._latency)
         if taskitem:
-            self._get_peers(task.id, *taskitem)
-        else:
-            self.boot_task(task) 
+            send(task.id, *taskitem)
+        elif task.inflight:
+            return
+        elif not task.responded:
+            self.boot_task(task)
+        elif task.finished:
+            self._on_lookup_done(task)
+
+    def _latency(self,item):
+        """查找任务中候选节点的预计延时，使用节点(或者所在/24网段)的平滑往返时间，
+        请求超时时间有下限，不能区分低延时的节点，因此不使用超时时间，
+        没有测量过往返时间的节点排在最后
+        Args:
+            item: 候选节点(nid,addr)
+        """
+        srtt = self.table.srtt(item[0],item[1])
+        return float("inf") if srtt is None else srtt
+
+    @count(netcount,"lookup","done")
+    def _on_lookup_done(self,task):
+        """查找任务完成，暂停任务，on_lookup_done为扩展接口"""
+        task.stop()
+        logging.info("查找任务完成:任务的id -> %s,请求次数 -> %d,回复次数 -> %d"%(task.id.encode("hex"),task.queried,task.responded))
+        self.on_lookup_done(task)
+
+    def on_lookup_done(self,task):
+        """查找任务完成的扩展接口，在使用时自己添加"""
+        pass
 
     def boot_task(self,task):
         """任务初始化
@@ -372,7 +686,9 @@ class R_Handle(BaseDHT):
             msg: 收到的进行bencode解码后的信息
             addr: 收到的节点网络地址
         Returns:
-            info: 挑战响应链表中取出当时发送的信息
+            (info,rtt)
+                info: 挑战响应链表中取出当时发送的信息
+                rtt: 请求的往返时间
             None: 收到错误的回复信息
         """
         if not (isinstance(msg["r"],dict) and msg["r"].has_key("id")):
@@ -385,7 +701,13 @@ class R_Handle(BaseDHT):
             return
         try:
             info = self.tidlink[index]
-            if (msg["r"]["id"]==info[2] and addr==info[3]) or info[2] is None:return info
+            if info is None:
+                logging.debug("收到过期的回复信息:来自%s,信息响应t -> %s,请求已经超时或者已经回复"%(str(addr),msg["t"]))
+                return
+            if (msg["r"]["id"]==info[2] and addr==info[3]) or info[2] is None:
+                rtt = self.tidlink.elapsed(index)
+                self.tidlink.pop(index)
+                return info,rtt
             logging.debug("收到虚假的回复信息:来自%s,信息响应t -> %s,不存在于挑战响应链表"%(str(addr),msg["t"]))
         except IndexError:
             logging.debug("收到虚假的回复信息:来自%s,信息响应t -> %s,不存在于挑战响应链表,索引超过链表长度"%(str(addr),msg["t"]))
@@ -404,11 +726,13 @@ class R_Handle(BaseDHT):
             msg: 收到的进行bencode解码后的信息
             addr: 收到的节点网络地址
         """
-        info = self._check_r_msg_uptable(msg, addr)
-        if not info:
+        res = self._check_r_msg_uptable(msg, addr)
+        if not res:
             self.r_error(msg, addr)
             return
+        info,rtt = res
         if info[2] is not None :self.table.push((msg["r"]["id"],addr[0],addr[1]))
+        self._on_rtt(info,rtt)
         func = self._r_handle.get(info[0])
         if not func:
             logging.error("未定义处理方式:func -> %s 未在_r_handle 中定义相应的处理方式"%info[0])
@@ -417,6 +741,7 @@ class R_Handle(BaseDHT):
         if task is None:
             logging.info("任务已被移除:任务管道tubes -> %s,任务的id -> %s"%(info[0],info[1]))
             return
+        task.done((info[2],info[3]))
         func(task,msg,addr)     
         
     @count(netcount,"recv","r","ping")
@@ -490,7 +815,17 @@ class R_Handle(BaseDHT):
     
 
 class Q_Handle(BaseDHT):
-    """对收到的请求信息的处理方式"""
+    """对收到的请求信息的处理方式
+    Notes:
+        回复的结构是固定的，只有t、id、nodes会变化，回复时使用预先编码好的键值，
+        通过一次拼接完成编码(详见_send_r)
+    Attributes:
+        _r_keys: 回复中用到的键值的bencode编码
+        _token: get_peers回复中的token
+        refresh: 收到请求时被动刷新路由表中的请求节点
+    """
+    _r_keys = dict((key,"%d:%s"%(len(key),key)) for key in ("id","nodes","token"))
+    _token = "aoeusnth"
     
     def __init__(self,port):
         """添加响应请求的映射关系(KRPC中)，初始收到请求的关系映射表"""
@@ -513,12 +848,41 @@ class Q_Handle(BaseDHT):
             logging.debug("收到错误的请求信息:来自%s,请求方式q -> %s,请求信息类型 -> %s"%(str(addr),msg.get("q"),type(msg.get("a"))))
             self.q_error(msg, addr)
             return
+        self.refresh(msg["a"]["id"],addr)
         func = self._q_handle.get(msg["q"])
         if not func:
             logging.debug("未定义的信息方式:信息方式q -> %s,没有被定义相应的处理方式"%msg["q"])
             return
         func(msg,addr) 
+
+    def refresh(self,nid,addr):
+        """收到请求的节点在线，被动刷新路由表中的该节点，推后节点的下次检测时间(详见KTable.refresh)，
+        统计被动刷新的次数
+        Args:
+            nid: 请求中节点的唯一标识
+            addr: 请求节点的网络地址
+        """
+        if self.table.refresh(nid,addr):
+            incr(netcount,"refresh","passive")
     
+    def _send_r(self,t,addr,*items):
+        """使用预先编码好的键值回复请求，
+        只需要将t和回复的内容通过一次拼接完成编码，
+        t或者回复的内容不是字符串时，使用send_msg进行回复
+        Args:
+            t: 请求的t
+            addr: 请求节点的网络地址
+            items: 回复的内容(key,value),(key,value),...，必须按照key排好序
+        """
+        if type(t) is str and all(type(value) is str for key,value in items):
+            parts = ["d1:rd"]
+            for key,value in items:
+                parts += (self._r_keys[key],str(len(value)),":",value)
+            parts += ("e1:t",str(len(t)),":",t,"1:y1:re")
+            self.send_data("".join(parts),addr)
+        else:
+            self.send_msg({"t":t,"y":"r","r":dict(items)},addr)
+
     @count(netcount,"recv","q","error")
     def q_error(self,msg,addr):
         """"""
@@ -528,14 +892,7 @@ class Q_Handle(BaseDHT):
     def on_ping(self,msg,addr):
         """对ping请求进行回复，正常响应
         """
-        msg = {
-                "t":msg["t"],
-                "y":"r",
-                "r":{
-                    "id":self.getnid(msg["a"]["id"]),
-                }
-            }
-        self.send_msg(msg, addr)
+        self._send_r(msg["t"],addr,("id",self.getnid(msg["a"]["id"])))
     
     @count(netcount,"recv","q","find_node")
     def on_find_node(self,msg,addr):
@@ -543,15 +900,7 @@ class Q_Handle(BaseDHT):
         if not msg["a"].has_key("target"):return
         target = msg["a"]["target"]
         nodes = self.table.find_node2chrall(target)
-        msg = {
-            "t":msg["t"],
-            "y":"r",
-            "r":{
-                "id":self.getnid(msg["a"]["id"]),
-                "nodes":nodes
-            }
-        }
-        self.send_msg(msg, addr)
+        self._send_r(msg["t"],addr,("id",self.getnid(msg["a"]["id"])),("nodes",nodes))
         
     @count(netcount,"recv","q","get_peers")
     def on_get_peers(self,msg,addr):
@@ -560,30 +909,14 @@ class Q_Handle(BaseDHT):
         self._on_get_peers_info(msg["a"], addr)
         target = msg["a"]["info_hash"]
         nodes = self.table.find_node2chrall(target)
-        msg = {
-            "t":msg["t"],
-            "y":"r",
-            "r":{
-                "id":self.getnid(msg["a"]["id"]),
-                "nodes":nodes,
-                "token":"aoeusnth"
-            }
-        }
-        self.send_msg(msg, addr)
+        self._send_r(msg["t"],addr,("id",self.getnid(msg["a"]["id"])),("nodes",nodes),("token",self._token))
     
     @count(netcount,"recv","q","announce_peer")
     def on_announce_peer(self,msg,addr):
         """对announce_peer请求进行回复，正常响应"""
         if not msg["a"].has_key("info_hash"):return
         self._on_announce_peer_info(msg["a"], addr)        
-        msg = {
-            "t":msg["t"],
-            "y":"r",
-            "r":{
-                "id":self.nid,
-            }
-        }
-        self.send_msg(msg, addr)    
+        self._send_r(msg["t"],addr,("id",self.nid))
     
     @count(netcount,"collect","get_peers")
     def _on_get_peers_info(self,info,addr):
@@ -632,7 +965,19 @@ class NormalDHT(S_Handle,R_Handle,Q_Handle,E_Handle):
 
 ########################################################################
 class DHTSpider(NormalDHT):
-    """"""
+    """爬虫模式，find_node任务不需要收敛，使用普通任务不断的认识新节点
+    find_node回复中的节点同时放入路由表之外的节点池，任务为空时从节点池中随机取出节点请求，
+    不再只依赖路由表中少量的节点
+    Attributes:
+        pool: 节点池(详见NodePool)
+    """
+    task_classes = {"find_node":Task,"get_peers":LookupTask}
+
+    def __init__(self,*args):
+        """初始化节点池"""
+        self.pool = NodePool(SPIDER_POOL_MAX_LENGTH)
+        super(DHTSpider,self).__init__(*args)
+
     #----------------------------------------------------------------------
     def getnid(self,nid = None):
         """"""
@@ -652,7 +997,26 @@ class DHTSpider(NormalDHT):
         if taskitem:
             self._find_node(task.id, *taskitem)
         else:
-            self.boot_task(task) 
+            self.feed_task(task)
+
+    def feed_task(self,task):
+        """从节点池中随机取出SPIDER_POOL_BATCH个节点放入任务，节点池为空时进行任务初始化
+        Args:
+            task: 需要操作的任务管道
+        """
+        items = self.pool.pick(SPIDER_POOL_BATCH)
+        if not items:
+            self.boot_task(task)
+            return
+        for item in items:
+            task.put(item)
+
+    def r_find_node(self,task,msg,addr):
+        """将回复中的节点放入节点池，再按照正常模式处理(详见R_Handle.r_find_node)"""
+        nodes = msg["r"].get("nodes")
+        if isinstance(nodes,str):
+            self.pool.add_nodes(nodes)
+        super(DHTSpider,self).r_find_node(task,msg,addr) 
         
         
     
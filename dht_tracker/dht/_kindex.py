@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+路由表节点的数组索引
+将路由表内所有节点的160位nid拆成三列无符号64位整数(高64位、中64位、低32位)保存在numpy数组中，
+查找与target最近的k个节点时对整列进行异或，先按高64位选出候选节点，
+再对候选节点按三列排序，不需要对所有的节点排序
+numpy为可选依赖，没有安装时available为False，路由表使用纯Python的查找方式
+"""
+from struct import unpack
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#numpy是否可用
+available = numpy is not None
+
+
+class NodeIndex(object):
+    """路由表节点的数组索引
+    Notes:
+        节点在数组中的位置是连续的，移除节点时用最后一个节点填补空位，
+        数组容量不足时按两倍扩容
+    Attributes:
+        add: 添加一个节点
+        remove: 移除一个节点
+        closest: 与target最近的k个节点(按距离排序)
+    """
+    _capacity = 1024
+
+    def __init__(self):
+        """初始化一个空的索引"""
+        self._size = 0
+        self._high = numpy.zeros(self._capacity,dtype=numpy.uint64)
+        self._middle = numpy.zeros(self._capacity,dtype=numpy.uint64)
+        self._low = numpy.zeros(self._capacity,dtype=numpy.uint64)
+        self._nodes = []
+        self._slots = dict()
+
+    def _grow(self):
+        """数组容量扩大为两倍"""
+        capacity = len(self._high)*2
+        for name in ("_high","_middle","_low"):
+            column = numpy.zeros(capacity,dtype=numpy.uint64)
+            column[:self._size] = getattr(self,name)[:self._size]
+            setattr(self,name,column)
+
+    def add(self,node):
+        """添加一个节点，已经存在的节点将被替换
+        Args:
+            node: KNode节点
+        """
+        if node.nid in self._slots:
+            self.remove(node.nid)
+        if self._size == len(self._high):
+            self._grow()
+        slot = self._size
+        self._high[slot],self._middle[slot],self._low[slot] = unpack("!QQI",node.nid)
+        self._nodes.append(node)
+        self._slots[node.nid] = slot
+        self._size += 1
+
+    def remove(self,nid):
+        """移除一个节点，用最后一个节点填补空位
+        Args:
+            nid: 节点的唯一标识
+        Returns:
+            True: 节点已经移除
+            None: 索引中没有该节点
+        """
+        slot = self._slots.pop(nid,None)
+        if slot is None:
+            return None
+        last = self._size - 1
+        if slot != last:
+            node = self._nodes[last]
+            self._high[slot] = self._high[last]
+            self._middle[slot] = self._middle[last]
+            self._low[slot] = self._low[last]
+            self._nodes[slot] = node
+            self._slots[node.nid] = slot
+        self._nodes.pop()
+        self._size = last
+        return True
+
+    def closest(self,target,k):
+        """与target最近的k个节点
+        Args:
+            target: 需要查找的node.nid或者peer.info_hash(20位)
+            k: 返回节点的最大数量
+        Returns:
+            [KNode,KNode,...]: 按与target的距离由近到远排序
+        """
+        size = self._size
+        if not size:
+            return []
+        high,middle,low = [numpy.uint64(part) for part in unpack("!QQI",target)]
+        dist = self._high[:size] ^ high
+        if size > k:
+            candidates = self._candidates(dist,k)
+        else:
+            candidates = numpy.arange(size)
+        order = numpy.lexsort((
+            self._low[candidates] ^ low,
+            self._middle[candidates] ^ middle,
+            dist[candidates]
+        ))[:k]
+        nodes = self._nodes
+        return [nodes[i] for i in candidates[order]]
+
+    def _candidates(self,dist,k):
+        """按高64位的距离选出候选节点，候选节点中一定包含最近的k个节点
+        nid是均匀分布的，第k近的节点的距离约为 k/size*2**64，
+        先用4倍的估计值作为上限进行比较，候选节点不足k个时再对整列进行partition
+        Args:
+            dist: 所有节点高64位与target的距离
+            k: 返回节点的最大数量
+        Returns:
+            候选节点在数组中的位置
+        """
+        bits = (4*k*2**64//len(dist)).bit_length()
+        if bits < 64:
+            candidates = numpy.flatnonzero(dist < numpy.uint64(1 << bits))
+            if len(candidates) >= k:
+                return candidates
+        kth = numpy.partition(dist,k-1)[k-1]
+        return numpy.flatnonzero(dist <= kth)
+
+    def __len__(self):
+        """索引中节点的数量"""
+        return self._size
+
+    def __contains__(self,nid):
+        """判断节点是否在索引中"""
+        return nid in self._slots
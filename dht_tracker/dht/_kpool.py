@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+爬虫模式的节点池
+路由表每个桶只保存少量的节点，爬虫收到的大部分节点都会被丢弃，
+节点池在路由表之外保存大量的节点，爬虫从中随机取出节点发送find_node请求
+节点以26位的字符串形式(与find_node回复中的格式相同)连续保存在bytearray中，
+最后一次见到的时间保存在array中，按nid和地址分别去重，
+达到最大数量后按照CLOCK算法淘汰节点(最近再次见到的节点有一次被跳过的机会)
+"""
+from array import array
+from random import randrange
+from socket import inet_ntoa
+from struct import unpack
+from time import time
+
+#节点记录的长度
+RECORD_LENGTH = 26
+
+
+class NodePool(object):
+    """节点池
+    Notes:
+        每个节点固定占用26位的记录、8位的时间和1位的标记，
+        另外nid和地址的去重字典每个节点约占用250位
+    Attributes:
+        capacity: 节点池的最大数量
+        status: 节点池的状态
+        add: 加入一个节点
+        add_nodes: 加入find_node回复中的nodes
+        pick: 随机取出节点
+    """
+
+    def __init__(self,capacity):
+        """初始化一个空的节点池
+        Args:
+            capacity: 节点池的最大数量
+        """
+        self._capacity = capacity
+        self._records = bytearray()
+        self._seen = array("d")
+        self._refs = bytearray()
+        self._nids = dict()
+        self._addrs = dict()
+        self._hand = 0
+        self._added = 0
+        self._evicted = 0
+
+    @property
+    def capacity(self):
+        """节点池的最大数量"""
+        return self._capacity
+
+    @property
+    def status(self):
+        """节点池的状态
+        Returns:
+            length: 节点的数量
+            capacity: 节点池的最大数量
+            added: 累计加入的新节点数量
+            evicted: 累计淘汰的节点数量
+        """
+        return {
+            "length":len(self),
+            "capacity":self._capacity,
+            "added":self._added,
+            "evicted":self._evicted
+        }
+
+    def add(self,record,now = None):
+        """加入一个节点，nid或者地址已经存在时更新原来的记录
+        Args:
+            record: 节点26位的字符串形式
+            now: 见到节点的时间，默认为time()
+        Returns:
+            True: 加入了新的节点
+            False: 更新了已经存在的节点
+        """
+        now = time() if now is None else now
+        nid,addr = record[:20],record[20:]
+        slot = self._nids.get(nid)
+        if slot is None:
+            slot = self._addrs.get(addr)
+        if slot is not None:
+            self._replace(slot,record)
+            self._seen[slot] = now
+            self._refs[slot] = 1
+            return False
+        if len(self._seen) < self._capacity:
+            slot = len(self._seen)
+            self._records += record
+            self._seen.append(now)
+            self._refs.append(0)
+        else:
+            slot = self._victim()
+            self._replace(slot,record)
+            self._seen[slot] = now
+            self._refs[slot] = 0
+            self._evicted += 1
+        self._nids[nid] = slot
+        self._addrs[addr] = slot
+        self._added += 1
+        return True
+
+    def add_nodes(self,nodes,now = None):
+        """加入find_node回复中的nodes，端口为0的节点不加入
+        Args:
+            nodes: 节点26位字符串形式拼接的字符串
+            now: 见到节点的时间，默认为time()
+        Returns:
+            加入的新节点的数量
+        """
+        if len(nodes) % RECORD_LENGTH:
+            return 0
+        now = time() if now is None else now
+        added = 0
+        for offset in xrange(0,len(nodes),RECORD_LENGTH):
+            record = nodes[offset:offset+RECORD_LENGTH]
+            if record[24:] != "\0\0" and self.add(record,now):
+                added += 1
+        return added
+
+    def _replace(self,slot,record):
+        """用新的记录覆盖slot位置的记录，移除旧记录在去重字典中的索引"""
+        start = slot*RECORD_LENGTH
+        old = str(self._records[start:start+RECORD_LENGTH])
+        if old == record:
+            return
+        if self._nids.get(old[:20]) == slot:
+            del self._nids[old[:20]]
+        if self._addrs.get(old[20:]) == slot:
+            del self._addrs[old[20:]]
+        self._records[start:start+RECORD_LENGTH] = record
+        self._nids[record[:20]] = slot
+        self._addrs[record[20:]] = slot
+
+    def _victim(self):
+        """按照CLOCK算法选出需要淘汰的节点的位置，
+        被标记的节点(加入后再次见到)清除标记后跳过一次
+        """
+        refs = self._refs
+        hand = self._hand
+        while refs[hand]:
+            refs[hand] = 0
+            hand = (hand + 1) % self._capacity
+        self._hand = (hand + 1) % self._capacity
+        return hand
+
+    def _node(self,slot):
+        """slot位置的节点(nid,(ip,port))"""
+        start = slot*RECORD_LENGTH
+        record = str(self._records[start:start+RECORD_LENGTH])
+        return record[:20],(inet_ntoa(record[20:24]),unpack("!H",record[24:])[0])
+
+    def pick(self,num):
+        """随机取出节点(可能重复)，节点不会从节点池中移除
+        Args:
+            num: 取出的节点数量
+        Returns:
+            [(nid,(ip,port)),(nid,(ip,port)),...]
+        """
+        size = len(self._seen)
+        if not size:
+            return []
+        return [self._node(randrange(size)) for i in xrange(num)]
+
+    def seen(self,nid):
+        """节点最后一次见到的时间
+        Returns:
+            最后一次见到的时间，节点不在节点池中返回None
+        """
+        slot = self._nids.get(nid)
+        if slot is not None:
+            return self._seen[slot]
+
+    def __len__(self):
+        """节点池中节点的数量"""
+        return len(self._seen)
+
+    def __contains__(self,nid):
+        """判断节点是否在节点池中"""
+        return nid in self._nids
@@ -4,10 +4,16 @@
 对http://www.bittorrent.org/beps/bep_0005.html中KRPC Protocol的实现，
 实现对发送信息的编码以及对接收信息的解码
 对接收信息基本格式的检验，并对格式不正确的自动进行error回复
+可选的批量收发模式，一次读取socket中的多个数据包，在一个greenlet中依次处理，
+需要发送的信息先放入发送队列，处理完一批后一起发送
+解码前先通过原始字节对信息进行预过滤，丢弃明显不是KRPC的信息和不是在等待的回复，
+丢弃的原因统计在netcount["drop"]中
 """
 import logging
 from gevent.server import DatagramServer
-from ..common import Dict,bdumps,bloads,netcount,count
+from ._udpbatch import UDPBatch
+from ..common import Dict,bdumps,bloads,kdumps,kloads,netcount,count,incr
+from ..config import KRPC_CODEC,KRPC_BATCH_IO,KRPC_BATCH_SIZE,KRPC_PREFILTER,KRPC_MAX_LENGTH
 
 class KRPC(DatagramServer):
     """KRPC的实现
@@ -16,12 +22,21 @@ class KRPC(DatagramServer):
     对格式不正确的信息进行自动error回复
     Attributes:
         error_msg: 官方定义的错误信息集合
+        loads: 信息的解码方式，由KRPC_CODEC决定
+        dumps: 信息的编码方式，由KRPC_CODEC决定
+        batch_io: 是否使用批量收发，由KRPC_BATCH_IO决定
+        use_prefilter: 是否在解码前进行预过滤，由KRPC_PREFILTER决定
         _auto_handle: 对于响应的处理映射关系表
         _default_handle: 对于找不到响应处理方式的默认处理方式
         handle_func: 已经设置的处理方式的键值
         add_handle: 添加处理方式
         handle: 对于udp收到的所有信息的处理
+        prefilter: 解码前通过原始字节对信息进行分类，返回丢弃的原因
+        outstanding: 判断回复的t是否正在等待回复的扩展接口，在使用时自己添加
         send_msg: 对需要发送的信息进行编码，并通过udp发送到相应的网络地址
+        send_data: 将已经编码好的信息通过udp发送到相应的网络地址
+        handle_batch: 批量收发模式下对收到的一批信息的处理
+        flush: 批量收发模式下发送队列中所有的信息
     """
     error_msg = {
         201:[201,'Generic Error'],
@@ -29,6 +44,11 @@ class KRPC(DatagramServer):
         203:[203,'Protocol Error, such as a malformed packet, invalid arguments, or bad token'],
         204:[204,'Method Unknown']
     }    
+    loads = staticmethod(kloads if KRPC_CODEC == "krpc" else bloads)
+    dumps = staticmethod(kdumps if KRPC_CODEC == "krpc" else bdumps)
+    batch_io = KRPC_BATCH_IO
+    batch_size = KRPC_BATCH_SIZE
+    use_prefilter = KRPC_PREFILTER
 
     def __init__(self,port,default):
         """添加默认的处理方式，对udp服务进行初始设置，初始一个空的响应的处理映射关系表
@@ -39,6 +59,9 @@ class KRPC(DatagramServer):
         self._default_handle = default
         self._set_server(port)
         self._auto_handle = Dict()
+        self._batch = None
+        self._send_queue = []
+        self._flushing = False
     
     @property
     def handle_func(self):
@@ -60,6 +83,45 @@ class KRPC(DatagramServer):
         """
         self.port,self.bind = int(port),":{}".format(port)        
         DatagramServer.__init__(self,self.bind) 
+
+    def init_socket(self):
+        """创建udp socket，批量收发模式下初始化批量收发的缓冲区"""
+        DatagramServer.init_socket(self)
+        if self.batch_io and self._batch is None:
+            self._batch = UDPBatch(self._socket,self.batch_size)
+            logging.info("使用批量收发,单次最大数量 -> %d,recvmmsg/sendmmsg -> %s"%(self.batch_size,self._batch.mmsg))
+
+    def do_read(self):
+        """从socket读取数据，批量收发模式下一次读取一批数据包
+        Returns:
+            (data,addr): 逐个收发模式
+            (packets,): 批量收发模式，packets为[(data,addr),...]
+            None: 没有数据
+        """
+        if self._batch is None:
+            return DatagramServer.do_read(self)
+        packets = self._batch.recv()
+        if packets:
+            return (packets,)
+
+    def do_handle(self,*args):
+        """处理读取到的数据，批量收发模式下一批数据包只启动一个greenlet"""
+        if self._batch is None:
+            return DatagramServer.do_handle(self,*args)
+        self._spawn(self.handle_batch,args[0])
+
+    def handle_batch(self,packets):
+        """批量收发模式下对收到的一批信息的处理，
+        依次处理每个信息，处理完成后发送队列中所有的信息
+        Args:
+            packets: [(data,addr),(data,addr),...]
+        """
+        for data,addr in packets:
+            try:
+                self.handle(data,addr)
+            except:
+                logging.exception("处理信息出错:来自%s"%str(addr))
+        self.flush()
     
     def handle(self,msg,addr):
         """对于udp收到的所有信息的处理
@@ -69,7 +131,12 @@ class KRPC(DatagramServer):
             msg: 接收到的信息
             addr: 接收的网络地址
         """
-        msg = bloads(msg)
+        if self.use_prefilter:
+            reason = self.prefilter(msg)
+            if reason is not None:
+                incr(netcount,"drop",reason)
+                return
+        msg = self.loads(msg)
         if not (isinstance(msg,dict) and msg.has_key("t")):
             self._error_handle(203, addr)
         elif not (msg.has_key("y") and msg.has_key(msg["y"])):
@@ -77,6 +144,77 @@ class KRPC(DatagramServer):
         else:
             self._auto_handle(msg["y"].lower(),self._default_handle)(msg,addr)
     
+    def prefilter(self,data):
+        """解码前通过原始字节对信息进行分类，只丢弃可以确定需要丢弃的信息，
+        无法确定的信息交给完整的解码处理
+            empty: 空的信息
+            oversize: 长度超过KRPC_MAX_LENGTH
+            utp: uTP(BEP29)的数据包
+            not_bencode: 不是以bencode字典开始
+            truncated: 不是以bencode字典结束
+            stale_tid: 回复的t不在等待回复的请求中
+        Args:
+            data: 接收到的原始信息
+        Returns:
+            reason: 丢弃的原因
+            None: 需要进行完整的解码
+        """
+        if not data:
+            return "empty"
+        if len(data) > KRPC_MAX_LENGTH:
+            return "oversize"
+        first = data[0]
+        if first != "d":
+            head = ord(first)
+            if head & 0x0f == 1 and head >> 4 <= 4 and len(data) >= 20:
+                return "utp"
+            return "not_bencode"
+        if data[-1] != "e":
+            return "truncated"
+        if data.endswith("1:y1:re"):
+            t = self._reply_tid(data)
+            if t is not None and not self.outstanding(t):
+                return "stale_tid"
+
+    @staticmethod
+    def _reply_tid(data):
+        """从回复的原始字节中取出t，
+        只处理按照bencode键值顺序以 t[,v],y 结尾的回复: ...e1:t2:XX[1:v4:XXXX]1:y1:re
+        Args:
+            data: 以"1:y1:re"结尾的原始信息
+        Returns:
+            t: 回复的t
+            None: 无法确定回复的t
+        """
+        end = len(data) - 7
+        index = data.rfind("e1:t",max(0,end - 64),end)
+        if index == -1:
+            return None
+        colon = data.find(":",index + 4,end)
+        if colon == -1 or not data[index+4:colon].isdigit():
+            return None
+        tend = colon + 1 + int(data[index+4:colon])
+        if tend == end:
+            return data[colon+1:tend]
+        if data[tend:tend+3] != "1:v":
+            return None
+        vcolon = data.find(":",tend + 3,end)
+        if vcolon == -1 or not data[tend+3:vcolon].isdigit():
+            return None
+        if vcolon + 1 + int(data[tend+3:vcolon]) == end:
+            return data[colon+1:tend]
+
+    def outstanding(self,t):
+        """判断回复的t是否正在等待回复的扩展接口，在使用时自己添加，
+        默认所有的回复都需要进行完整的解码
+        Args:
+            t: 回复的t
+        Returns:
+            True: 需要处理该回复
+            False: 没有在等待该回复，丢弃
+        """
+        return True
+
     @count(netcount,"recv","error")
     def _error_handle(self,code,addr,t = "er"):
         """对接收错误的信息进行相应的error处理"""
@@ -100,11 +238,49 @@ class KRPC(DatagramServer):
                 raise TypeError,"发送的信息必须是dict格式"
             if not msg.has_key("t"):
                 raise KeyError,"发送的信息必须包含key:t"
-            try:
-                self.sendto(bdumps(msg),addr)
-            except:
-                logging.error("网络不可用，或者地址不可用%s"%str(addr))
+            data = self.dumps(msg)
+            if data is None:
+                raise TypeError,"发送的信息不能被编码"
         except:
             logging.warn("发送的信息格式不正确:发送的格式 -> %s,发送的内容 -> %s"%(type(msg),str(msg)))
+            return
+        self.send_data(data,addr)
+
+    def send_data(self,data,addr):
+        """将已经编码好的信息通过udp发送到相应的网络地址
+        Args:
+            data: 已经编码好的信息(type->str)
+            addr: 需要发送到的网络地址
+        """
+        if self._batch is not None:
+            self._send_queue.append((data,addr))
+            if len(self._send_queue) >= self.batch_size:
+                self.flush()
+            return
+        try:
+            self.sendto(data,addr)
+        except:
+            logging.error("网络不可用，或者地址不可用%s"%str(addr))
+
+    def flush(self):
+        """批量收发模式下发送队列中所有的信息，
+        发送缓冲区已满或者地址需要解析时，通过sendto逐个发送(会等待socket可写)
+        """
+        if self._flushing:return
+        self._flushing = True
+        queue = self._send_queue
+        try:
+            while queue:
+                sent = self._batch.send(queue)
+                if sent < len(queue):
+                    data,addr = queue[sent]
+                    try:
+                        self.sendto(data,addr)
+                    except:
+                        logging.error("网络不可用，或者地址不可用%s"%str(addr))
+                    sent += 1
+                del queue[:sent]
+        finally:
+            self._flushing = False
         
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+路由表快照
+将路由表内的节点保存为紧凑的二进制文件，重启时从快照恢复路由表，不需要重新通过启动节点启动
+文件格式:
+    文件头: 标识(4位) + 版本(1位) + 自己的nid(20位) + 节点数量(4位)
+    节点记录: node(26位，与find_node回复中的格式相同) + 权重 + 失误次数 + 加入时间 + 下次检测时间
+写入时先写到临时文件再重命名，保证快照文件始终是完整的，
+读取时使用mmap映射文件，按偏移量逐条解析节点记录
+"""
+import os
+import mmap
+from socket import inet_ntoa
+from struct import Struct
+
+MAGIC = "KTSS"
+VERSION = 1
+HEADER = Struct("!4sB20sI")
+STATE = Struct("!iHdd")
+RECORD = Struct("!20s4sHiHdd")
+
+
+def dumps(nid,records):
+    """将节点记录打包成快照
+    Args:
+        nid: 自己的nid
+        records: [(packed,weight,missnum,ptime,utime),...]，packed为节点26位的字符串形式
+    Returns:
+        快照的二进制字符串
+    """
+    pack = STATE.pack
+    body = [
+        packed + pack(weight,min(missnum,0xffff),ptime,utime)
+        for packed,weight,missnum,ptime,utime in records if len(packed) == 26
+    ]
+    return HEADER.pack(MAGIC,VERSION,nid,len(body)) + "".join(body)
+
+
+def save(path,data):
+    """将快照写入文件，先写入临时文件再重命名为目标文件(原子替换)
+    Args:
+        path: 快照文件的路径
+        data: 快照的二进制字符串
+    """
+    tmp = "%s.%d.tmp"%(path,os.getpid())
+    with open(tmp,"wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp,path)
+
+
+def load(path):
+    """使用mmap读取快照文件中的节点记录
+    Args:
+        path: 快照文件的路径
+    Returns:
+        (nid,[(nid,ip,port,weight,missnum,ptime,utime),...]): 保存快照时自己的nid和所有的节点记录
+        None: 文件不存在、为空或者不是有效的快照
+    """
+    try:
+        f = open(path,"rb")
+    except IOError:
+        return None
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER.size:
+            return None
+        buf = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+    try:
+        magic,version,nid,number = HEADER.unpack_from(buf,0)
+        if magic != MAGIC or version != VERSION or size < HEADER.size + number*RECORD.size:
+            return None
+        unpack_from = RECORD.unpack_from
+        records = []
+        for offset in xrange(HEADER.size,HEADER.size + number*RECORD.size,RECORD.size):
+            node,ip,port,weight,missnum,ptime,utime = unpack_from(buf,offset)
+            records.append((node,inet_ntoa(ip),port,weight,missnum,ptime,utime))
+        return nid,records
+    finally:
+        buf.close()
@@ -6,25 +6,80 @@
 增加了权重和失误次数--每成功链接一次权重增加一失误次数重置为零，
 每失误一次权重减少一失误次数增加一，下次更新时间以失误次数计算(timeout*(2**_missnum_missnum))
 这样当有新的节点可以插入时，可以根据节点的权重去更换节点。
+失误由请求超时时间轮通知(详见TidLink)，不再在发送请求时预先扣除。
+记录节点和节点所在/24网段的往返时间，请求的超时时间根据往返时间计算。
+节点的nid在加入时转换为整数，通过距离的二进制位数直接确定所在的桶。
+查找最近的节点时返回真正与target异或距离最近的节点，节点数量较多时使用numpy数组索引(详见NodeIndex)。
+节点缓存26位的字符串形式，桶缓存所有节点拼接后的字符串，响应请求时不需要重复打包。
+需要检测的节点按检测时间的秒数放入时间轮的槽中，只取出到期的槽，不再遍历所有的节点。
+桶满并且不能分隔时，新节点放入桶的替换缓存，桶内节点连续失误过多时直接用最近见到的候选节点替换。
+路由表可以保存为二进制快照(详见_ksnapshot)，重启时从快照恢复节点的状态。
+桶的容量由KTABLE_SPLIT_POLICY决定，可以设置路由表节点数量的上限，达到上限后淘汰权重最低的节点。
 """
-from bisect import bisect_left
 from time import time
+from heapq import nsmallest,heappush,heappop,heapreplace,heapify
+from collections import OrderedDict
+from operator import itemgetter
+from . import _kindex
+from . import _ksnapshot
 from ..common import (
     unpack_nodes,
     pack_node,
-    ascii2l16,
+    nid2l16,
     nid
 )
 from ..config import (
     RETURN_NODE_MAX_LENGTH,
+    KTABLE_INDEX,
+    KTABLE_INDEX_MIN_LENGTH,
+    KTABLE_SPLIT_POLICY,
+    KTABLE_RELAXED_DEPTH,
+    KTABLE_MAX_NODES,
+    KBUCKET_CACHE_LENGTH,
+    NODE_MAX_MISSNUM,
+    NODE_REFRESH_INTERVAL,
     NODE_UPDATE_TIME,
     KBUCKET_MAX_LENGTH,
     NODE_DEFAULT_WEIGHT,
     NID_LENGTH,
-    TABLE_RANGE
+    TABLE_RANGE,
+    TID_TIMEOUT,
+    TID_WHEEL_TICK,
+    RTT_ALPHA,
+    RTT_BETA,
+    RTT_MIN_TIMEOUT,
+    RTT_SUBNET_MAX_LENGTH
 )
 
 
+def smooth_rtt(srtt,rttvar,sample):
+    """按照RFC6298计算平滑往返时间和往返时间偏差
+    Args:
+        srtt: 平滑往返时间，None表示还没有测量
+        rttvar: 往返时间偏差
+        sample: 本次测量的往返时间
+    Returns:
+        (srtt,rttvar)
+    """
+    if srtt is None:
+        return sample,sample/2
+    rttvar = (1-RTT_BETA)*rttvar + RTT_BETA*abs(srtt-sample)
+    srtt = (1-RTT_ALPHA)*srtt + RTT_ALPHA*sample
+    return srtt,rttvar
+
+#根据往返时间计算的最小超时时间，至少为请求超时时间轮的两个刻度
+MIN_TIMEOUT = max(RTT_MIN_TIMEOUT,2*TID_WHEEL_TICK)
+
+def rtt2timeout(srtt,rttvar):
+    """根据平滑往返时间和往返时间偏差计算请求的超时时间
+    Notes:
+        超时时间轮按刻度检查超时，最小超时时间至少为两个刻度，避免响应正常的节点被算作失误
+    Returns:
+        max(RTT_MIN_TIMEOUT,2*TID_WHEEL_TICK) <= srtt+4*rttvar <= TID_TIMEOUT
+    """
+    return min(max(srtt+4*rttvar,MIN_TIMEOUT),TID_TIMEOUT)
+
+
 class KNode(object):
     """KNode节点属性
     包含nid，ip，port的基本属性。
@@ -32,17 +87,28 @@ class KNode(object):
     增加了权重和失误次数--每成功链接一次权重增加一失误次数重置为零，
     每失误一次权重减少一失误次数增加一，下次更新时间以失误次数计算(timeout*(2**_missnum_missnum))
     这样当有新的节点可以插入时，可以根据节点的权重去更换节点。
+    Notes:
+        使用__slots__减少每个节点占用的内存
     Attributes:
         nid: 节点的唯一nid标识
+        nid_l16: 节点nid的整数形式
         weight: 节点的权重值
+        missnum: 节点连续失误的次数
         ip: 节点的ipv4地址
         port: 节点的对等端口
         _timeout: 默认的单次检测节点响应的时间间隔
         addr: 节点的地址元组
         _ptime: 节点进入路由表的时间
         _utime: 节点下次检测的时间
+        srtt: 节点的平滑往返时间
+        rto: 根据往返时间计算的请求超时时间
+        packed: 节点26位的字符串形式(第一次使用时打包并缓存)
         need_check: 判断节点是否需要检测
     """
+    __slots__ = (
+        "_weight","_missnum","_nid","_nid_l16","_ip","_port",
+        "_timeout","_utime","_ptime","_srtt","_rttvar","_packed","_touched"
+    )
 
     def __init__(self, nid, ip, port, weight, timeout):
         """初始化节点的基本信息
@@ -56,11 +122,16 @@ class KNode(object):
         self._weight = weight
         self._missnum = 0
         self._nid = nid
+        self._nid_l16 = nid2l16(nid)
         self._ip = ip
         self._port = port
         self._timeout = timeout
         self._utime = time() + self._timeout
         self._ptime = time()
+        self._srtt = None
+        self._rttvar = None
+        self._packed = None
+        self._touched = False
 
     @property
     def weight(self):
@@ -70,6 +141,14 @@ class KNode(object):
         """
         return self._weight
 
+    @property
+    def missnum(self):
+        """节点连续失误的次数，响应后重置为零
+        Returns:
+            节点连续失误的次数
+        """
+        return self._missnum
+
     @property
     def status(self):
         """节点的状态
@@ -78,6 +157,8 @@ class KNode(object):
             utime: 节点下次的检测时间
             missnum: 节点失误次数
             ptime: 节点第一次加入路由表的时间
+            srtt: 节点的平滑往返时间
+            rttvar: 节点的往返时间偏差
             body: 节点的主要信息(nid,addr0
         """
         res = {
@@ -85,6 +166,8 @@ class KNode(object):
             "utime":self._utime,
             "missnum":self._missnum,
             "ptime":self._ptime,
+            "srtt":self._srtt,
+            "rttvar":self._rttvar,
             "body":(self.nid,self.addr)
         }
         return res
@@ -99,25 +182,84 @@ class KNode(object):
         self._use()
         return self.nid,self.addr
 
-    def update(self):
+    def update(self,now = None):
         """节点对我们的请求作出响应后更新节点，
-        将节点的失误次数重置为零，节点的权重增加二(在使用时权重已经减一，实际上对权重加一)，
+        将节点的失误次数重置为零，节点的权重增加一，
         更新节点的下次检测时间，当前时间加延时，time() + self._timeout*(2**self._missnum)
         其中self._missnum为零
+        Args:
+            now: 收到响应的时间，默认为time()
         """
         self._missnum = 0
-        self._weight += 2
-        self._utime = time() + self._timeout
+        self._weight += 1
+        self._utime = (time() if now is None else now) + self._timeout
+        self._touched = False
+
+    def touch(self,now):
+        """收到节点的请求，说明节点在线，将节点的失误次数重置为零，
+        下次检测时间推后到now + self._timeout，节点的权重不变
+        Args:
+            now: 收到请求的时间
+        """
+        self._missnum = 0
+        self._utime = now + self._timeout
+        self._touched = True
+
+    @property
+    def touched(self):
+        """节点最近一次推后检测时间是否是因为收到了节点的请求(被动刷新)"""
+        return self._touched
+
+    def miss(self):
+        """节点没有在超时时间内响应我们的请求
+        节点权重减一，节点失误次数加一(在节点正常响应后，节点的失误次数重置为零，如果没有正常响应失误次数将累加)
+        """
+        self._missnum += 1
+        self._weight -= 1
+
+    def restore(self,weight,missnum,ptime,utime):
+        """从快照恢复节点的状态
+        Args:
+            weight: 节点的权重
+            missnum: 节点连续失误的次数
+            ptime: 节点第一次加入路由表的时间
+            utime: 节点下次检测的时间
+        """
+        self._weight = weight
+        self._missnum = missnum
+        self._ptime = ptime
+        self._utime = utime
+
+    def rtt(self,sample):
+        """记录一次请求的往返时间
+        Args:
+            sample: 本次请求的往返时间
+        """
+        self._srtt,self._rttvar = smooth_rtt(self._srtt,self._rttvar,sample)
+
+    @property
+    def srtt(self):
+        """节点的平滑往返时间
+        Returns:
+            平滑往返时间，没有测量过返回None
+        """
+        return self._srtt
+
+    @property
+    def rto(self):
+        """根据往返时间计算的请求超时时间
+        Returns:
+            超时时间，没有测量过返回None
+        """
+        if self._srtt is not None:
+            return rtt2timeout(self._srtt,self._rttvar)
 
     def _use(self):
         """节点被使用
-        重置下次检测的时间，
-        节点权重减一(在节点正常响应后，权重加二，实际上是一次正常响应，权重会加一)
-        节点失误次数加一(在节点正常响应后，节点的失误次数重置为零，如果没有正常响应失误次数将累加)
+        重置下次检测的时间，失误次数越多，下次检测的时间越晚
         """
         self._utime = time() + self._timeout*(2**self._missnum)
-        self._missnum += 1
-        self._weight -= 1
+        self._touched = False
 
     @property
     def ip(self):
@@ -143,6 +285,14 @@ class KNode(object):
         """
         return self._nid
 
+    @property
+    def nid_l16(self):
+        """节点nid的整数形式
+        Returns:
+            节点nid的长整数
+        """
+        return self._nid_l16
+
     @property
     def addr(self):
         """节点的网络地址
@@ -168,9 +318,19 @@ class KNode(object):
         """
         return time() > self._utime
 
+    @property
+    def packed(self):
+        """节点26位的字符串形式，nid、ip、port不会改变，打包一次后缓存
+        Returns:
+            nid+ipv4地址的字符串格式+port的网络大端字节
+        """
+        if self._packed is None:
+            self._packed = pack_node(self._nid,self._ip,self._port)
+        return self._packed
+
     def __str__(self):
         """将节点转换成26位的字符串，以便后面使用"""
-        return pack_node(self._nid,self._ip,self._port)
+        return self.packed
 
 
 
@@ -183,6 +343,11 @@ class KBucket(object):
     Notes:
         优化了官方的功能，官方以KBucket桶为更新单位，这里实现了以KNode节点为更新单位，
         详细情况请查看KNode的介绍。
+        列表保持节点加入的顺序，同时用字典{nid:KNode}索引节点，
+        查找、更新、替换节点都不需要遍历列表。
+        桶内所有节点拼接后的字符串在第一次使用时生成，只在桶内节点变化(添加、替换)时失效。
+        桶满时新节点放入替换缓存{nid:(ip,port)}，按见到的顺序保存最近的KBUCKET_CACHE_LENGTH个，
+        桶内节点失误过多时用最近见到的候选节点替换(BEP5的replacement cache)。
     Attributes:
         le: gt: KBucket桶的范围，里面的节点 le <= KNode的nid与自己的距离 < gt
         k: KBucket桶存放节点的最大数量
@@ -193,8 +358,12 @@ class KBucket(object):
         nodes: KBucket桶里面的节点
         items: KBucket桶里面节点的(nid,ip,port)信息
         nid_list: KBucket桶内所有节点的nid
+        blob: KBucket桶内所有节点拼接后的字符串
         need_check: KBucket桶内需要更新的检测的节点
+        cache: 将节点放入替换缓存
+        promote: 用替换缓存中的候选节点替换桶内的节点
     """
+    _cache_length = KBUCKET_CACHE_LENGTH
 
     def __init__(self,le,gt,k,weight,timeout):
         """初始化一个KBucket桶，设定桶的范围、桶内节点的数量、
@@ -211,6 +380,9 @@ class KBucket(object):
         self._weight = weight
         self._timeout = timeout
         self._nodes = [] 
+        self._map = dict()
+        self._blob = None
+        self._cache = OrderedDict()
 
     @property
     def status(self):
@@ -220,6 +392,7 @@ class KBucket(object):
             range: KBucket桶的范围
             canSplit: KBucket桶是否还可分隔(可分隔是指gt/le>2)
             items: KBucket桶里面节点的(nid,ip,port)信息
+            cached: 替换缓存中候选节点的数量
             detail: 每个KNode节点的详细信息
         """
         res = {
@@ -227,6 +400,7 @@ class KBucket(object):
             "range":self.ranges,
             "canSplit":self.canSplit(),
             "items":self.items,
+            "cached":len(self._cache),
             "detail":[]
         }
         for node in self._nodes:
@@ -297,7 +471,17 @@ class KBucket(object):
         """
         return [node.nid for node in self._nodes]
 
-    def index(self,nid):#待优化空间复杂度
+    @property
+    def blob(self):
+        """KBucket桶内所有节点拼接后的字符串
+        Returns:
+            str(KNode)+str(KNode)+str(KNode)+...
+        """
+        if self._blob is None:
+            self._blob = "".join([node.packed for node in self._nodes])
+        return self._blob
+
+    def index(self,nid):
         """获取某个nid在KBucket桶内的索引值
         Args:
             nid: 响应请求的节点的20位唯一标识
@@ -305,9 +489,9 @@ class KBucket(object):
             num: 某个nid在KBucket桶内的索引值
             None: 该nid不在KBucket桶内
         """
-
-        if nid in self.nid_list:
-            return self.nid_list.index(nid)      
+        node = self._map.get(nid)
+        if node is not None:
+            return self._nodes.index(node)
 
     @property
     def need_check(self):
@@ -322,32 +506,76 @@ class KBucket(object):
         Args:
             nid: 响应请求的节点的20位唯一标识
         """
-        for node in self._nodes:
-            if node.nid == nid:
-                node.update()
-                return
+        node = self._map.get(nid)
+        if node is not None:
+            node.update()
 
     def replace(self,newnode):
         """替换节点
         如果桶内有节点失误的次数过多，则该节点的权重将会低于一个新节点的初始权重，
-        用新的节点去代替旧的节点
+        用新的节点去代替桶内权重最低的旧节点
         Args:
             newnode: KNode节点或者节点(nid,ip,port)信息
+        Returns:
+            node: 被替换掉的旧节点
+            None: 桶内没有权重低于新节点的节点
         """
         if not isinstance(newnode,KNode):
             newnode = KNode(newnode[0],newnode[1],newnode[2],self._weight,self._timeout)
-        for node in self._nodes:
-            if node.weight < newnode.weight:
-                node = newnode
-                return
+        if not self._nodes:
+            return None
+        node = min(self._nodes,key=lambda node:node.weight)
+        if node.weight >= newnode.weight:
+            return None
+        self._nodes[self._nodes.index(node)] = newnode
+        del self._map[node.nid]
+        self._map[newnode.nid] = newnode
+        self._blob = None
+        return node
+
+    def cache(self,node):
+        """将节点放入替换缓存，已经在缓存中的节点移动到最后(最近见到)，
+        超过KBUCKET_CACHE_LENGTH个时丢弃最早见到的候选节点
+        Args:
+            node: 节点(nid,ip,port)信息
+        """
+        nid = node[0]
+        if nid in self._map:return
+        self._cache.pop(nid,None)
+        self._cache[nid] = (node[1],node[2])
+        if len(self._cache) > self._cache_length:
+            self._cache.popitem(last=False)
+
+    def promote(self,nid):
+        """用替换缓存中最近见到的候选节点替换桶内的节点，不需要再检测候选节点
+        Args:
+            nid: 需要被替换的节点的唯一标识
+        Returns:
+            (oldnode,newnode): 被替换掉的旧节点和新加入的节点
+            None: 桶内没有该节点或者替换缓存为空
+        """
+        node = self._map.get(nid)
+        if node is None or not self._cache:
+            return None
+        newnid,(ip,port) = self._cache.popitem(last=True)
+        newnode = KNode(newnid,ip,port,self._weight,self._timeout)
+        self._nodes[self._nodes.index(node)] = newnode
+        del self._map[nid]
+        self._map[newnid] = newnode
+        self._blob = None
+        return node,newnode
 
     def push(self,newnode):
         """向桶内添加一个新的节点
         Args:
             newnode: KNode节点或者节点(nid,ip,port)信息
+        Returns:
+            newnode: 添加的KNode节点
         """
-        newnode = KNode(newnode[0],newnode[1],newnode[2],self._weight,self._timeout)
+        if not isinstance(newnode,KNode):
+            newnode = KNode(newnode[0],newnode[1],newnode[2],self._weight,self._timeout)
         self._append(newnode)        
+        return newnode
 
     def _append(self,node):
         """向桶内添加一个新的节点
@@ -355,6 +583,22 @@ class KBucket(object):
             node: KNode节点
         """
         self._nodes.append(node)
+        self._map[node.nid] = node
+        self._blob = None
+
+    def remove(self,nid):
+        """从桶内移除一个节点
+        Args:
+            nid: 需要移除的节点的唯一标识
+        Returns:
+            node: 被移除的节点
+            None: 桶内没有该节点
+        """
+        node = self._map.pop(nid,None)
+        if node is not None:
+            self._nodes.remove(node)
+            self._blob = None
+        return node
 
     def __contains__(self,nid):
         """判断某个nid是否在KBucket桶内
@@ -364,10 +608,7 @@ class KBucket(object):
             True: 该nid在KBucket桶内
             False: 该nid不在KBucket桶内
         """
-        for node in self._nodes:
-            if node.nid == nid:
-                return True
-        return False
+        return nid in self._map
 
     def __len__(self):
         """KBucket桶内节点的数量，方便通过len(KBucket)方法使用
@@ -376,18 +617,6 @@ class KBucket(object):
         """
         return len(self._nodes)
 
-    def __lt__(self,dist):
-        """小于比较符，
-        主要用在bisect_left中，bisect_left将在路由表中返回一个桶位置的索引，
-        该索引将在[...,False,False,False,True,True,True...]最后一个False的索引位置
-        Args:
-            dist: type()->int 该nid与自身nid异或后的距离
-        Returns:
-            True: 大于桶的最大边界
-            False: 小于等于桶的最大边界
-        """
-        return self._gt < dist
-
     def __getitem__(self,nid):
         """方便使用KBucket[nid]的方法获取该nid的KNode节点
         如果KBucket桶内没有响应的KNode节点将返回None
@@ -397,10 +626,7 @@ class KBucket(object):
             node: 该nid匹配到的KNode节点
             None: 没有匹配到响应的KNode节点
         """
-        for node in self._nodes:
-            if node.nid == nid:
-                return node
-        return None
+        return self._map.get(nid)
 
     def __iter__(self):
         """将KBucket变成可迭代的生成器，方便路由表取出数据"""
@@ -419,31 +645,72 @@ class KTable(object):
     用来存放范围在2**0到2**160之间的KBucket，所以最多有160个KBucket，
     最开始只有一个最大范围的KBucket，随着节点的增加，当KBucket中的节点数量达到了16，
     如果桶可以分隔，则将桶拆分成两个。
+    桶的边界都是2的幂，距离的二进制位数减一(0-159)即可确定所在的桶，
+    _exponents记录每个二进制位数对应的桶的索引，在桶分隔时重新计算。
+    只有自己所在的第一个桶可以分隔，其他的桶只对应一个二进制位数，桶的容量由_policy决定:
+        standard: 所有桶的容量都为_k(Kademlia的标准分隔方式)
+        relaxed: 最靠近自己的KTABLE_RELAXED_DEPTH个桶容量为2*_k，相当于这些桶再分隔了一次
+        unbounded: 除自己所在的桶外，其他桶不限容量(爬虫模式收集尽量多的节点)
+    _max_nodes不为0时，路由表的节点数量达到上限后，新节点只能淘汰整个路由表中权重比它低的节点
     notes:
         对官方进行了一些修改，在插入节点的过程中，如果路由表已经有了该节点，则更新该节点
         权重(详情参照KNode介绍)，在桶不可以分隔的情况下，官方使用丢弃的处理方式，我们采用
         替换路由表的权重低，失误次数高的节点
     Attributes:
         _k: 每个KBucket最大数量
+        _policy: 桶的容量策略(standard,relaxed,unbounded)
+        _max_nodes: 路由表节点数量的上限，0为不限制
         _timeout: 默认初始节点的更新间隔时间
         _weight: 默认初始节点的权重
         _nid_l16: nid的16进制整数
+        _exponents: 距离的二进制位数减一 -> KBucket桶的索引
+        _indexable: numpy可用并且KTABLE_INDEX为1时才使用数组索引
+        _nindex: 所有节点的numpy数组索引，节点数量第一次达到KTABLE_INDEX_MIN_LENGTH时才建立，
+            降到一半以下时丢弃，不使用数组索引时为None
+        _checks: 检测的时间轮{检测时间的秒数:[(nid,KNode),...]}
+        _check_from: 时间轮中还没有检查完的最早的秒数
+        _scheduled: 需要检测的节点{nid:KNode}，时间轮中与之不一致的项已经失效，同时也是路由表中所有的节点
+        _weights: 按权重排序的最小堆[(weight,nid,KNode),...]，只在设置了_max_nodes时使用
+        avoided: 因为被动刷新而省去的检测次数(累计)
         push: 添加一个节点
         find_node2chrlist: 最近的node列表
         find_node2chrall: 最近的node字符串
         need_check: 需要更新的节点
+        snapshot: 路由表的二进制快照
+        restore: 从快照恢复路由表
+        refresh: 收到节点的请求时被动刷新节点
+        rtt: 记录节点和节点所在/24网段的往返时间
+        timeout: 根据往返时间计算对节点请求的超时时间
+        srtt: 节点或者节点所在/24网段的平滑往返时间
     """
     _k = KBUCKET_MAX_LENGTH
+    _policy = KTABLE_SPLIT_POLICY
+    _max_nodes = KTABLE_MAX_NODES
     _timeout = NODE_UPDATE_TIME
     _weight = NODE_DEFAULT_WEIGHT
     _nid = nid
-    _nid_l16 = ascii2l16(nid)    
+    _nid_l16 = nid2l16(nid)
+    _indexable = bool(KTABLE_INDEX and _kindex.available)
     
     def __init__(self):
         """初始化路由表，
         初始路由表中只包含一个最大范围的KBucket桶
         """
         self._buckets = [KBucket(TABLE_RANGE[0],TABLE_RANGE[1],self._k,self._weight,self._timeout)]
+        self._subnets = dict()
+        self._exponents = [0]*160
+        self._reindex()
+        self._nindex = None
+        self._checks = dict()
+        self._check_from = int(time())
+        self._scheduled = dict()
+        self._weights = []
+        self._avoided = 0
+
+    @property
+    def avoided(self):
+        """因为被动刷新而省去的检测次数(累计)"""
+        return self._avoided
     
     @property
     def buckets(self):
@@ -460,12 +727,14 @@ class KTable(object):
             length: 路由表中KBucket桶的数量
             nodes_num: 路由表中KNode节点的数量
             bucket_max_length： KBucket桶中节点的最大数量
+            subnets_num: 记录了往返时间的/24网段的数量
             detail: 每个KBucket桶的详细信息
         """
         res = {
             "length":len(self._buckets),
             "nodes_num":len(self),
             "bucket_max_length":self._k,
+            "subnets_num":len(self._subnets),
             "detail":[]
         }      
         for bucket in self._buckets:
@@ -507,40 +776,192 @@ class KTable(object):
         Returns:
             index: KBucket桶的索引值
         """
-        dist = self._cmp(nid)
-        return bisect_left(self._buckets, dist) 
+        return self._dist2index(self._cmp(nid))
+
+    def _dist2index(self,dist):
+        """通过距离的二进制位数确定KBucket桶的索引，距离为0(自己)时为第一个桶
+        Args:
+            dist: type()->int 与自身nid的距离
+        Returns:
+            index: KBucket桶的索引值
+        """
+        if not dist:
+            return 0
+        return self._exponents[dist.bit_length()-1]
+
+    def _reindex(self):
+        """重新计算每个二进制位数对应的KBucket桶的索引"""
+        for index,bucket in enumerate(self._buckets):
+            le,gt = bucket.ranges
+            for exponent in xrange(le.bit_length()-1,gt.bit_length()-1):
+                self._exponents[exponent] = index
     
-    def _node2bucket(self,node): #待优化桶分隔后节点权重等问题
+    def _node2bucket(self,node,newnode = None):
         """将node插入到路由表中
         根据node节点的唯一标识nid确定，该节点在路由表中的KBucket桶的索引->index，
         获取应该放置该节点的KBucket桶->bucket,
         通过该桶尝试获取该节->knode
-        if 该节点已经存在，则更新该节点，
-        elif KBucket桶没有满，则在该桶中插入该节点，
-        elif KBucket桶可以继续分隔，则将该KBucket桶拆成两个，将该节点与原节点合并后重新分配，
-        else 用该节点去替换桶中权重过低，失误次数过多的不活跃节点
+        if 该节点已经存在，则更新该节点(从快照恢复时不更新)，
+        elif KBucket桶没有满(容量详见_capacity)，则在该桶中插入该节点，
+            路由表节点数量达到上限时，需要先淘汰一个权重比该节点低的节点，否则放入桶的替换缓存，
+        elif KBucket桶是自己所在的桶并且可以继续分隔，则将该KBucket桶拆成两个，原节点对象直接移动到新的桶中
+            (保留节点的权重、失误次数和往返时间)，再重新插入该节点，
+        else 用该节点去替换桶中权重过低，失误次数过多的不活跃节点，没有可以替换的节点时放入桶的替换缓存
         Args:
             node: 元组的形式，由唯一标识nid和ipv4地址组成(nid,addr = (ip,port))
+            newnode: 已经创建好的KNode节点(从快照恢复时保留了节点的状态)，默认根据node创建
         """
         nid = node[0]
         index = self._index(nid)
         bucket = self._buckets[index]
         knode = bucket[nid]
         if knode is not None:
-            knode.update()
-        elif not bucket.isFull():
-            bucket.push(node)
-        elif bucket.canSplit():
-            nodelist = bucket.items+[node]
-            lt,ge = bucket.ranges
-            point = ge/2
-            self._buckets[index] = KBucket(point,ge,self._k,self._weight,self._timeout)
-            self._buckets.insert(index,KBucket(lt,point,self._k,self._weight,self._timeout))
-            for node in nodelist:
-                self._node2bucket(node)
+            if newnode is None:
+                knode.update()
+        elif len(bucket) < self._capacity(index):
+            weight = self._weight if newnode is None else newnode.weight
+            if self._max_nodes and len(self._scheduled) >= self._max_nodes and not self._evict(weight):
+                bucket.cache(node)
+                return
+            knode = bucket.push(node if newnode is None else newnode)
+            self._schedule(knode)
+            if self._nindex is not None:
+                self._nindex.add(knode)
+            elif self._indexable and len(self._scheduled) >= KTABLE_INDEX_MIN_LENGTH:
+                self._build_nindex()
+        elif index == 0 and bucket.canSplit():
+            self._split(index)
+            self._node2bucket(node,newnode)
         else:
-            bucket.replace(node)
+            knode = KNode(node[0],node[1],node[2],self._weight,self._timeout) if newnode is None else newnode
+            oldnode = bucket.replace(knode)
+            if oldnode is not None:
+                self._swap(oldnode,knode)
+            else:
+                bucket.cache(node)
+
+    def _capacity(self,index):
+        """KBucket桶的容量
+        Args:
+            index: KBucket桶的索引
+        Returns:
+            桶内节点的最大数量
+        """
+        if index == 0 and self._buckets[0].canSplit():
+            return self._k
+        if self._policy == "unbounded":
+            return float("inf")
+        if self._policy == "relaxed" and index < KTABLE_RELAXED_DEPTH:
+            return self._k*2
+        return self._k
+
+    def _evict(self,weight):
+        """路由表节点数量达到上限时，淘汰整个路由表中权重最低的节点
+        Notes:
+            节点的权重变化时堆中的项不会同步更新，响应后权重增加的节点在取出时按新的权重重新加入，
+            失误后权重减少的节点在失误时另外加入一项，已经不在路由表中的项直接丢弃
+        Args:
+            weight: 新节点的权重，只淘汰权重比它低的节点
+        Returns:
+            node: 被淘汰的节点
+            None: 没有权重比新节点低的节点
+        """
+        heap = self._weights
+        scheduled = self._scheduled
+        while heap:
+            low,nid,node = heap[0]
+            if scheduled.get(nid) is not node:
+                heappop(heap)
+            elif node.weight > low:
+                heapreplace(heap,(node.weight,nid,node))
+            elif node.weight < low:
+                heappop(heap)
+            elif low >= weight:
+                return None
+            else:
+                heappop(heap)
+                self._remove(node)
+                return node
+        return None
+
+    def _remove(self,node):
+        """从路由表中移除一个节点"""
+        self._buckets[self._index(node.nid)].remove(node.nid)
+        del self._scheduled[node.nid]
+        if self._nindex is not None:
+            if len(self._scheduled) < KTABLE_INDEX_MIN_LENGTH//2:
+                self._nindex = None
+            else:
+                self._nindex.remove(node.nid)
+
+    def _build_nindex(self):
+        """节点数量达到KTABLE_INDEX_MIN_LENGTH时，用路由表中所有的节点建立数组索引，
+        之前的节点增减不需要维护索引
+        """
+        nindex = _kindex.NodeIndex()
+        for node in self._scheduled.itervalues():
+            nindex.add(node)
+        self._nindex = nindex
+
+    def _track(self,node):
+        """设置了节点数量上限时，将节点按当前的权重加入淘汰的最小堆，
+        堆中失效的项过多时重建
+        """
+        if not self._max_nodes:return
+        heap = self._weights
+        if len(heap) > 2*len(self._scheduled) + 1024:
+            heap[:] = [(item.weight,nid,item) for nid,item in self._scheduled.iteritems()]
+            heapify(heap)
+        heappush(heap,(node.weight,node.nid,node))
+
+    def _swap(self,oldnode,newnode):
+        """桶内的节点被替换后，更新数组索引和检测的时间轮"""
+        if self._nindex is not None:
+            self._nindex.remove(oldnode.nid)
+            self._nindex.add(newnode)
+        del self._scheduled[oldnode.nid]
+        self._schedule(newnode)
+
+    def _schedule(self,node):
+        """将新加入路由表的节点加入检测的时间轮(设置了节点数量上限时同时加入淘汰的最小堆)
+        Args:
+            node: KNode节点
+        """
+        self._scheduled[node.nid] = node
+        self._enqueue(node,node.utime)
+        self._track(node)
+
+    def _enqueue(self,node,utime):
+        """将节点放入检测时间所在秒数的槽中，已经检查过的秒数放入_check_from的槽中
+        Args:
+            node: KNode节点
+            utime: 检测时间
+        """
+        second = max(int(utime),self._check_from)
+        slot = self._checks.get(second)
+        if slot is None:
+            self._checks[second] = [(node.nid,node)]
+        else:
+            slot.append((node.nid,node))
     
+    def _split(self,index):
+        """将KBucket桶从中间拆成两个，桶内的节点按照距离移动到新的桶中
+        Args:
+            index: 需要拆分的KBucket桶的索引
+        """
+        bucket = self._buckets[index]
+        lt,ge = bucket.ranges
+        point = ge/2
+        low = KBucket(lt,point,self._k,self._weight,self._timeout)
+        high = KBucket(point,ge,self._k,self._weight,self._timeout)
+        for knode in bucket:
+            if knode.nid_l16^self._nid_l16 < point:
+                low._append(knode)
+            else:
+                high._append(knode)
+        self._buckets[index:index+1] = [low,high]
+        self._reindex()
+
     def _cmp(self,nid):
         """比较nid与自身nid的距离
         Args:
@@ -548,58 +969,260 @@ class KTable(object):
         Returns:
             dist: type()->int nid与自身nid的距离
         """
-        nid_l16 = ascii2l16(nid)       
-        return nid_l16^self._nid_l16
+        return nid2l16(nid)^self._nid_l16
 
     def find_node2chrlist(self,target):
         """查找与target最近的节点信息，以node的形式返回
+        (查找任务在距离相近的节点中优先请求低延时的节点，详见LookupTask.get)
         Args:
             target: 需要查找的node.nid或者peer.info_hash
         Returns:
-            [(nid,addr(ip,port)),(nid,addr(ip,port)),...]
+            [(nid,addr(ip,port)),(nid,addr(ip,port)),...]: 按与target的距离由近到远排序
         """
         return [(node.nid,node.addr) for node in self._find_node(target)]
     
     def find_node2chrall(self,target):
         """查找与target最近的节点信息，以字符串的形式返回
+        Notes:
+            target所在桶内的节点与target的距离小于其他所有桶内的节点
+            (除第一个桶外每个桶只对应一个二进制位数，第一个桶下面没有更近的桶)，
+            所以target所在的桶正好有RETURN_NODE_MAX_LENGTH个节点时，这些节点就是最近的节点，
+            直接返回桶缓存的字符串(节点不再按距离排序)
         Args:
             target: 需要查找的node.nid或者peer.info_hash
         Returns:
             str(KNode)+str(KNode)+str(KNode)+...
         """
-        return "".join([str(node) for node in self._find_node(target)])
+        assert len(target) == NID_LENGTH,"target 必须是%s位字符串"%NID_LENGTH
+        bucket = self._buckets[self._index(target)]
+        if len(bucket) == RETURN_NODE_MAX_LENGTH:
+            return bucket.blob
+        return "".join([node.packed for node in self._find_node(target)])
     
     def _find_node(self,target):
-        """查找与target最近的节点，
-        如果从最近的桶不满默认数量个则向后推，直到推到最后
+        """查找与target异或距离最近的节点
+        节点数量达到KTABLE_INDEX_MIN_LENGTH并且有数组索引时，使用数组索引查找，
+        否则在target所在的桶以及更靠近自己的桶中查找，这些桶内节点与target的距离
+        都小于更远的桶内的节点，不足RETURN_NODE_MAX_LENGTH个时再依次从更远的桶中补充
         Args:
             target: 需要查找的node.nid或者peer.info_hash
         Returns:
-            [KNode,KNode,KNode,...]
+            [KNode,KNode,KNode,...]: 按与target的距离由近到远排序
         """
         assert len(target) == NID_LENGTH,"target 必须是%s位字符串"%NID_LENGTH
-        index = self._index(target)
+        if self._nindex is not None and len(self._nindex) >= KTABLE_INDEX_MIN_LENGTH:
+            return self._nindex.closest(target,RETURN_NODE_MAX_LENGTH)
+        target_l16 = nid2l16(target)
+        key = lambda node:node.nid_l16^target_l16
+        index = self._dist2index(target_l16^self._nid_l16)
         nodes = []
-        while len(nodes) < RETURN_NODE_MAX_LENGTH and index<len(self._buckets):
-            for node in self._buckets[index].nodes:
-                nodes.append(node)
+        for bucket in self._buckets[:index+1]:
+            nodes += bucket.nodes
+        nodes = nsmallest(RETURN_NODE_MAX_LENGTH,nodes,key=key)
+        while len(nodes) < RETURN_NODE_MAX_LENGTH and index+1 < len(self._buckets):
             index += 1
+            nodes += nsmallest(RETURN_NODE_MAX_LENGTH-len(nodes),self._buckets[index].nodes,key=key)
         return nodes
     
-    def need_check(self):
-        """每个桶中取出一个需要检测的节点
+    def need_check(self,now = None):
+        """从检测的时间轮中取出所有已经到检测时间的节点
+        Notes:
+            只检查_check_from到now的槽，开销与到期的节点数量有关，与路由表的大小无关，
+            now所在秒数的槽可能还有没到检测时间的节点，下次检测时再检查一次，
+            节点被使用或者响应后检测时间会推后，时间轮中的时间不会同步更新，
+            取出时节点的检测时间还没有到则按新的检测时间重新加入，已经被替换的节点直接丢弃，
+            检测时间是因为被动刷新而推后的，记为省去了一次检测，
+            返回的节点按_timeout秒后重新加入(节点被检测后的检测时间不会早于这个时间)
+        Args:
+            now: 当前时间，默认为time()
         Returns:
-            [KNode,KNode,KNode,...]
+            [KNode,KNode,KNode,...]: 按检测时间的秒数由早到晚排序
         """
+        now = time() if now is None else now
+        checks = self._checks
+        scheduled = self._scheduled
+        second = int(now)
+        if second < self._check_from:
+            return []
+        if second - self._check_from < len(checks):
+            seconds = xrange(self._check_from,second + 1)
+        else:
+            seconds = sorted(key for key in checks if key <= second)
+        self._check_from = second
         nodes = []
-        for bucket in self._buckets:
-            nodes += bucket.need_check
-        return nodes    
+        timeout = now + self._timeout
+        for key in seconds:
+            slot = checks.pop(key,None)
+            if slot is None:
+                continue
+            for entry in slot:
+                node = entry[1]
+                if scheduled.get(entry[0]) is not node:
+                    continue
+                utime = node.utime
+                if utime > now:
+                    if node.touched:
+                        self._avoided += 1
+                        node._touched = False
+                else:
+                    nodes.append(node)
+                    utime = timeout
+                #重新加入时复用原来的项，now所在秒数的槽在本次循环的最后还会再检查一次
+                tick = int(utime)
+                later = checks.get(tick)
+                if later is None:
+                    checks[tick] = [entry]
+                else:
+                    later.append(entry)
+        return nodes
     
+    def snapshot(self):
+        """路由表的二进制快照，包含所有节点的26位字符串形式、权重、失误次数和时间
+        Returns:
+            快照的二进制字符串(格式详见_ksnapshot)
+        """
+        return _ksnapshot.dumps(self._nid,[
+            (node.packed,node.weight,node.missnum,node._ptime,node.utime)
+            for bucket in self._buckets for node in bucket
+        ])
+
+    def restore(self,records,now = None):
+        """从快照恢复路由表，节点保留保存时的权重、失误次数和加入时间
+        Notes:
+            恢复的节点不会立即检测，保留保存时的下次检测时间(最晚为now之后_timeout秒)，
+            停机期间已经过了检测时间的节点由need_check在第一次检测时取出，
+            随ping任务在一个检测间隔内平均地检测(懒验证)，
+            保存快照时的nid与自己的nid不同时，节点同样按照距离放入对应的桶，
+            按检测时间的顺序放入节点
+        Args:
+            records: [(nid,ip,port,weight,missnum,ptime,utime),...]
+            now: 当前时间，默认为time()
+        Returns:
+            恢复到路由表中的节点数量
+        """
+        now = time() if now is None else now
+        before = len(self)
+        for nid,ip,port,weight,missnum,ptime,utime in sorted(records,key=itemgetter(6)):
+            if nid == self._nid:continue
+            knode = KNode(nid,ip,port,self._weight,self._timeout)
+            knode.restore(weight,missnum,ptime,min(utime,now + self._timeout))
+            self._node2bucket((nid,ip,port),knode)
+        return len(self) - before
+
     def __len__(self):
         """路由表中所有KNode节点的数量"""
         return reduce(lambda x,y:y+x,[len(bucket) for bucket in self._buckets])
     
+    def _subnet(self,ip):
+        """节点所在的/24网段"""
+        return ip.rsplit(".",1)[0]
+
+    def rtt(self,nid,addr,sample):
+        """记录一次请求的往返时间，更新节点所在/24网段的往返时间，
+        如果节点在路由表中，更新节点的往返时间
+        Args:
+            nid: 节点的唯一标识
+            addr: 节点的网络地址
+            sample: 本次请求的往返时间
+        """
+        subnet = self._subnet(addr[0])
+        if subnet in self._subnets:
+            self._subnets[subnet] = smooth_rtt(self._subnets[subnet][0],self._subnets[subnet][1],sample)
+        else:
+            if len(self._subnets) >= RTT_SUBNET_MAX_LENGTH:
+                self._subnets.popitem()
+            self._subnets[subnet] = smooth_rtt(None,None,sample)
+        if nid is None or len(nid) != NID_LENGTH:return
+        node = self[nid]
+        if node is not None and node.addr == addr:
+            node.rtt(sample)
+
+    def timeout(self,nid,addr):
+        """根据往返时间计算对节点请求的超时时间，
+        优先使用节点自己的往返时间，其次使用节点所在/24网段的往返时间
+        Args:
+            nid: 节点的唯一标识
+            addr: 节点的网络地址
+        Returns:
+            请求的超时时间
+        """
+        if nid is not None and len(nid) == NID_LENGTH:
+            node = self[nid]
+            if node is not None and node.addr == addr:
+                return self._node_timeout(node)
+        subnet = self._subnets.get(self._subnet(addr[0]))
+        if subnet is not None:
+            return rtt2timeout(*subnet)
+        return TID_TIMEOUT
+
+    def srtt(self,nid,addr):
+        """节点的平滑往返时间，优先使用节点自己的往返时间，其次使用节点所在/24网段的往返时间
+        Args:
+            nid: 节点的唯一标识
+            addr: 节点的网络地址
+        Returns:
+            平滑往返时间
+            None: 还没有测量过往返时间
+        """
+        if nid is not None and len(nid) == NID_LENGTH:
+            node = self[nid]
+            if node is not None and node.addr == addr and node.srtt is not None:
+                return node.srtt
+        subnet = self._subnets.get(self._subnet(addr[0]))
+        if subnet is not None:
+            return subnet[0]
+
+    def _node_timeout(self,node):
+        """路由表中节点的请求超时时间"""
+        if node.rto is not None:
+            return node.rto
+        subnet = self._subnets.get(self._subnet(node.ip))
+        if subnet is not None:
+            return rtt2timeout(*subnet)
+        return TID_TIMEOUT
+
+    def refresh(self,nid,addr,now = None):
+        """收到节点的请求时被动刷新节点，推后节点的下次检测时间，
+        距离上次推后检测时间不到NODE_REFRESH_INTERVAL秒的节点不刷新，
+        时间轮中的时间在取出时按节点新的检测时间重新加入(详见need_check)
+        Args:
+            nid: 请求中节点的唯一标识
+            addr: 请求节点的网络地址
+            now: 收到请求的时间，默认为time()
+        Returns:
+            True: 已经刷新
+            None: 节点不在路由表中、地址不一致或者刚刷新过
+        """
+        if type(nid) is not str or len(nid) != NID_LENGTH:return
+        node = self[nid]
+        if node is None or node.addr != addr:return
+        now = time() if now is None else now
+        if node.utime > now + self._timeout - NODE_REFRESH_INTERVAL:return
+        node.touch(now)
+        return True
+
+    def miss(self,nid,addr):
+        """节点没有在超时时间内响应我们的请求，更新该节点的失误次数和权重，
+        连续失误达到NODE_MAX_MISSNUM次时，用桶的替换缓存中最近见到的候选节点替换该节点
+        Args:
+            nid: 节点的唯一标识
+            addr: 请求时节点的网络地址
+        Returns:
+            True: 该节点在路由表中，已经更新
+            None: 该节点不在路由表中
+        """
+        if nid is None or len(nid) != NID_LENGTH:return
+        bucket = self._buckets[self._index(nid)]
+        node = bucket[nid]
+        if node is not None and node.addr == addr:
+            node.miss()
+            self._track(node)
+            if node.missnum >= NODE_MAX_MISSNUM:
+                promoted = bucket.promote(nid)
+                if promoted is not None:
+                    self._swap(*promoted)
+            return True
+
     def __getitem__(self,nid):
         """通过节点的唯一标识nid获取KNode节点
         Args:
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#coding:utf-8
+"""
+UDP批量收发
+在Linux下通过ctypes调用recvmmsg/sendmmsg，一次系统调用收发多个数据包，
+其他平台或者系统不支持时，使用非阻塞socket循环收发作为替代
+单个目标地址的错误(端口为0、网络不可达、广播地址等)只丢弃该数据包，不影响同一批的其他数据包，
+只有系统调用本身不可用(ENOSYS、EBADF等)时才改为循环收发
+只支持IPv4地址，发送时遇到需要解析的地址(域名)会停止，交给调用者处理
+"""
+import ctypes
+import ctypes.util
+import logging
+from errno import EAGAIN,EWOULDBLOCK,EINTR,ENOSYS,EBADF,ENOTSOCK,EOPNOTSUPP,EFAULT
+from socket import inet_aton,inet_ntoa,error as socketerror
+from struct import pack,unpack_from,calcsize,error as structerror
+
+MSG_DONTWAIT = 0x40
+AF_INET = 2
+#接收数据包的最大长度，与gevent.server.DatagramServer保持一致
+RECV_MAX_LENGTH = 8192
+#sockaddr_in的地址族(本机字节序)，端口和地址之后的8字节填充
+_FAMILY = pack("=H",AF_INET)
+_ZERO = "\0"*8
+#iovec的打包格式(指针,长度)
+_IOVEC = "P" + {4:"I",8:"Q"}[ctypes.sizeof(ctypes.c_size_t)]
+#系统调用本身不可用的错误，遇到时改为循环收发，其他错误只与单个数据包有关
+FALLBACK_ERRORS = (ENOSYS,EBADF,ENOTSOCK,EOPNOTSUPP,EFAULT)
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base",ctypes.c_void_p),
+        ("iov_len",ctypes.c_size_t),
+    ]
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family",ctypes.c_ushort),
+        ("sin_port",ctypes.c_ubyte*2),
+        ("sin_addr",ctypes.c_ubyte*4),
+        ("sin_zero",ctypes.c_ubyte*8),
+    ]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name",ctypes.c_void_p),
+        ("msg_namelen",ctypes.c_uint32),
+        ("msg_iov",ctypes.POINTER(_iovec)),
+        ("msg_iovlen",ctypes.c_size_t),
+        ("msg_control",ctypes.c_void_p),
+        ("msg_controllen",ctypes.c_size_t),
+        ("msg_flags",ctypes.c_int),
+    ]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr",_msghdr),
+        ("msg_len",ctypes.c_uint),
+    ]
+
+
+def _load_libc():
+    """加载libc中的recvmmsg/sendmmsg
+    Returns:
+        libc: 加载成功
+        None: 当前平台不支持
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"),use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int,ctypes.POINTER(_mmsghdr),ctypes.c_uint,ctypes.c_int,ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int,ctypes.POINTER(_mmsghdr),ctypes.c_uint,ctypes.c_int]
+        return libc
+    except (OSError,AttributeError,TypeError):
+        return None
+
+_libc = _load_libc()
+
+
+class UDPBatch(object):
+    """UDP批量收发
+    Attributes:
+        mmsg: 是否使用recvmmsg/sendmmsg
+        size: 单次收发数据包的最大数量
+        dropped: 因为目标地址出错而丢弃的数据包数量(累计)
+        recv: 接收一批数据包
+        send: 发送一批数据包
+    """
+
+    def __init__(self,sock,size,mmsg = True):
+        """初始化收发缓冲区
+        Args:
+            sock: 非阻塞的UDP socket
+            size: 单次收发数据包的最大数量
+            mmsg: 是否尝试使用recvmmsg/sendmmsg
+        """
+        self._sock = sock
+        self._size = size
+        self._mmsg = bool(mmsg and _libc is not None)
+        self._dropped = 0
+        if self._mmsg:
+            self._init_buffers()
+
+    @property
+    def mmsg(self):
+        """是否使用recvmmsg/sendmmsg"""
+        return self._mmsg
+
+    @property
+    def size(self):
+        """单次收发数据包的最大数量"""
+        return self._size
+
+    @property
+    def dropped(self):
+        """因为目标地址出错而丢弃的数据包数量(累计)"""
+        return self._dropped
+
+    def _init_buffers(self):
+        """预先分配接收的缓冲区、地址和消息头，之后每次接收都复用，
+        接收后的消息头和地址一次性读出，再按偏移量解析，减少ctypes的属性访问
+        """
+        size = self._size
+        self._buffer = ctypes.create_string_buffer(RECV_MAX_LENGTH*size)
+        self._names = (_sockaddr_in*size)()
+        self._iovecs = (_iovec*size)()
+        self._rmsgs = (_mmsghdr*size)()
+        self._smsgs = (_mmsghdr*size)()
+        self._snames = (_sockaddr_in*size)()
+        self._siovecs = (_iovec*size)()
+        self._sbuffer = ctypes.create_string_buffer(RECV_MAX_LENGTH*size)
+        for i in xrange(size):
+            self._iovecs[i].iov_base = ctypes.addressof(self._buffer) + i*RECV_MAX_LENGTH
+            self._iovecs[i].iov_len = RECV_MAX_LENGTH
+            hdr = self._rmsgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._names[i])
+            hdr.msg_namelen = ctypes.sizeof(_sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+            hdr.msg_iovlen = 1
+            self._snames[i].sin_family = AF_INET
+            hdr = self._smsgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._snames[i])
+            hdr.msg_namelen = ctypes.sizeof(_sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(self._siovecs[i])
+            hdr.msg_iovlen = 1
+        #接收后内核会修改消息头，每次接收前用初始的消息头还原
+        self._rtemplate = ctypes.string_at(ctypes.addressof(self._rmsgs),ctypes.sizeof(self._rmsgs))
+        #一次解析所有消息头的长度和所有地址的格式
+        hsize,offset = ctypes.sizeof(_mmsghdr),_mmsghdr.msg_len.offset
+        self._lenfmt = "%dxI%dx"%(offset,hsize - offset - calcsize("=I"))
+        assert calcsize(_IOVEC) == ctypes.sizeof(_iovec)
+
+    def _fallback(self,err):
+        """recvmmsg/sendmmsg不可用(FALLBACK_ERRORS)，改为使用socket循环收发"""
+        logging.warn("recvmmsg/sendmmsg不可用(errno %d)，改为使用socket循环收发"%err)
+        self._mmsg = False
+
+    def recv(self):
+        """接收一批数据包，没有数据时立即返回
+        Returns:
+            [(data,(ip,port)),(data,(ip,port)),...]
+        """
+        if self._mmsg:
+            return self._recvmmsg()
+        return self._recvloop()
+
+    def send(self,packets):
+        """发送一批数据包，发送缓冲区已满或者遇到不是IPv4的地址时停止
+        Args:
+            packets: [(data,(ip,port)),(data,(ip,port)),...]
+        Returns:
+            已经发送的数据包数量，剩下的数据包需要调用者处理
+        """
+        if self._mmsg:
+            return self._sendmmsg(packets)
+        return self._sendloop(packets)
+
+    def _recvmmsg(self):
+        """通过recvmmsg接收一批数据包，所有消息头的长度和地址各用一次unpack解析"""
+        ctypes.memmove(self._rmsgs,self._rtemplate,len(self._rtemplate))
+        num = _libc.recvmmsg(self._sock.fileno(),self._rmsgs,self._size,MSG_DONTWAIT,None)
+        if num < 0:
+            err = ctypes.get_errno()
+            if err in FALLBACK_ERRORS:
+                self._fallback(err)
+                return self._recvloop()
+            #EAGAIN或者之前发送的数据包返回的ICMP错误(ECONNREFUSED等)，下次继续接收
+            return []
+        if num == 0:
+            return []
+        hdrs = ctypes.string_at(ctypes.addressof(self._rmsgs),ctypes.sizeof(_mmsghdr)*num)
+        names = ctypes.string_at(ctypes.addressof(self._names),ctypes.sizeof(_sockaddr_in)*num)
+        lengths = unpack_from("=" + self._lenfmt*num,hdrs)
+        addrs = unpack_from("!" + "2xH4s8x"*num,names)
+        base = ctypes.addressof(self._buffer)
+        return [
+            (ctypes.string_at(base+i*RECV_MAX_LENGTH,lengths[i]),(inet_ntoa(addrs[2*i+1]),addrs[2*i]))
+            for i in xrange(num)
+        ]
+
+    def _recvloop(self):
+        """通过非阻塞socket循环接收一批数据包"""
+        packets = []
+        for i in xrange(self._size):
+            try:
+                packets.append(self._sock.recvfrom(RECV_MAX_LENGTH))
+            except socketerror as e:
+                if e.args[0] not in (EAGAIN,EWOULDBLOCK,EINTR):
+                    logging.debug("接收数据包失败:%s"%str(e))
+                break
+        return packets
+
+    def _sendmmsg(self,packets):
+        """通过sendmmsg发送一批数据包，
+        地址、iovec和数据各自拼接后一次复制到预先分配的缓冲区，不需要逐个设置ctypes的属性
+        """
+        sent = 0
+        total = len(packets)
+        base = ctypes.addressof(self._sbuffer)
+        limit = len(self._sbuffer)
+        while sent < total:
+            names,iovecs,datas = [],[],[]
+            offset = 0
+            for data,addr in packets[sent:sent+self._size]:
+                length = len(data)
+                if offset + length > limit:
+                    break
+                try:
+                    names.append(_FAMILY + pack("!H",addr[1]) + inet_aton(addr[0]) + _ZERO)
+                except (socketerror,structerror,TypeError,ValueError,IndexError):
+                    break
+                iovecs.append(pack(_IOVEC,base + offset,length))
+                datas.append(data)
+                offset += length
+            num = len(names)
+            if num == 0:
+                return sent
+            ctypes.memmove(self._snames,"".join(names),ctypes.sizeof(_sockaddr_in)*num)
+            ctypes.memmove(self._siovecs,"".join(iovecs),ctypes.sizeof(_iovec)*num)
+            ctypes.memmove(self._sbuffer,"".join(datas),offset)
+            res = _libc.sendmmsg(self._sock.fileno(),self._smsgs,num,MSG_DONTWAIT)
+            if res < 0:
+                err = ctypes.get_errno()
+                if err in (EAGAIN,EWOULDBLOCK,EINTR):
+                    return sent
+                if err in FALLBACK_ERRORS:
+                    self._fallback(err)
+                    return sent + self._sendloop(packets[sent:])
+                #第一个数据包的目标地址出错，单独发送该数据包，失败时丢弃，继续发送之后的数据包
+                if not self._sendone(*packets[sent]):
+                    return sent
+                sent += 1
+                continue
+            #只发送了一部分时，下一次调用会返回剩下的第一个数据包的错误
+            sent += res
+        return sent
+
+    def _sendone(self,data,addr):
+        """通过sendto单独发送一个数据包，目标地址出错时丢弃
+        Returns:
+            True: 已经发送或者丢弃
+            False: 发送缓冲区已满
+        """
+        try:
+            self._sock.sendto(data,addr)
+        except socketerror as e:
+            if e.args[0] in (EAGAIN,EWOULDBLOCK):
+                return False
+            self._dropped += 1
+            logging.debug("发送数据包失败:%s %s"%(str(addr),str(e)))
+        return True
+
+    def _sendloop(self,packets):
+        """通过非阻塞socket循环发送一批数据包"""
+        sent = 0
+        for data,addr in packets:
+            try:
+                inet_aton(addr[0])
+            except (socketerror,TypeError,IndexError):
+                break
+            if not self._sendone(data,addr):
+                break
+            sent += 1
+        return sent
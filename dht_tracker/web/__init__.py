@@ -3,8 +3,12 @@ import tornado.ioloop
 from ._basehandle import BaseHandle
 from ._counthandle import CountHandle
 from ._taskhandle import TaskHandle
+from ._pacerhandle import PacerHandle
+from ._synchandle import SyncHandle
+from ._tablehandle import TableHandle
+from ._controlhandle import ControlHandle
 from ..config import WEBPORT
-approte = [(r"/count.*",CountHandle),(r"/task",TaskHandle),]
+approte = [(r"/count.*",CountHandle),(r"/task",TaskHandle),(r"/pacer",PacerHandle),(r"/sync",SyncHandle),(r"/table",TableHandle),(r"/control",ControlHandle),]
 application = tornado.web.Application(approte
 )  
 #----------------------------------------------------------------------
@@ -2,17 +2,48 @@
 #coding:utf-8
 import json
 import tornado.web
-from ..common import sync
+from tornado import gen
+from ..common import query,RPCError
+from ..config import CONTROL_BATCH_SIZE
 
 ########################################################################
 class BaseHandle(tornado.web.RequestHandler):
     """"""
-    sync = sync
+    query = query
     #----------------------------------------------------------------------
     def jsondumps(self,data):
         """"""
         return json.dumps(data)
-        
-        
-    
-    
\ No newline at end of file
+
+    @gen.coroutine
+    def call(self,kind,*args):
+        """向DHT进程查询(详见AsyncRPCClient)，在IOLoop中等待回复，查询失败时返回503及错误信息
+        Returns:
+            Future: 查询的结果
+        """
+        try:
+            result = yield self.query.call(kind,*args)
+        except RPCError as e:
+            raise tornado.web.HTTPError(503,str(e))
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def control(self,commands):
+        """向DHT进程发送任务控制命令，每次最多发送CONTROL_BATCH_SIZE个
+        Args:
+            commands: [(操作,(任务类型,任务唯一标识id)),...]
+        Returns:
+            Future: [结果,...] 每个命令的结果(详见BaseDHT.control)
+        """
+        results = []
+        for start in xrange(0,len(commands),CONTROL_BATCH_SIZE):
+            results += yield self.call("control",commands[start:start+CONTROL_BATCH_SIZE])
+        raise gen.Return(results)
+
+    def write_error(self,status_code,**kwargs):
+        """查询失败时以json返回错误信息"""
+        error = kwargs.get("exc_info",(None,None))[1]
+        if isinstance(error,tornado.web.HTTPError) and error.log_message:
+            self.finish(self.jsondumps({"RPCError":error.log_message}))
+            return
+        super(BaseHandle,self).write_error(status_code,**kwargs)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+#coding:utf-8
+import json
+from tornado import gen
+from . import BaseHandle
+
+########################################################################
+class ControlHandle(BaseHandle):
+    """批量的任务控制命令
+    请求体为json: [[操作,任务类型,任务唯一标识id(hex)],...]，操作为push、start、stop、remove，
+    按顺序返回每个命令的结果(ok、exists、missing、forbidden、invalid)
+    """
+    #----------------------------------------------------------------------
+    @gen.coroutine
+    def post(self):
+        """"""
+        try:
+            commands = [
+                (str(action),(str(tubes),str(taskid).decode("hex")))
+                for action,tubes,taskid in json.loads(self.request.body)
+            ]
+        except (TypeError,ValueError):
+            self.finish(self.jsondumps(
+                {
+                    "InputError":"the body must be json -> [[action,tubes,taskid],...]"
+                 }))
+            return
+        results = yield self.control(commands)
+        self.finish(self.jsondumps(
+            {
+                "results":results
+            }))
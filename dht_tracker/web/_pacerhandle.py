@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+#coding:utf-8
+from tornado import gen
+from . import BaseHandle
+
+########################################################################
+class PacerHandle(BaseHandle):
+    """发送节拍器的状态，目标与实际的每秒发送次数"""
+    #----------------------------------------------------------------------
+    @gen.coroutine
+    def get(self):
+        """"""
+        result = yield self.call("pacer")
+        self.finish(self.jsondumps(result))
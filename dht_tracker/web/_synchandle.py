@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+#coding:utf-8
+from tornado import gen
+from . import BaseHandle
+
+########################################################################
+class SyncHandle(BaseHandle):
+    """DHT进程回答查询的开销(详见RPCServer.status)"""
+    #----------------------------------------------------------------------
+    @gen.coroutine
+    def get(self):
+        """"""
+        result = yield self.call("sync")
+        self.finish(self.jsondumps(result))
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+#coding:utf-8
+from copy import deepcopy
+from tornado import gen
+from . import BaseHandle
+
+########################################################################
+class TableHandle(BaseHandle):
+    """路由表的概况，指定bucket时返回该KBucket桶内节点的详细信息"""
+    #----------------------------------------------------------------------
+    def loadbucket(self,status):
+        """"""
+        res = deepcopy(status)
+        res["items"] = [(i[0].encode("hex"),i[1],i[2]) for i in status["items"]]
+        for node in res["detail"]:
+            node["body"] = (node["body"][0].encode("hex"),node["body"][1])
+        return res
+    @gen.coroutine
+    def get(self):
+        """"""
+        bucket = self.request.arguments.get("bucket")
+        if not bucket:
+            result = yield self.call("table")
+            self.finish(self.jsondumps(result))
+            return
+        try:
+            index = int(bucket[0])
+        except ValueError:
+            self.finish(self.jsondumps(
+                {
+                    "ValueError":"the bucket is must be type -> int"
+                 }))
+            return
+        status = yield self.call("table",index)
+        if status is None:
+            self.finish(self.jsondumps(
+                {
+                    "IndexError":"the bucket [%d] is not in the table"%index
+                }
+            ))
+            return
+        self.finish(self.jsondumps(self.loadbucket(status)))
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 #coding:utf-8
 from copy import deepcopy
+from tornado import gen
 from . import BaseHandle
-from ..common import control_in
 
 class TaskHandle(BaseHandle):
     """"""
@@ -26,21 +26,22 @@ class TaskHandle(BaseHandle):
         res = deepcopy(status)
         res["detail"] = [(i[0],self.loadtube(i[1])) for i in status["detail"]]
         return res
+    @gen.coroutine
     def get(self):
         """"""
         tubes = self.request.arguments.get("tubes")
         taskid = self.request.arguments.get("taskid")
-        taskline = self.sync["taskline"]
         if not tubes:
-            self.finish(self.jsondumps(self.loadline(taskline.status)))
+            status = yield self.call("task")
+            self.finish(self.jsondumps(self.loadline(status)))
             return
         tubes = tubes[0]      
-        task_tube = taskline[tubes]
         if not taskid:
-            self.finish(self.jsondumps(self.loadtube(task_tube.status)))
+            status = yield self.call("task",tubes)
+            self.finish(self.jsondumps(self.loadtube(status)))
             return
         taskid = taskid[0]      
-        task = task_tube[taskid.decode("hex")]
+        task = yield self.call("task",tubes,taskid.decode("hex"))
         if task is None:
             self.finish(self.jsondumps(
                 {
@@ -48,11 +49,37 @@ class TaskHandle(BaseHandle):
                 }
             ))
             return
-        self.finish(self.jsondumps(self.loadtask(task.status)))
+        self.finish(self.jsondumps(self.loadtask(task)))
 
     #----------------------------------------------------------------------
+    @gen.coroutine
+    def _control(self,action,tubes,taskids):
+        """对tubes管道内的多个任务执行控制命令，返回每个任务的结果"""
+        try:
+            ids = [taskid.decode("hex") for taskid in taskids]
+        except TypeError:
+            self.finish(self.jsondumps(
+                {
+                    "InputError":"the taskid must be hex!"
+                 }))
+            return
+        results = yield self.control([(action,(tubes,id)) for id in ids])
+        if len(taskids) == 1 and results[0] == "missing":
+            self.finish(self.jsondumps(
+                {
+                    "KeyError":"the taskid [%s] is not in the tubes %s"%(taskids[0],tubes)
+                 }
+            ))
+            return
+        self.finish(self.jsondumps(
+            {
+                "post":"OK",
+                "results":zip(taskids,results)
+            }))
+    #----------------------------------------------------------------------
+    @gen.coroutine
     def post(self):
-        """"""
+        """添加任务，taskid可以有多个"""
         tubes = self.request.arguments.get("tubes")
         taskid = self.request.arguments.get("taskid")
         if not (tubes and taskid):
@@ -62,17 +89,11 @@ class TaskHandle(BaseHandle):
                  }
             ))
             return
-        tubes = tubes[0]
-        taskid = taskid[0]        
-        control_in.send(("push",(tubes,taskid.decode("hex"))))
-        self.finish(self.jsondumps(
-            {
-                "post":"OK"
-            }
-        ))
+        yield self._control("push",tubes[0],taskid)
     #----------------------------------------------------------------------
+    @gen.coroutine
     def put(self):
-        """"""
+        """启动或者暂停任务，taskid可以有多个"""
         tubes = self.request.arguments.get("tubes")
         taskid = self.request.arguments.get("taskid")
         started = self.request.arguments.get("started")
@@ -90,27 +111,13 @@ class TaskHandle(BaseHandle):
                     "ValueError":"the started is must be type -> int"
                  }))
             return  
-        tubes = tubes[0]
-        taskid = taskid[0]
-        taskline = self.sync["taskline"]
-        task = taskline[tubes][taskid.decode("hex")]
-        if task is None:
-            self.finish(self.jsondumps(
-                {
-                    "KeyError":"the taskid [%s] is not in the tubes %s"%(taskid,tubes)
-                 }
-            ))
-            return
-        control_in.send(("start" if started else "stop",(tubes,taskid.decode("hex"))))
-        self.finish(self.jsondumps(
-            {
-                "post":"OK"
-            }))
+        yield self._control("start" if started else "stop",tubes[0],taskid)
         
         
     #----------------------------------------------------------------------
+    @gen.coroutine
     def delete(self):
-        """"""
+        """移除任务，taskid可以有多个"""
         tubes = self.request.arguments.get("tubes")
         taskid = self.request.arguments.get("taskid")
         if not (tubes and taskid):
@@ -119,22 +126,4 @@ class TaskHandle(BaseHandle):
                     "InputError":"you must input tubes and taskid!"
                  }))
             return  
-        tubes = tubes[0]
-        taskid = taskid[0]        
-        taskline = self.sync["taskline"]
-        task = taskline[tubes][taskid.decode("hex")]
-        if task is None:
-            self.finish(self.jsondumps(
-                {
-                    "KeyError":"the taskid [%s] is not in the tubes %s"%(taskid,tubes)
-                 }
-            ))
-            return
-        control_in.send(("remove",(tubes,taskid.decode("hex"))))
-        self.finish(self.jsondumps(
-            {
-                "post":"OK"
-            }))
-        
-
-    
+        yield self._control("remove",tubes[0],taskid)
@@ -4,7 +4,7 @@ import logging
 from multiprocessing import Process
 from dht_tracker.web import web_start
 from dht_tracker.dht import BaseDHT,KRPC,KTable,NormalDHT,DHTSpider
-from dht_tracker.common import netcount,sync
+from dht_tracker.common import netcount
 logging.basicConfig(level=logging.DEBUG,
                     format='[%(asctime)s][%(filename)s][%(funcName)s]LINE %(lineno)-4d : %(levelname)-8s %(message)s'
                     ) 